@@ -0,0 +1,251 @@
+"""
+Benchmark of HttpFetcher.fetch against a local HTTP server.
+
+The files are served by nidata's mirror server, throttled to simulate a
+remote host: per-request latency, per-connection bandwidth, optional range
+support and injected failures (connections cut halfway through a file).
+Scenarios:
+
+- many_small: many small files, fetched sequentially and with n_jobs
+  threads;
+- few_huge: a few large files;
+- archive_heavy: many zip archives to download and extract;
+- resume: a large file whose first transfer is cut halfway; it is fetched
+  again until complete, and the bytes served are counted (with range
+  support, the second transfer only sends the missing half).
+
+Results are printed and, with --output, written as JSON for regression
+tracking.
+
+Usage: python benchmarks/bench_fetchers.py [--scale 1] [--output out.json]
+"""
+from __future__ import division, print_function
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import zipfile
+
+from nidata.core.fetchers import HttpFetcher
+from nidata.core.fetchers.mirror_server import (MirrorRequestHandler,
+                                                MirrorServer)
+
+MB = 2 ** 20
+
+
+class ThrottledRequestHandler(MirrorRequestHandler):
+    """Mirror handler with latency, bandwidth limit and injected errors
+    (see ThrottledServer)."""
+    def send_head(self):
+        time.sleep(self.server.latency)
+        if not self.server.ranges and 'Range' in self.headers:
+            del self.headers['Range']
+        f = MirrorRequestHandler.send_head(self)
+        self._cut_at = None
+        if f is not None and self.server.should_cut(self.path):
+            self._cut_at = self._remaining // 2
+        return f
+
+    def write_chunk(self, outputfile, chunk):
+        if self._cut_at is not None:
+            if self._cut_at <= 0:
+                raise IOError('injected error')  # drops the connection
+            chunk = chunk[:self._cut_at]
+            self._cut_at -= len(chunk)
+        if self.server.bandwidth:
+            time.sleep(len(chunk) / float(self.server.bandwidth))
+        outputfile.write(chunk)
+        self.server.count(len(chunk))
+
+    def copyfile(self, source, outputfile):
+        try:
+            MirrorRequestHandler.copyfile(self, source, outputfile)
+        except IOError:
+            self.close_connection = True
+
+
+class ThrottledServer(MirrorServer):
+    """Mirror server simulating a remote host.
+
+    latency: seconds before each response; bandwidth: bytes per second per
+    connection (0 for no limit); ranges: whether Range requests are
+    honored; error_rate: probability that a transfer is cut halfway;
+    cut_once: paths whose first transfer is cut halfway.
+    """
+    def __init__(self, root, latency=0., bandwidth=0, ranges=True,
+                 error_rate=0., cut_once=(), seed=0):
+        MirrorServer.__init__(self, root, host='127.0.0.1', port=0,
+                              handler_class=ThrottledRequestHandler,
+                              verbose=0)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.ranges = ranges
+        self.error_rate = error_rate
+        self.cut_once = set(cut_once)
+        self.bytes_sent = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def should_cut(self, path):
+        with self._lock:
+            if path in self.cut_once:
+                self.cut_once.remove(path)
+                return True
+            return self._random.random() < self.error_rate
+
+    def count(self, n_bytes):
+        with self._lock:
+            self.bytes_sent += n_bytes
+
+
+def _write_file(filename, size, rng):
+    # Half random, half zeros: archives have some compression work to do.
+    with open(filename, 'wb') as f:
+        f.write(bytearray(rng.getrandbits(8) for _ in range(size // 2)))
+        f.write(b'\0' * (size - size // 2))
+
+
+def make_files(root, scale=1.):
+    """Create the served files; return {scenario: (paths, opts)}."""
+    rng = random.Random(0)
+    scenarios = {}
+
+    n_small = max(int(500 * scale), 1)
+    os.makedirs(os.path.join(root, 'small'))
+    for i in range(n_small):
+        _write_file(os.path.join(root, 'small', 'f%05d.bin' % i), 16 * 1024,
+                    rng)
+    small = ['small/f%05d.bin' % i for i in range(n_small)]
+    scenarios['many_small'] = (small, {})
+
+    os.makedirs(os.path.join(root, 'huge'))
+    huge = []
+    for i in range(2):
+        # Random data is slow to generate in pure python; repeat a block.
+        filename = os.path.join(root, 'huge', 'f%d.bin' % i)
+        _write_file(filename, MB, rng)
+        with open(filename, 'rb') as f:
+            block = f.read()
+        with open(filename, 'wb') as f:
+            for _ in range(max(int(64 * scale), 1)):
+                f.write(block)
+        huge.append('huge/f%d.bin' % i)
+    scenarios['few_huge'] = (huge, {})
+
+    os.makedirs(os.path.join(root, 'archives'))
+    archives = []
+    member = os.path.join(root, 'member.bin')
+    _write_file(member, 64 * 1024, rng)
+    for i in range(max(int(20 * scale), 1)):
+        with zipfile.ZipFile(os.path.join(root, 'archives', 'a%03d.zip' % i),
+                             'w', zipfile.ZIP_DEFLATED) as z:
+            for j in range(100):
+                z.write(member, 'a%03d/m%03d.bin' % (i, j))
+        archives.append('archives/a%03d.zip' % i)
+    os.remove(member)
+    scenarios['archive_heavy'] = (archives, {'uncompress': True})
+
+    scenarios['resume'] = (huge[:1], {})
+    return scenarios
+
+
+def run_scenario(server, paths, opts, n_jobs=1, max_attempts=5):
+    data_dir = tempfile.mkdtemp()
+    try:
+        files = []
+        for path in paths:
+            if opts.get('uncompress'):
+                # The first member of each archive.
+                target = os.path.join(
+                    os.path.splitext(os.path.basename(path))[0], 'm000.bin')
+            else:
+                target = os.path.basename(path)
+            files.append((target, '%s/%s' % (server.url, path), dict(opts)))
+        fetcher = HttpFetcher(data_dir=data_dir)
+        bytes_sent = server.bytes_sent
+        attempts = 0
+        t0 = time.time()
+        while True:
+            attempts += 1
+            try:
+                fetcher.fetch(files, verbose=0, n_jobs=n_jobs)
+                break
+            except Exception:
+                if attempts == max_attempts:
+                    raise
+        elapsed = time.time() - t0
+        bytes_sent = server.bytes_sent - bytes_sent
+        return {'seconds': elapsed, 'attempts': attempts,
+                'files': len(files), 'bytes_sent': bytes_sent,
+                'MB/s': bytes_sent / MB / elapsed}
+    finally:
+        shutil.rmtree(data_dir)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scale', type=float, default=1.,
+                        help='multiplies the number and size of files')
+    parser.add_argument('--latency', type=float, default=0.01,
+                        help='seconds before each response')
+    parser.add_argument('--bandwidth', type=float, default=0.,
+                        help='MB/s per connection (0: no limit)')
+    parser.add_argument('--no-ranges', action='store_true',
+                        help='ignore Range requests')
+    parser.add_argument('--error-rate', type=float, default=0.,
+                        help='probability that a transfer is cut')
+    parser.add_argument('--n_jobs', type=int, default=8)
+    parser.add_argument('--scenarios', nargs='+', default=None)
+    parser.add_argument('--output', default=None,
+                        help='JSON file where results are written')
+    args = parser.parse_args(args)
+
+    root = tempfile.mkdtemp()
+    try:
+        scenarios = make_files(root, scale=args.scale)
+        server = ThrottledServer(root, latency=args.latency,
+                                 bandwidth=int(args.bandwidth * MB),
+                                 ranges=not args.no_ranges,
+                                 error_rate=args.error_rate)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+        results = {}
+        for name in args.scenarios or sorted(scenarios):
+            paths, opts = scenarios[name]
+            runs = [('%s' % name, 1)]
+            if name in ('many_small', 'archive_heavy') and args.n_jobs > 1:
+                runs.append(('%s_n_jobs_%d' % (name, args.n_jobs),
+                             args.n_jobs))
+            for run_name, n_jobs in runs:
+                if name == 'resume':
+                    server.cut_once.add('/' + paths[0])
+                results[run_name] = result = run_scenario(
+                    server, paths, opts, n_jobs=n_jobs)
+                print('%-28s %8.2fs %8.1f MB/s  %d attempt(s), %.1f MB sent'
+                      % (run_name, result['seconds'], result['MB/s'],
+                         result['attempts'], result['bytes_sent'] / MB))
+        server.shutdown()
+        server.server_close()
+    finally:
+        shutil.rmtree(root)
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'time': time.time(),
+                       'python': sys.version.split()[0],
+                       'platform': platform.platform(),
+                       'options': vars(args),
+                       'results': results}, f, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark of image loading through check_niimg(ensure_ndim=3).
+
+Many small single-scan 4D images are written to a temporary directory and
+loaded (and squeezed to 3D) through check_niimg, which reads their data
+with _safe_get_data. The previous implementation, which deep-copied the
+image and ran a full garbage collection on every call, is timed as a
+reference.
+
+Usage: python benchmarks/bench_safe_get_data.py [n_images]
+"""
+import copy
+import gc
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import nibabel
+import numpy as np
+
+from nidata.core._utils import niimg
+
+
+def _legacy_safe_get_data(img):
+    if hasattr(img, '_data_cache') and img._data_cache is None:
+        img = copy.deepcopy(img)
+    gc.collect()
+    return img.get_data()
+
+
+def make_images(dirname, n_images, shape=(16, 16, 16, 1)):
+    rng = np.random.RandomState(0)
+    filenames = []
+    for i in range(n_images):
+        filename = os.path.join(dirname, 'img%05d.nii' % i)
+        data = rng.rand(*shape).astype(np.float32)
+        nibabel.save(nibabel.Nifti1Image(data, np.eye(4)), filename)
+        filenames.append(filename)
+    return filenames
+
+
+def time_loading(filenames):
+    # A large heap of live objects, as in long-running workers, makes
+    # every garbage collection expensive.
+    heap = [dict(i=i) for i in range(10 ** 6)]
+    t0 = time.time()
+    for filename in filenames:
+        niimg.check_niimg(filename, ensure_ndim=3).get_data()
+    elapsed = time.time() - t0
+    del heap
+    return elapsed
+
+
+def main(n_images=10000):
+    dirname = tempfile.mkdtemp()
+    try:
+        filenames = make_images(dirname, n_images)
+        elapsed = time_loading(filenames)
+        print('_safe_get_data:        %.2fs (%.0f images/s)'
+              % (elapsed, n_images / elapsed))
+
+        new_safe_get_data = niimg._safe_get_data
+        niimg._safe_get_data = _legacy_safe_get_data
+        try:
+            elapsed = time_loading(filenames)
+        finally:
+            niimg._safe_get_data = new_safe_get_data
+        print('legacy _safe_get_data: %.2fs (%.0f images/s)'
+              % (elapsed, n_images / elapsed))
+    finally:
+        shutil.rmtree(dirname)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:]])
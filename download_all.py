@@ -1,29 +1,217 @@
-import nidata
-
-data_categories = filter(lambda mod: not mod.startswith('_') and mod != 'core',
-                         dir(nidata))
-for cat in data_categories:
-    exec('objs = dir(nidata.%s)' % cat)
-    objs = filter(lambda obj: obj.endswith('Dataset') and obj not in ['Dataset', 'HttpDataset'],
-                  objs)
-    for obj in objs:
-        if "Brainomics" in obj or 'Hcp' in obj:
-            continue
-        print(cat, obj)
-        exec('from nidata.%s import %s' % (cat, obj))
-        exec('klass = %s' % obj)
-        exec('dset = %s().fetch()' % obj)
-
-        mod_path = klass.__module__.rsplit('.', 1)[0]
-        exec('import %s as mod' % mod_path)
-
-        if obj not in ["OasisVbmDataset", "HaxbyEtal2011Dataset"]:
-            try:
-                exec('import %s.example1' % mod_path)
-            except ImportError as ie:
-                if 'example1' in ie.message:
-                    pass
-                else:
-                    raise ie
-            else:
-                print("cool!")
+"""
+Download (or bring up to date) all nidata datasets, e.g. to keep a shared
+mirror current:
+
+    python download_all.py --n_jobs 8
+    python download_all.py --status
+
+Datasets are fetched concurrently; the files they request are queued to a
+single pool of download workers, so that at most n_jobs downloads run at
+once across all datasets. The script can be killed and run again: it then
+resumes partial downloads and skips completed files, which fetch_files finds
+on disk. The state of every file is recorded in a sqlite database, which is
+only used for reporting (--status). Examples are never run.
+
+Archives are kept next to their extracted files, as a mirror serving the
+data directory (see mirror_server) must publish them too; use
+--delete_archives to remove them.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.pool import ThreadPool
+
+# Some fetch methods plot their results; never open windows.
+os.environ.setdefault('MPLBACKEND', 'Agg')
+
+from nidata.core.datasets import get_dataset_classes
+from nidata.core._utils.profiling import propagate
+from nidata.core.fetchers import HttpFetcher
+from nidata.core.fetchers.http_fetcher import fetch_files
+
+# Datasets requiring credentials, or too large for a default sync.
+EXCLUDED = ['BrainomicsDataset', 'HcpDataset']
+
+
+class StatusDB(object):
+    """Per-file and per-dataset download states, in a sqlite database.
+
+    The states are only reported: what is left to download is found by
+    fetch_files from the files on disk."""
+    def __init__(self, filename):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        with self._lock:
+            with self._conn:
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS files (dataset TEXT, '
+                    'target TEXT, url TEXT, state TEXT, error TEXT, '
+                    'updated REAL, PRIMARY KEY (dataset, target))')
+                self._conn.execute(
+                    'CREATE TABLE IF NOT EXISTS datasets (name TEXT PRIMARY '
+                    'KEY, state TEXT, error TEXT, updated REAL)')
+                # Work interrupted by a kill is queued again.
+                self._conn.execute("UPDATE files SET state = 'queued' "
+                                   "WHERE state = 'running'")
+
+    def _execute(self, query, args=()):
+        with self._lock:
+            with self._conn:
+                return self._conn.execute(query, args).fetchall()
+
+    def set_file(self, dataset, target, url, state, error=None):
+        self._execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)',
+                      (dataset, target, url, state, error, time.time()))
+
+    def set_dataset(self, name, state, error=None):
+        self._execute('INSERT OR REPLACE INTO datasets VALUES (?, ?, ?, ?)',
+                      (name, state, error, time.time()))
+
+    def summary(self):
+        """{dataset: (dataset state, {file state: count})}"""
+        summary = dict((name, (state, {})) for name, state in self._execute(
+            'SELECT name, state FROM datasets'))
+        for name, state, count in self._execute(
+                'SELECT dataset, state, COUNT(*) FROM files '
+                'GROUP BY dataset, state'):
+            summary.setdefault(name, (None, {}))[1][state] = count
+        return summary
+
+
+class QueueFetcher(HttpFetcher):
+    """HttpFetcher sending each requested file to a shared worker pool
+    (and waiting for them, as datasets use the files they fetch).
+
+    Archives are kept unless keep_archives is False, whatever the dataset
+    requests."""
+    def __init__(self, fetcher, pool, db, dataset_name, keep_archives=True):
+        super(QueueFetcher, self).__init__(data_dir=fetcher.data_dir,
+                                           username=fetcher.username,
+                                           passwd=fetcher.passwd)
+        self.pool = pool
+        self.db = db
+        self.dataset_name = dataset_name
+        self.keep_archives = keep_archives
+
+    def _fetch_entry(self, entry, **kwargs):
+        file_, url, _ = entry
+        self.db.set_file(self.dataset_name, file_, url, 'running')
+        try:
+            target_file = fetch_files(self.data_dir, [entry], **kwargs)[0]
+        except Exception:
+            self.db.set_file(self.dataset_name, file_, url, 'failed',
+                             traceback.format_exc())
+            raise
+        self.db.set_file(self.dataset_name, file_, url, 'done')
+        return target_file
+
+    def fetch(self, files, force=False, resume=True, check=False, verbose=1,
+              delete_archive=True, n_jobs=1):
+        delete_archive = delete_archive and not self.keep_archives
+        results = []
+        for entry in self.prepare_files(files):
+            self.db.set_file(self.dataset_name, entry[0], entry[1], 'queued')
+            # The files are reported with the dataset that requested them.
+            results.append(self.pool.apply_async(
+                propagate(self._fetch_entry), (entry,),
+                dict(resume=resume, force=force, verbose=verbose,
+                     delete_archive=delete_archive)))
+        return [result.get() for result in results]
+
+
+def sync_dataset(name, klass, pool, db, keep_archives=True, verbose=1):
+    """Fetch a dataset (with its default arguments) through pool."""
+    db.set_dataset(name, 'running')
+    try:
+        dataset = klass()
+        if isinstance(dataset.fetcher, HttpFetcher):
+            dataset.fetcher = QueueFetcher(dataset.fetcher, pool, db, name,
+                                           keep_archives=keep_archives)
+        dataset.fetch()
+    except Exception:
+        error = traceback.format_exc()
+        db.set_dataset(name, 'failed', error)
+        if verbose > 0:
+            print('%s failed:\n%s' % (name, error))
+        return False
+    db.set_dataset(name, 'done')
+    if verbose > 0:
+        print('%s is up to date.' % name)
+    return True
+
+
+def print_summary(db):
+    for name, (state, files) in sorted(db.summary().items()):
+        counts = ', '.join('%d %s' % (count, file_state)
+                           for file_state, count in sorted(files.items()))
+        print('%-30s %-8s %s' % (name, state or '-', counts))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Download all nidata datasets.')
+    parser.add_argument('--datasets', nargs='+', default=None,
+                        help='dataset classes to fetch (default: all)')
+    parser.add_argument('--exclude', nargs='+', default=EXCLUDED,
+                        help='dataset classes to skip, unless listed '
+                             'in --datasets')
+    parser.add_argument('--n_jobs', type=int, default=4,
+                        help='number of concurrent downloads')
+    parser.add_argument('--n_datasets', type=int, default=4,
+                        help='number of datasets fetched concurrently')
+    parser.add_argument('--db', default=None,
+                        help='status database (default: '
+                             'download_all.sqlite in NIDATA_PATH)')
+    parser.add_argument('--delete_archives', dest='keep_archives',
+                        action='store_false',
+                        help='remove archives once extracted (by default, '
+                             'they are kept for mirrors)')
+    parser.add_argument('--status', action='store_true',
+                        help='print the recorded states and exit')
+    parser.add_argument('--verbose', type=int, default=1)
+    args = parser.parse_args(args)
+
+    db_file = args.db
+    if db_file is None:
+        data_path = (os.environ.get('NIDATA_PATH', '').split(':')[0] or
+                     os.path.expanduser('~/nidata_path'))
+        if not os.path.exists(data_path):
+            os.makedirs(data_path)
+        db_file = os.path.join(data_path, 'download_all.sqlite')
+    db = StatusDB(db_file)
+    if args.status:
+        print_summary(db)
+        return 0
+
+    classes = get_dataset_classes()
+    names = sorted(args.datasets or classes)
+    unknown = set(names) - set(classes)
+    if unknown:
+        parser.error('unknown datasets: %s' % ', '.join(sorted(unknown)))
+    if args.datasets is None:
+        names = [name for name in names if name not in args.exclude]
+
+    file_pool = ThreadPool(args.n_jobs)
+    dataset_pool = ThreadPool(args.n_datasets)
+    try:
+        results = [dataset_pool.apply_async(
+            sync_dataset, (name, classes[name], file_pool, db,
+                           args.keep_archives, args.verbose))
+            for name in names]
+        ok = all([result.get() for result in results])
+    finally:
+        dataset_pool.terminate()
+        file_pool.terminate()
+    if args.verbose > 0:
+        print_summary(db)
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,13 +5,53 @@ Utilities to download anatomical MRI datasets
 # Author: Alexandre Abraham, Philippe Gervais
 # License: simplified BSD
 
+import glob
+import hashlib
+import json
 import os
+import warnings
 
+import nibabel
 import numpy as np
 from sklearn.datasets.base import Bunch
+from sklearn.externals.joblib import Parallel, delayed
 
 from ...core.datasets import HttpDataset
 from ...core.fetchers import (format_time, md5_sum_file)
+from ...core._utils.fileio import FileLock, atomic_filename
+from ...core._utils.niimg import _safe_get_data, check_fovs, load_niimg
+
+
+def _mask_digest(mask, affine):
+    """md5 of a boolean mask and of its affine."""
+    m = hashlib.md5()
+    m.update(str(mask.shape).encode('utf-8'))
+    m.update(np.asarray(affine, dtype=np.float64).tobytes())
+    m.update(np.packbits(mask.ravel()).tobytes())
+    return m.hexdigest()
+
+
+def _subject_id(path):
+    # e.g. 'OAS1_0001_MR1', the folder of the map.
+    return os.path.basename(os.path.dirname(path))
+
+
+def _fill_features(features, index, filename, mask):
+    """Write the masked voxels of an image in a row of features."""
+    img = nibabel.load(filename)
+    features[index] = _safe_get_data(img).reshape(mask.shape)[mask]
+
+
+def _read_feature_entries(pattern):
+    """{n_subjects: index} of the feature matrices matching pattern."""
+    entries = {}
+    for index_file in glob.glob(pattern + '.json'):
+        with open(index_file) as fp:
+            index = json.load(fp)
+        index['feature_file'] = index_file[:-len('.json')] + '.npy'
+        if os.path.exists(index['feature_file']):
+            entries[len(index['subject_ids'])] = index
+    return entries
 
 
 class OasisVbmDataset(HttpDataset):
@@ -222,6 +262,152 @@ class OasisVbmDataset(HttpDataset):
             ext_vars=csv_data,
             data_usage_agreement=data_usage_agreement)
 
+    def get_features(self, n_subjects=None, dartel_version=True,
+                     mask_img=None, tissue='gray', rebuild=False, n_jobs=1,
+                     url=None, resume=True, verbose=1):
+        """Masked subjects x voxels matrix of the gray (or white) matter maps.
+
+        The matrix is built once and stored, with its mask and the ids of
+        its subjects, in the 'features' folder of the dataset directory. It
+        is keyed by the normalization, the mask and the number of subjects:
+        later calls memory-map it, a matrix of more subjects also serves
+        smaller requests, and a request for more subjects only loads the
+        maps of the additional subjects. Stored matrices are never removed,
+        as other processes may be reading them; delete the 'features'
+        folder to reclaim the space.
+
+        Parameters
+        ----------
+        n_subjects, dartel_version, url, resume, verbose:
+            See fetch.
+
+        mask_img: Niimg-like object, optional
+            Voxels to keep (non-zero values). It must have the shape and
+            affine of the maps. If None, all voxels are kept.
+
+        tissue: 'gray' or 'white', optional
+            Maps to load.
+
+        rebuild: bool, optional
+            If True, the matrix is built again even if it is stored.
+
+        n_jobs: int, optional
+            Number of threads loading the maps.
+
+        Returns
+        -------
+        data: Bunch
+            Dictionary-like object, the interest attributes are :
+            'features': np.memmap, shape (n_subjects, n_voxels)
+                float32 values of the masked voxels, read-only
+            'mask_img': string
+                Path to the mask (NIfTI), e.g. to unmask results
+            'subject_ids': string list
+                Subject of each row
+            'ext_vars': np.recarray
+                See fetch
+            'feature_file': string
+                Path to the .npy file holding the matrix
+        """
+        if tissue not in ('gray', 'white'):
+            raise ValueError("tissue must be 'gray' or 'white', not %r"
+                             % tissue)
+        dataset = self.fetch(n_subjects=n_subjects,
+                             dartel_version=dartel_version, url=url,
+                             resume=resume, verbose=verbose)
+        maps = dataset['%s_matter_maps' % tissue]
+        subject_ids = [_subject_id(path) for path in maps]
+
+        if mask_img is None:
+            img = nibabel.load(maps[0])
+            mask = np.ones(img.shape[:3], dtype=bool)
+            affine = img.get_affine()
+        else:
+            mask_img = load_niimg(mask_img)
+            mask = _safe_get_data(mask_img) != 0
+            affine = mask_img.get_affine()
+        digest = _mask_digest(mask, affine)
+
+        feature_dir = os.path.join(self.data_dir, 'features')
+        if not os.path.exists(feature_dir):
+            os.makedirs(feature_dir)
+        mask_file = os.path.join(feature_dir, 'mask-%s.nii' % digest)
+        if not os.path.exists(mask_file):
+            with atomic_filename(mask_file) as tmp_file:
+                nibabel.save(nibabel.Nifti1Image(mask.astype(np.uint8),
+                                                 affine), tmp_file)
+
+        prefix = os.path.join(feature_dir, '%s-%s-%s' % (
+            tissue, 'dartel' if dartel_version else 'spm8', digest))
+        # Processes sharing the dataset build each matrix once.
+        with FileLock(prefix + '.lock', stale_age=600):
+            entries = _read_feature_entries(prefix + '-*')
+            # Subjects are always taken in the same order: a matrix of n
+            # subjects starts with the rows of any smaller one.
+            entries = dict((n, index) for n, index in entries.items()
+                           if index['subject_ids'] == subject_ids[:n] or
+                           index['subject_ids'][:len(maps)] == subject_ids)
+            larger = [n for n in entries if n >= len(maps)]
+            if larger and not rebuild:
+                index = entries[min(larger)]
+            else:
+                smaller = [n for n in entries if n < len(maps)]
+                start = max(smaller) if smaller and not rebuild else 0
+                # Headers only: fail before loading any map.
+                fovs = check_fovs(maps[start:], target_affine=affine,
+                                  target_shape=mask.shape)
+                if len(fovs['indices']):
+                    raise ValueError(
+                        '%d maps do not have the shape and affine of the '
+                        'mask, e.g. %s' % (len(fovs['indices']),
+                                           maps[start + fovs['indices'][0]]))
+                index = self._build_features(
+                    prefix, maps, subject_ids, mask,
+                    entries[start] if start else None, n_jobs=n_jobs,
+                    verbose=verbose)
+                # Smaller matrices are kept: other processes may have them
+                # memory-mapped.
+
+        features = np.load(index['feature_file'], mmap_mode='r')
+        return Bunch(features=features[:len(maps)],
+                     mask_img=mask_file,
+                     subject_ids=subject_ids,
+                     ext_vars=dataset.ext_vars,
+                     feature_file=index['feature_file'])
+
+    def _build_features(self, prefix, maps, subject_ids, mask,
+                        previous=None, n_jobs=1, verbose=1):
+        """Write the feature matrix of maps, reusing the rows of the
+        previous index; return the index of the new matrix."""
+        start = len(previous['subject_ids']) if previous else 0
+        if verbose > 0:
+            print('Building the feature matrix of %d subjects (%d loaded)'
+                  % (len(maps), len(maps) - start))
+        feature_file = '%s-%d.npy' % (prefix, len(maps))
+        with atomic_filename(feature_file) as tmp_file:
+            features = np.lib.format.open_memmap(
+                tmp_file, mode='w+', dtype=np.float32,
+                shape=(len(maps), int(mask.sum())))
+            if previous:
+                features[:start] = np.load(previous['feature_file'],
+                                           mmap_mode='r')
+            # Subjects fill disjoint rows, and zlib releases the GIL while
+            # decompressing.
+            Parallel(n_jobs=n_jobs, backend='threading')(
+                delayed(_fill_features)(features, i, maps[i], mask)
+                for i in range(start, len(maps)))
+            features.flush()
+            del features
+
+        index = {'subject_ids': subject_ids,
+                 'maps': [os.path.relpath(path, self.data_dir)
+                          for path in maps]}
+        with atomic_filename('%s-%d.json' % (prefix, len(maps))) as tmp_file:
+            with open(tmp_file, 'w') as fp:
+                json.dump(index, fp)
+        index['feature_file'] = feature_file
+        return index
+
 
 def fetch_oasis_vbm(n_subjects=None, dartel_version=True,
                     data_dir=None, url=None, resume=True, verbose=1):
@@ -4,20 +4,27 @@ Test the datasets module
 # Author: Alexandre Abraham
 # License: simplified BSD
 
+import os
+import shutil
+from tempfile import mkdtemp
+
+import nibabel
 import numpy as np
 
 from nose import with_setup
+from nose.tools import assert_equal, assert_true
 
-from nidata import fetchers
-from nidata._utils.testing import (mock_request, wrap_chunk_read_,
-                                   assert_raises_regex)
-from nidata._utils.compat import _basestring
-from nidata.anatomical import datasets
-from nidata.tests.test_fetchers import (get_file_mock, setup_tmpdata, setup_mock,
-                                        teardown_tmpdata, get_url_request,
-                                        get_datadir, get_tmpdir)
+from nidata.core import fetchers
+from nidata.core._utils.testing import assert_raises_regex, known_failure
+from nidata.core._utils.compat import _basestring
+from nidata.core.fetchers.tests.base import mock_request, wrap_chunk_read_
+from nidata.core.fetchers.tests.test_fetchers import (
+    get_file_mock, setup_tmpdata, setup_mock, teardown_tmpdata,
+    get_url_request, get_datadir, get_tmpdir)
+from nidata.anatomical.oasis_vbm import datasets
 
 
+@known_failure('setup_mock does not mock url requests')
 @with_setup(setup_mock)
 @with_setup(setup_tmpdata, teardown_tmpdata)
 def test_fetch_oasis_vbm():
@@ -46,3 +53,47 @@ def test_fetch_oasis_vbm():
     assert_true(isinstance(dataset.ext_vars, np.recarray))
     assert_true(isinstance(dataset.data_usage_agreement, _basestring))
     assert_equal(len(get_url_request().urls), 4)
+
+
+def test_oasis_vbm_features():
+    from nidata.core.fetchers.synthetic import SyntheticFetcher
+    data_dir = mkdtemp()
+    try:
+        dataset = datasets.OasisVbmDataset(data_dir=data_dir)
+        dataset.fetcher = SyntheticFetcher(dataset.data_dir, scale=1e-3)
+        small = dataset.get_features(n_subjects=3, verbose=0)
+        n_voxels = small.features.shape[1]
+        assert_equal(small.features.shape, (3, n_voxels))
+        assert_equal(small.features.dtype, np.float32)
+        assert_equal(small.subject_ids[0], 'OAS1_0001_MR1')
+
+        # More subjects: only the new subjects are loaded.
+        large = dataset.get_features(n_subjects=5, verbose=0)
+        assert_equal(large.features.shape, (5, n_voxels))
+        np.testing.assert_array_equal(large.features[:3], small.features)
+        feature_dir = os.path.join(dataset.data_dir, 'features')
+        assert_equal(len([f for f in os.listdir(feature_dir)
+                          if f.endswith('.npy')]), 2)
+
+        # Fewer subjects: served by the smallest large enough matrix.
+        subset = dataset.get_features(n_subjects=2, verbose=0)
+        assert_equal(subset.features.shape, (2, n_voxels))
+        assert_equal(subset.feature_file, small.feature_file)
+        subset = dataset.get_features(n_subjects=4, verbose=0)
+        assert_equal(subset.feature_file, large.feature_file)
+
+        # A mask selects voxels.
+        mask = np.zeros(nibabel.load(subset.mask_img).shape, dtype=np.uint8)
+        mask.flat[:10] = 1
+        masked = dataset.get_features(
+            n_subjects=2, verbose=0, mask_img=nibabel.Nifti1Image(
+                mask, nibabel.load(subset.mask_img).get_affine()))
+        assert_equal(masked.features.shape, (2, 10))
+
+        # Maps must have the field of view of the mask.
+        assert_raises_regex(
+            ValueError, '2 maps do not have the shape and affine',
+            dataset.get_features, n_subjects=2, verbose=0,
+            mask_img=nibabel.Nifti1Image(mask, np.eye(4)))
+    finally:
+        shutil.rmtree(data_dir)
@@ -8,6 +8,7 @@ Utilities to download NeuroImaging-based atlases
 from sklearn.datasets.base import Bunch
 
 from ...core.datasets import HttpDataset
+from ...core._utils.mmap_cache import mmap_niimgs
 
 
 class Craddock2012Dataset(HttpDataset):
@@ -18,6 +19,10 @@ class Craddock2012Dataset(HttpDataset):
 
     url: string
 
+    mmap: bool, optional
+        If True, return memory-mapped images (decompressed once and shared
+        by all processes) instead of file names.
+
     Returns
     -------
     data: sklearn.datasets.base.Bunch
@@ -38,7 +43,8 @@ class Craddock2012Dataset(HttpDataset):
     on this parcellation.
     """
 
-    def fetch(self, url=None, resume=True, force=False, verbose=1):
+    def fetch(self, url=None, resume=True, force=False, mmap=False,
+              verbose=1):
 
         if url is None:
             url = "ftp://www.nitrc.org/home/groups/cluster_roi/htdocs" \
@@ -61,10 +67,14 @@ class Craddock2012Dataset(HttpDataset):
                                        force=force, verbose=verbose)
 
         params = dict(list(zip(keys, sub_files)))
+        if mmap:
+            params = mmap_niimgs(params)
 
         return Bunch(**params)
 
 
-def fetch_craddock_2012_atlas(data_dir=None, url=None, resume=True, verbose=1):
-    return Craddock2012Dataset(data_dir=data_dir).fetch(url=url, resume=resume, verbose=verbose)
+def fetch_craddock_2012_atlas(data_dir=None, url=None, resume=True, mmap=False,
+                              verbose=1):
+    return Craddock2012Dataset(data_dir=data_dir).fetch(url=url, resume=resume,
+                                                        mmap=mmap, verbose=verbose)
 
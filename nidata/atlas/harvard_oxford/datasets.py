@@ -7,11 +7,70 @@ Utilities to download NeuroImaging-based atlases
 
 import os
 
+import nibabel
 import numpy as np
+from scipy import ndimage
 from sklearn.datasets.base import Bunch
 
 from ...core.datasets import HttpDataset
 from ...core.fetchers import get_dataset_dir
+from ...core._utils.fileio import atomic_filename
+from ...core._utils.mmap_cache import (_cache_key, cached_array,
+                                       get_mmap_cache_dir, load_mmap_niimg)
+from ...core._utils.niimg import check_niimg, new_img_like
+
+
+def _parse_label_names(label_file):
+    """Region names of an FSL atlas XML file; index 0 is background."""
+    from xml.etree import ElementTree
+    names = {}
+    names[0] = 'Background'
+    for label in ElementTree.parse(label_file).findall('.//label'):
+        names[int(label.get('index')) + 1] = label.text
+    return np.asarray(list(names.values()))
+
+
+def _make_label_file(filename, rng, scale=1., n_labels=48):
+    """Synthetic FSL atlas XML file (see nidata.core.fetchers.synthetic)."""
+    with open(filename, 'w') as f:
+        f.write('<?xml version="1.0" encoding="ISO-8859-1"?>\n<atlas>\n'
+                '<data>\n')
+        for index in range(n_labels):
+            f.write('<label index="%i" x="%i" y="%i" z="%i">Region %i'
+                    '</label>\n' % ((index, ) + tuple(rng.randint(91, size=3))
+                                     + (index + 1, )))
+        f.write('</data>\n</atlas>\n')
+
+
+def _symmetric_split(atlas):
+    """Split every region crossing the median (x) plane of a label volume
+    into a right and a left part.
+
+    Left parts get new labels, numbered from max(labels) + 1 in label
+    order; the median plane is set to background. Assumes that the
+    background label is zero. The input array is not modified.
+    """
+    atlas = atlas.astype(np.int32)
+    middle_ind = (atlas.shape[0] - 1) // 2
+
+    # ndimage.find_objects gives the bounding box of every label in a
+    # single pass; None elements are labels that do not exist.
+    found_slices = ndimage.find_objects(atlas)
+    crossing = np.asarray([s is not None and
+                           s[0].start < middle_ind and s[0].stop > middle_ind
+                           for s in found_slices], dtype=bool)
+    crossing_labels = np.where(crossing)[0] + 1
+
+    # Lookup table relabelling the left half of crossing regions.
+    n_labels = len(found_slices) + 1
+    lut = np.arange(n_labels, dtype=np.int32)
+    lut[crossing_labels] = n_labels + np.arange(len(crossing_labels))
+
+    split = np.empty_like(atlas)
+    split[:middle_ind] = lut[atlas[:middle_ind]]
+    split[middle_ind] = 0
+    split[middle_ind + 1:] = atlas[middle_ind + 1:]
+    return split
 
 
 class HarvardOxfordDataset(HttpDataset):
@@ -37,6 +96,11 @@ class HarvardOxfordDataset(HttpDataset):
         If True, split every symmetric region in left and right parts.
         Effectively doubles the number of regions. Default: False.
         Not implemented for probabilistic atlas (*-prob-* atlases)
+
+    mmap: bool, optional
+        If True, return a memory-mapped image (decompressed once and shared
+        by all processes) instead of a file name, and load region names from
+        a cached .npy table instead of parsing the XML file.
     """
     atlas_items = ("cort-maxprob-thr0-1mm", "cort-maxprob-thr0-2mm",
                    "cort-maxprob-thr25-1mm", "cort-maxprob-thr25-2mm",
@@ -47,20 +111,27 @@ class HarvardOxfordDataset(HttpDataset):
                    "cort-prob-1mm", "cort-prob-2mm",
                    "sub-prob-1mm", "sub-prob-2mm")
 
+    # Region names of the cortical and subcortical atlases.
+    synthetic_specs = {
+        'HarvardOxford-Cortical.xml': dict(generator=_make_label_file),
+        'HarvardOxford-Subcortical.xml': dict(generator=_make_label_file,
+                                              n_labels=21)}
+
     def __init__(self, data_dir=None):
         super(HarvardOxfordDataset, self).__init__(data_dir=data_dir)
         self.data_dir = get_dataset_dir(self.name, data_dir=data_dir,
                                         env_vars=['FSL_DIR', 'FSLDIR'])
 
     def fetch(self, atlas_name=None, symmetric_split=False,
-              resume=True, force=False, verbose=1):
+              resume=True, force=False, mmap=False, verbose=1):
 
         if atlas_name is None:
             # Recursive call
             rv = []
             for atlas_name in self.atlas_items:
                 rv.append(self.fetch(atlas_name=atlas_name, symmetric_split=symmetric_split,
-                                     resume=resume, force=force, verbose=verbose))
+                                     resume=resume, force=force, mmap=mmap,
+                                     verbose=verbose))
                 return rv
 
         if atlas_name not in self.atlas_items:
@@ -82,14 +153,14 @@ class HarvardOxfordDataset(HttpDataset):
             [(atlas_file, url, opts), (label_file, url, opts)],
             resume=resume, force=force, verbose=verbose)
 
-        names = {}
-        from xml.etree import ElementTree
-        names[0] = 'Background'
-        for label in ElementTree.parse(label_file).findall('.//label'):
-            names[int(label.get('index')) + 1] = label.text
-        names = np.asarray(list(names.values()))
+        if mmap:
+            names = cached_array(label_file, 'names', _parse_label_names)
+        else:
+            names = _parse_label_names(label_file)
 
         if not symmetric_split:
+            if mmap:
+                atlas_img = load_mmap_niimg(atlas_img)
             return atlas_img, names
 
         if atlas_name in ("cort-prob-1mm", "cort-prob-2mm",
@@ -97,30 +168,24 @@ class HarvardOxfordDataset(HttpDataset):
             raise ValueError("Region splitting not supported for probabilistic "
                              "atlases")
 
-        atlas_img = check_niimg(atlas_img)
-        atlas = atlas_img.get_data()
-
-        labels = np.unique(atlas)
-        # ndimage.find_objects output contains None elements for labels
-        # that do not exist
-        found_slices = (s for s in ndimage.find_objects(atlas)
-                        if s is not None)
-        middle_ind = (atlas.shape[0] - 1) // 2
-        crosses_middle = [s.start < middle_ind and s.stop > middle_ind
-                          for s, _, _ in found_slices]
-
-        # Split every zone crossing the median plane into two parts.
-        # Assumes that the background label is zero.
-        half = np.zeros(atlas.shape, dtype=np.bool)
-        half[:middle_ind, ...] = True
-        new_label = max(labels) + 1
-        # Put zeros on the median plane
-        atlas[middle_ind, ...] = 0
-        for label, crosses in zip(labels[1:], crosses_middle):
-            if not crosses:
-                continue
-            atlas[np.logical_and(atlas == label, half)] = new_label
-            new_label += 1
+        # The split is keyed by the source atlas file, so that it is
+        # computed again if the atlas changes.
+        split_dir = os.path.dirname(atlas_img)
+        if not os.access(split_dir, os.W_OK):
+            # e.g. read-only FSL installation
+            split_dir = get_mmap_cache_dir()
+        split_file = os.path.join(split_dir, 'HarvardOxford-%s-split-%s.nii'
+                                  % (atlas_name, _cache_key(atlas_img)))
+        if force or not os.path.exists(split_file):
+            atlas_img = check_niimg(atlas_img)
+            atlas = _symmetric_split(atlas_img.get_data())
+            split_img = new_img_like(atlas_img, atlas, atlas_img.get_affine())
+            with atomic_filename(split_file) as tmp_file:
+                nibabel.save(split_img, tmp_file)
+        if mmap:
+            split_img = load_mmap_niimg(split_file)
+        else:
+            split_img = check_niimg(split_file)
 
         # Duplicate labels for right and left
         new_names = [names[0]]
@@ -129,13 +194,14 @@ class HarvardOxfordDataset(HttpDataset):
         for n in names[1:]:
             new_names.append(n + ', left part')
 
-        return new_img_like(atlas_img, atlas, atlas_img.get_affine()), new_names
+        return split_img, new_names
 
 
 def fetch_harvard_oxford(atlas_name, data_dir=None, symmetric_split=False,
-                        resume=True, verbose=1):
+                        resume=True, mmap=False, verbose=1):
     return HarvardOxfordDataset(data_dir=data_dir).fetch(atlas_name=atlas_name,
                                                          symmetric_split=symmetric_split,
-                                                         resume=resume, verbose=verbose)
+                                                         resume=resume, mmap=mmap,
+                                                         verbose=verbose)
 
 
@@ -6,53 +6,152 @@ import sys
 import nibabel as nib
 import numpy as np
 from sklearn.datasets.base import Bunch
+from sklearn.externals.joblib import Parallel, delayed
 
 from ...core.fetchers import HttpFetcher
 from ...core.datasets import HttpDataset
+from ...core._utils.fileio import atomic_filename
+from ...core._utils.niimg import create_mmap_niimg
+
+
+def _import_pymvpa_hdf5():
+    """Import the local version of pymvpa's hdf5 module."""
+    cur_dir = os.path.dirname(os.path.abspath(__file__))
+    mvpa2_path = os.path.abspath(os.path.join(cur_dir, '..', '..', 'core', '_external', 'pymvpa'))
+    if mvpa2_path not in sys.path:
+        sys.path = [mvpa2_path] + sys.path
+    from mvpa2.base import hdf5
+    return hdf5
+
+
+def _collectable_value(col):
+    return getattr(col, 'value', col)
+
+
+def _load_subject_attributes(hdf, subject_index, hdf5):
+    """Load the (small) attribute collections of one subject's dataset,
+    without touching its samples.
+
+    pymvpa stores a list of datasets as items/<i>/rcargs/items/{0,1,2,3}
+    = (samples, sa, fa, a). Objects can be shared across subjects through
+    object references, so attributes of the preceding subjects are loaded
+    too (they are tiny) to resolve them.
+    """
+    memo = {}
+    for si in range(subject_index + 1):
+        rcargs = hdf['items'][str(si)]['rcargs']['items']
+        sa = hdf5.hdf2obj(rcargs['1'], memo=memo)
+        hdf5.hdf2obj(rcargs['2'], memo=memo)
+        a = hdf5.hdf2obj(rcargs['3'], memo=memo)
+    return rcargs['0'], sa, a
+
+
+def _convert_subject(hdf5_file, subject_index, func_filename,
+                     chunk_size=16):
+    """Write one subject of the hyperalignment HDF5 file to NIfTI.
+
+    Samples are read `chunk_size` volumes at a time, mapped back into
+    volume space and written straight into a memory-mapped .nii file, so
+    only one chunk is ever held in memory.
+    """
+    import h5py
+    hdf5 = _import_pymvpa_hdf5()
+
+    with h5py.File(hdf5_file, 'r') as hdf:
+        samples, _, a = _load_subject_attributes(hdf, subject_index, hdf5)
+        mapper = _collectable_value(a['mapper'])
+        func_affine = _collectable_value(a['imgaffine'])
+        if 'is_a_view' in samples.attrs:
+            # Stored as a raw buffer; it cannot be sliced lazily.
+            samples = hdf5.hdf2obj(samples)
+        n_volumes = samples.shape[0]
+        vol_shape = mapper.reverse(samples[:1]).shape[1:]
+
+        with atomic_filename(func_filename) as tmp_filename:
+            func_data = create_mmap_niimg(
+                tmp_filename, vol_shape + (n_volumes, ), func_affine,
+                dtype=samples.dtype)
+            for start in range(0, n_volumes, chunk_size):
+                stop = min(start + chunk_size, n_volumes)
+                vols = mapper.reverse(samples[start:stop])
+                # Write each volume in place; no transposed copy is made.
+                for vi, vol in enumerate(vols):
+                    func_data[..., start + vi] = vol
+            func_data.flush()
+            del func_data
+
+    return func_filename
+
+
+def _make_hyperalignment_file(filename, rng, scale=1., n_subjects=10,
+                              n_volumes=56):
+    """Synthetic tutorial data: a masked fMRI dataset of 7 categories per
+    subject, saved by pymvpa (see nidata.core.fetchers.synthetic)."""
+    from ...core.fetchers.synthetic import AFFINE_4D, SHAPE_4D, _scaled_shape
+    hdf5 = _import_pymvpa_hdf5()
+    from mvpa2.datasets.mri import fmri_dataset
+
+    shape = _scaled_shape(SHAPE_4D[:3], scale)
+    mask = nib.Nifti1Image((rng.rand(*shape) > .3).astype(np.uint8),
+                           AFFINE_4D)
+    targets = ['bird', 'butterfly', 'face', 'monkey', 'house', 'chair',
+               'shoe']
+    datasets = []
+    for _ in range(n_subjects):
+        samples = rng.rand(*(shape + (n_volumes, ))).astype(np.float32)
+        datasets.append(fmri_dataset(
+            nib.Nifti1Image(samples, AFFINE_4D), mask=mask,
+            targets=[targets[i % 7] for i in range(n_volumes)],
+            chunks=[i // 7 for i in range(n_volumes)]))
+    hdf5.h5save(filename, datasets)
 
 
 class HaxbyEtal2011Dataset(HttpDataset):
     dependencies = ['h5py']  # ['pymvpa2']
     MAX_SUBJECTS = 10
 
-    def fetch(self, n_subjects=10, resume=True, force=False, check=True, verbose=1):
+    # Written with the bundled pymvpa, as the loader reads it.
+    synthetic_specs = {
+        'hyperalignment_tutorial_data_2.4.hdf5': dict(
+            generator=_make_hyperalignment_file)}
+
+    def fetch(self, n_subjects=10, resume=True, force=False, check=True,
+              n_jobs=1, verbose=1):
         """data_types is a list, can contain: anat, diff, func, rest, psyc, bgnd
+
+        Subjects are converted from the raw HDF5 file one at a time (or
+        `n_jobs` at a time) to uncompressed, memory-mappable NIfTI files.
         """
         if n_subjects > self.MAX_SUBJECTS:
             raise ValueError('Max # subjects == %d' % self.MAX_SUBJECTS)
 
-        processed_files = ['S%02d_func_mni.nii.gz' % subj_id
+        processed_files = ['S%02d_func_mni.nii' % subj_id
                            for subj_id in range(1, 1 + n_subjects)]
         processed_files.append('stims.csv')
         processed_files = [os.path.join(self.data_dir, f)
                            for f in processed_files]
 
-        raw_files = ('http://data.pymvpa.org/datasets/hyperalignment_tutorial_data/hyperalignment_tutorial_data_2.4.hdf5.gz',)
+        raw_files = (('hyperalignment_tutorial_data_2.4.hdf5',
+                      'http://data.pymvpa.org/datasets/hyperalignment_tutorial_data/hyperalignment_tutorial_data_2.4.hdf5.gz',
+                      {'uncompress': True}),)
         raw_files = self.fetcher.fetch(raw_files, resume=resume, force=force,
                                        check=check, verbose=verbose)
 
-        if force or np.any([not os.path.exists(f) for f in processed_files]):
-            # Import local version of pymvpa
-            cur_dir = os.path.dirname(os.path.abspath(__file__))
-            mvpa2_path = os.path.abspath(os.path.join(cur_dir, '..', '..', 'core', '_external', 'pymvpa'))
-            sys.path = [mvpa2_path] + sys.path
-            from mvpa2.base.hdf5 import h5load
-
-            # Load the file and manipulate into expected form.
-            ds_all = h5load(raw_files[0])
-            for si, func_filename in enumerate(processed_files[:-1]):
-                if not os.path.exists(os.path.dirname(func_filename)):
-                    os.makedirs(os.path.dirname(func_filename))
-
-                # Construct and save the image
-                func_data = np.transpose(ds_all[si].O, [1, 2, 3, 0])
-                func_affine = ds_all[si].a['imgaffine'].value
-                func_hdr = ds_all[si].a['imghdr'].value
-                img = nib.Nifti1Image(func_data, affine=func_affine)#, header=func_hdr)
-                nib.save(img, func_filename)
+        func_files = [f for f in processed_files[:-1]
+                      if force or not os.path.exists(f)]
+        Parallel(n_jobs=n_jobs, verbose=max(verbose - 1, 0))(
+            delayed(_convert_subject)(raw_files[0], processed_files.index(f), f)
+            for f in func_files)
+
+        if force or not os.path.exists(processed_files[-1]):
+            import h5py
+            hdf5 = _import_pymvpa_hdf5()
 
             # Construct and save the stimuli
-            value_arr = np.asarray([ds_all[0].T, ds_all[0].sa['chunks']])
+            with h5py.File(raw_files[0], 'r') as hdf:
+                _, sa, _ = _load_subject_attributes(hdf, 0, hdf5)
+            value_arr = np.asarray([_collectable_value(sa['targets']),
+                                    _collectable_value(sa['chunks'])])
             csv_cols = np.vstack([['stim', 'chunk'], value_arr.T])
             np.savetxt(processed_files[-1], csv_cols, delimiter=',', fmt='%s')
 
@@ -10,6 +10,7 @@ import os
 from sklearn.datasets.base import Bunch
 
 from ...core.datasets import HttpDataset
+from ...core._utils.mmap_cache import mmap_niimgs
 
 
 class ICBM152Dataset(HttpDataset):
@@ -22,6 +23,9 @@ class ICBM152Dataset(HttpDataset):
         standard location. Default: None (meaning: default)
     url: string, optional
         Download URL of the dataset. Overwrite the default URL.
+    mmap: bool, optional
+        If True, return memory-mapped images (shared by all processes)
+        instead of file names.
 
     Returns
     -------
@@ -35,7 +39,8 @@ class ICBM152Dataset(HttpDataset):
         "eye_mask", "face_mask", "mask": use these images to mask out
         parts of mri images. Values are file paths.
     """
-    def fetch(self, url=None, resume=True, force=False, verbose=1):
+    def fetch(self, url=None, resume=True, force=False, mmap=False,
+              verbose=1):
         if url is None:
             url = "http://www.bic.mni.mcgill.ca/~vfonov/icbm/2009/" \
                   "mni_icbm152_nlin_sym_09a_nifti.zip"
@@ -62,8 +67,12 @@ class ICBM152Dataset(HttpDataset):
                                        force=force, verbose=verbose)
 
         params = dict(list(zip(keys, sub_files)))
+        if mmap:
+            params = mmap_niimgs(params)
         return Bunch(**params)
 
 
-def fetch_icbm152_2009(data_dir=None, url=None, resume=True, verbose=1):
-    return ICBM152Dataset(data_dir=data_dir).fetch(url=url, resume=resume, verbose=verbose)
+def fetch_icbm152_2009(data_dir=None, url=None, resume=True, mmap=False,
+                       verbose=1):
+    return ICBM152Dataset(data_dir=data_dir).fetch(url=url, resume=resume,
+                                                   mmap=mmap, verbose=verbose)
@@ -6,6 +6,7 @@ Utilities to download NeuroImaging-based atlases
 # License: simplified BSD
 
 from ...core.datasets import HttpDataset
+from ...core._utils.mmap_cache import mmap_niimgs
 
 
 class MNI152Dataset(HttpDataset):
@@ -16,6 +17,9 @@ class MNI152Dataset(HttpDataset):
     -------
     mni152_template: nibabel object corresponding to the template
 
+    If mmap is True, the template is returned as a memory-mapped image
+    (decompressed once and shared by all processes) instead of a path.
+
     References
     ----------
 
@@ -29,12 +33,17 @@ class MNI152Dataset(HttpDataset):
     NeuroImage, Volume 47, Supplement 1, July 2009, Page S102 Organization for
     Human Brain Mapping 2009 Annual Meeting, DOI: 10.1016/S1053-8119(09)70884-5
     """
-    def fetch(self, url=None, resume=True, verbose=1):
+    def fetch(self, url=None, resume=True, mmap=False, verbose=1):
         files = (('avg152T1_brain.nii.gz',
                   'https://raw.githubusercontent.com/nilearn/nilearn/master/nilearn/data/avg152T1_brain.nii.gz',
                   {}),)
-        return self.fetcher.fetch(files=files, force=not resume, verbose=verbose)
+        files = self.fetcher.fetch(files=files, force=not resume, verbose=verbose)
+        if mmap:
+            files = mmap_niimgs(files)
+        return files
 
 
-def fetch_mni152_template(data_dir=None, url=None, resume=True, verbose=1):
-    return MNI152Dataset(data_dir=data_dir).fetch(url=url, resume=resume, verbose=verbose)
+def fetch_mni152_template(data_dir=None, url=None, resume=True, mmap=False,
+                          verbose=1):
+    return MNI152Dataset(data_dir=data_dir).fetch(url=url, resume=resume,
+                                                  mmap=mmap, verbose=verbose)
@@ -10,6 +10,7 @@ import os
 from sklearn.datasets.base import Bunch
 
 from ...core.datasets import HttpDataset
+from ...core._utils.mmap_cache import mmap_niimgs
 
 
 class MSDLDataset(HttpDataset):
@@ -24,6 +25,10 @@ class MSDLDataset(HttpDataset):
         Override download URL. Used for test only (or if you setup a mirror of
         the data).
 
+    mmap: bool, optional
+        If True, 'maps' is a memory-mapped image (decompressed once and
+        shared by all processes) instead of a file name.
+
     Returns
     -------
     data: sklearn.datasets.base.Bunch
@@ -32,7 +37,7 @@ class MSDLDataset(HttpDataset):
         - 'maps': str. path to nifti file containing regions definition.
 
     """
-    def fetch(self, url=None, resume=True, verbose=1):
+    def fetch(self, url=None, resume=True, mmap=False, verbose=1):
         url = 'https://team.inria.fr/parietal/files/2015/01/MSDL_rois.zip'
         opts = {'uncompress': True}
 
@@ -40,8 +45,12 @@ class MSDLDataset(HttpDataset):
         files = [(os.path.join('MSDL_rois', 'msdl_rois_labels.csv'), url, opts),
                  (os.path.join('MSDL_rois', 'msdl_rois.nii'), url, opts)]
         files = self.fetcher.fetch(files, force=not resume, verbose=verbose)
+        if mmap:
+            files = mmap_niimgs(files)
         return Bunch(labels=files[0], maps=files[1])
 
 
-def fetch_msdl_atlas(data_dir=None, url=None, resume=True, verbose=1):
-    return MSDLDataset(data_dir=data_dir).fetch(url=url, resume=resume, verbose=verbose)
+def fetch_msdl_atlas(data_dir=None, url=None, resume=True, mmap=False,
+                     verbose=1):
+    return MSDLDataset(data_dir=data_dir).fetch(url=url, resume=resume,
+                                                mmap=mmap, verbose=verbose)
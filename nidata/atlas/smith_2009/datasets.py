@@ -8,6 +8,7 @@ Utilities to download resting state MRI datasets
 from sklearn.datasets.base import Bunch
 
 from ...core.datasets import HttpDataset
+from ...core._utils.mmap_cache import mmap_niimgs
 
 
 class Smith2009Dataset(HttpDataset):
@@ -21,6 +22,9 @@ class Smith2009Dataset(HttpDataset):
         standard location. Default: None (meaning: default)
     url: string, optional
         Download URL of the dataset. Overwrite the default URL.
+    mmap: bool, optional
+        If True, return memory-mapped images (decompressed once and shared
+        by all processes) instead of file names.
 
     Returns
     -------
@@ -56,7 +60,7 @@ class Smith2009Dataset(HttpDataset):
     For more information about this dataset's structure:
     http://www.fmrib.ox.ac.uk/analysis/brainmap+rsns/
     """
-    def fetch(self, url=None, resume=True, verbose=1):
+    def fetch(self, url=None, resume=True, mmap=False, verbose=1):
         if url is None:
             url = "http://www.fmrib.ox.ac.uk/analysis/brainmap+rsns/"
 
@@ -75,9 +79,13 @@ class Smith2009Dataset(HttpDataset):
 
         keys = ['rsn20', 'rsn10', 'rsn70', 'bm20', 'bm10', 'bm70']
         params = dict(zip(keys, files_))
+        if mmap:
+            params = mmap_niimgs(params)
 
         return Bunch(**params)
 
 
-def fetch_smith_2009(data_dir=None, url=None, resume=True, verbose=1):
-    return Smith2009Dataset(data_dir=data_dir).fetch(url=url, resume=resume, verbose=verbose)
+def fetch_smith_2009(data_dir=None, url=None, resume=True, mmap=False,
+                     verbose=1):
+    return Smith2009Dataset(data_dir=data_dir).fetch(url=url, resume=resume,
+                                                     mmap=mmap, verbose=verbose)
@@ -10,6 +10,7 @@ import os
 from sklearn.datasets.base import Bunch
 
 from ...core.datasets import HttpDataset
+from ...core._utils.mmap_cache import mmap_niimgs
 
 
 class Yeo2011Dataset(HttpDataset):
@@ -23,6 +24,10 @@ class Yeo2011Dataset(HttpDataset):
 
     resume: bool
 
+    mmap: bool, optional
+        If True, return memory-mapped images (decompressed once and shared
+        by all processes) instead of file names.
+
     verbose: int
 
     Returns
@@ -46,7 +51,8 @@ class Yeo2011Dataset(HttpDataset):
     Licence: unknown.
     """
 
-    def fetch(self, url=None, resume=True, force=False, verbose=1):
+    def fetch(self, url=None, resume=True, force=False, mmap=False,
+              verbose=1):
         if url is None:
             url = "ftp://surfer.nmr.mgh.harvard.edu/" \
                   "pub/data/Yeo_JNeurophysiol11_MNI152.zip"
@@ -71,8 +77,12 @@ class Yeo2011Dataset(HttpDataset):
                                        force=force, verbose=verbose)
 
         params = dict(list(zip(keys, sub_files)))
+        if mmap:
+            params = mmap_niimgs(params)
         return Bunch(**params)
 
 
-def fetch_yeo_2011_atlas(data_dir=None, url=None, resume=True, verbose=1):
-    return Yeo2011Dataset(data_dir=data_dir).fetch(url=url, resume=resume, verbose=verbose)
+def fetch_yeo_2011_atlas(data_dir=None, url=None, resume=True, mmap=False,
+                         verbose=1):
+    return Yeo2011Dataset(data_dir=data_dir).fetch(url=url, resume=resume,
+                                                   mmap=mmap, verbose=verbose)
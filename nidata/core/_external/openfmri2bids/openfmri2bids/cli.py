@@ -8,20 +8,27 @@ from .converter import convert, NII_HANDLING_OPTS
 @click.option('--first_session_label', type=(str))
 @click.option('--additional_session', type=(str, click.Path()), multiple=True)
 @click.option('--nii_handling', type=click.Choice(NII_HANDLING_OPTS), default=NII_HANDLING_OPTS[0])
+@click.option('--n_jobs', type=int, default=1,
+              help='Number of subjects converted in parallel.')
+@click.option('--incremental', is_flag=True,
+              help='Skip subjects that are already up to date.')
 def main(openfmri_dataset_path, output_folder, first_session_label,
-         additional_session, nii_handling):
+         additional_session, nii_handling, n_jobs, incremental):
     """Convert OpenfMRI dataset to BIDS."""
     click.echo('{0}, {1}.'.format(openfmri_dataset_path, output_folder))
 
     if additional_session:
         convert(openfmri_dataset_path, output_folder,
-                ses=first_session_label, nii_handling=nii_handling)
+                ses=first_session_label, nii_handling=nii_handling,
+                n_jobs=n_jobs, incremental=incremental)
         for session in additional_session:
             convert(session[1], output_folder, ses=session[0],
-                    nii_handling=nii_handling)
+                    nii_handling=nii_handling, n_jobs=n_jobs,
+                    incremental=incremental)
     else:
         convert(openfmri_dataset_path, output_folder,
-                nii_handling=nii_handling)
+                nii_handling=nii_handling, n_jobs=n_jobs,
+                incremental=incremental)
 
 
 if __name__ == '__main__':
@@ -4,10 +4,14 @@ Mixin for cache with joblib
 # Author: Gael Varoquaux, Alexandre Abraham, Philippe Gervais
 # License: simplified BSD
 
-import json
 import warnings
 import os
+import re
 import shutil
+import sqlite3
+import sys
+import threading
+import time
 from distutils.version import LooseVersion
 
 import nibabel
@@ -22,66 +26,324 @@ except ImportError:
     pass
 
 from .compat import _basestring
+from .fileio import FileLock
 
-__cache_checked = dict()
+__cache_backends = dict()
 
 
-def _safe_cache(memory, func, **kwargs):
-    """ A wrapper for mem.cache that flushes the cache if the version
-        number of nibabel has changed.
-    """
-    cachedir = memory.cachedir
+def _version_namespace():
+    """Name of the cache namespace of the running versions of the modules
+    that cached results depend on."""
+    modules = (nibabel, )
+    # Keep only the major + minor version numbers
+    return '-'.join('%s_%s' % (m.__name__, '.'.join(
+        str(v) for v in LooseVersion(m.__version__).version[:2]))
+        for m in modules)
 
-    if cachedir is None or cachedir in __cache_checked:
-        return memory.cache(func, **kwargs)
 
-    version_file = os.path.join(cachedir, 'module_versions.json')
+# Names of the namespaces made by _version_namespace
+_NAMESPACE_PATTERN = re.compile(
+    r'^[A-Za-z]\w*_\d[\d.]*(-[A-Za-z]\w*_\d[\d.]*)*$')
 
-    versions = dict()
-    if os.path.exists(version_file):
-        with open(version_file, 'r') as _version_file:
-            versions = json.load(_version_file)
 
-    modules = (nibabel, )
-    # Keep only the major + minor version numbers
-    my_versions = dict((m.__name__, LooseVersion(m.__version__).version[:2])
-                       for m in modules)
-    commons = set(versions.keys()).intersection(set(my_versions.keys()))
-    collisions = [m for m in commons if versions[m] != my_versions[m]]
-
-    # Flush cache if version collision
-    if len(collisions) > 0:
-        warnings.warn("Incompatible cache in %s: "
-                      "different version of nibabel. Deleting "
-                      "the cache. Put nilearn.check_cache_version "
-                      "to false to avoid this behavior."
-                      % cachedir)
+def _call(memorized_func, args, kwargs):
+    """Call a joblib MemorizedFunc, hashing its arguments only once.
+
+    Returns the output, the directory of the result (None if the joblib
+    version it comes from is not supported) and whether the result was
+    read from the cache.
+    """
+    if not hasattr(memorized_func, '_cached_call'):
+        return memorized_func(*args, **kwargs), None, False
+    # metadata is only returned when the function has been called
+    output, args_id, metadata = memorized_func._cached_call(args, kwargs)
+    module = sys.modules[type(memorized_func).__module__]
+    package = module.__name__.rsplit('.', 1)[0]
+    version = getattr(sys.modules.get(package), '__version__', '0')
+    if LooseVersion(version) < LooseVersion('0.12'):
+        func_dir = memorized_func._get_func_dir(mkdir=False)
+    else:
+        # From joblib 0.12, results are in a store backend
+        func_dir = os.path.join(
+            memorized_func.store_backend.location,
+            module._build_func_identifier(memorized_func.func))
+    return output, os.path.join(func_dir, args_id), metadata is None
+
+
+def _dir_size(dirpath):
+    size = 0
+    for filename in os.listdir(dirpath):
         try:
-            tmp_dir = (os.path.split(cachedir)[:-1]
-                        + ('old_%i' % os.getpid(), ))
-            tmp_dir = os.path.join(*tmp_dir)
-            # We use rename + unlink to be more robust to race
-            # conditions
-            os.rename(cachedir, tmp_dir)
-            shutil.rmtree(tmp_dir)
+            size += os.path.getsize(os.path.join(dirpath, filename))
         except OSError:
-            # Another process could have removed this dir
             pass
+    return size
+
+
+def _remove_dir(dirpath):
+    """Remove a directory, returning False if it does not exist anymore."""
+    try:
+        # We use rename + unlink to be more robust to race conditions
+        tmp_dir = '%s.evicted_%i' % (dirpath, os.getpid())
+        os.rename(dirpath, tmp_dir)
+        shutil.rmtree(tmp_dir)
+        return True
+    except OSError:
+        return False  # Another process could have removed this dir
+
+
+class CacheBackend(object):
+    """Size-bounded storage of the results cached in a joblib cachedir.
+
+    Results are stored in a namespace per version of the modules they
+    depend on (see _version_namespace). Entries of incompatible versions
+    are never read: the namespaces of other versions are removed the first
+    time a process uses the cachedir, with or without a size budget.
+
+    The size, hits and last access time of every entry are recorded in a
+    sqlite index in the cachedir, shared by all the processes using it.
+    When the recorded size grows over max_bytes, entries are evicted,
+    least recently used first (policy='lru') or least often used first
+    (policy='lfu'). Eviction is done by one process at a time, under a
+    lock file. Hits, misses and evictions of the current process are
+    counted in the stats attribute.
+
+    Entries written without nidata are indexed when the index is created.
+    With joblib versions for which the result directory of a call is not
+    known, the cachedir is scanned again at most every scan_interval
+    seconds instead.
 
+    Parameters
+    ----------
+    cachedir: string
+        The joblib cachedir (memory.cachedir).
+
+    max_bytes: int, optional
+        Size budget of the cachedir. Defaults to the NIDATA_CACHE_SIZE
+        environment variable (in MB), or no limit.
+
+    policy: {'lru', 'lfu'}, optional
+        Eviction policy. Defaults to the NIDATA_CACHE_POLICY environment
+        variable, or 'lru'.
+    """
+    index_file = 'nidata_cache_index.sqlite'
+    scan_interval = 60.
+
+    def __init__(self, cachedir, max_bytes=None, policy=None):
+        if max_bytes is None and os.environ.get('NIDATA_CACHE_SIZE'):
+            max_bytes = int(float(os.environ['NIDATA_CACHE_SIZE']) * 2 ** 20)
+        if policy is None:
+            policy = os.environ.get('NIDATA_CACHE_POLICY', 'lru')
+        if policy not in ('lru', 'lfu'):
+            raise ValueError("Unknown cache eviction policy '%s'. Valid "
+                             "policies are 'lru' and 'lfu'." % policy)
+        self.cachedir = cachedir
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.stats = dict(hits=0, misses=0, evictions=0, evicted_bytes=0)
+        self._memories = dict()
+        self._lock = threading.Lock()
+        self._conn = None
+        self._pid = os.getpid()
+        self._last_scan = 0.
+
+    def get_memory(self, memory):
+        """Return a Memory storing its results in the namespace of the
+        current module versions."""
+        namespace = _version_namespace()
+        if namespace not in self._memories:
+            self.remove_stale_namespaces(namespace)
+            # Verbosity is set per function, by the kwargs of cache()
+            self._memories[namespace] = memory.__class__(
+                cachedir=os.path.join(self.cachedir, namespace),
+                mmap_mode=memory.mmap_mode, verbose=0)
+        return self._memories[namespace]
+
+    def cache(self, memory, func, **kwargs):
+        return _BoundedMemorizedFunc(
+            self.get_memory(memory).cache(func, **kwargs), self)
+
+    def _execute(self, query, args=()):
+        if self._pid != os.getpid():
+            # sqlite connections must not be used across a fork
+            self._pid = os.getpid()
+            self._lock = threading.Lock()
+            self._conn = None
+        with self._lock:
+            if self._conn is None:
+                if not os.path.exists(self.cachedir):
+                    os.makedirs(self.cachedir)
+                index_file = os.path.join(self.cachedir, self.index_file)
+                new_index = not os.path.exists(index_file)
+                self._conn = sqlite3.connect(index_file, timeout=60,
+                                             check_same_thread=False)
+                with self._conn:
+                    self._conn.execute(
+                        'CREATE TABLE IF NOT EXISTS entries (path TEXT '
+                        'PRIMARY KEY, size INTEGER, hits INTEGER, '
+                        'last_access REAL)')
+                if new_index:
+                    self._scan()
+            with self._conn:
+                return self._conn.execute(query, args).fetchall()
+
+    def _scan(self):
+        """Index the entries of the cachedir that are not indexed yet
+        (lock held)."""
+        self._last_scan = time.time()
+        indexed = set(path for path, in self._conn.execute(
+            'SELECT path FROM entries'))
+        entries = []
+        for dirpath, dirnames, filenames in os.walk(self.cachedir):
+            if 'output.pkl' not in filenames:
+                continue
+            dirnames[:] = []  # numpy arrays of an entry are in the entry
+            path = os.path.relpath(dirpath, self.cachedir)
+            if path in indexed:
+                continue
+            try:
+                entries.append((path, _dir_size(dirpath), 0,
+                                os.path.getmtime(dirpath)))
+            except OSError:
+                continue
+        with self._conn:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO entries VALUES (?, ?, ?, ?)', entries)
+
+    def scan(self, force=False):
+        """Index new entries of the cachedir, at most every scan_interval
+        seconds unless force is True."""
+        if force or time.time() - self._last_scan > self.scan_interval:
+            self._execute('SELECT 1')  # opens the index
+            with self._lock:
+                self._scan()
+
+    def record_access(self, output_dir, hit):
+        """Update statistics and the index entry of a cache entry."""
+        self.stats['hits' if hit else 'misses'] += 1
+        path = os.path.relpath(output_dir, self.cachedir)
+        now = time.time()
+        if hit and self._execute(
+                'SELECT 1 FROM entries WHERE path = ?', (path, )):
+            self._execute('UPDATE entries SET hits = hits + 1, '
+                          'last_access = ? WHERE path = ?', (now, path))
+            return
         try:
-            os.makedirs(cachedir)
+            size = _dir_size(output_dir)
         except OSError:
-            # File exists?
-            pass
+            return  # entry removed by another process
+        self._execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                      (path, size, int(hit), now))
+
+    def get_size(self):
+        """Recorded size of the cachedir."""
+        return self._execute('SELECT COALESCE(SUM(size), 0) '
+                             'FROM entries')[0][0]
+
+    def remove_stale_namespaces(self, namespace):
+        """Remove the namespaces of the cachedir other than namespace, and
+        their index entries."""
+        if not os.path.isdir(self.cachedir):
+            return
+        stale = [name for name in os.listdir(self.cachedir)
+                 if name != namespace and _NAMESPACE_PATTERN.match(name)
+                 and os.path.isdir(os.path.join(self.cachedir, name))]
+        if not stale:
+            return
+        lock = FileLock(os.path.join(self.cachedir, '.nidata_evict.lock'))
+        if not lock.acquire(blocking=False):
+            return  # another process is evicting
+        try:
+            for name in stale:
+                _remove_dir(os.path.join(self.cachedir, name))
+                prefix = name + os.sep
+                self._execute('DELETE FROM entries WHERE substr(path, 1, ?) '
+                              '= ?', (len(prefix), prefix))
+        finally:
+            lock.release()
+
+    def evict(self, keep=None):
+        """Remove entries until the cachedir fits in max_bytes, except the
+        entry in the directory keep (e.g. the one just added)."""
+        if self.max_bytes is None or self.get_size() <= self.max_bytes:
+            return
+        lock = FileLock(os.path.join(self.cachedir, '.nidata_evict.lock'))
+        if not lock.acquire(blocking=False):
+            return  # another process is evicting
+        try:
+            if self.policy == 'lfu':
+                order = 'hits, last_access'
+            else:
+                order = 'last_access, hits'
+            entries = self._execute('SELECT path, size FROM entries '
+                                    'ORDER BY ' + order)
+            total_size = sum(size for _, size in entries)
+            keep = keep and os.path.relpath(keep, self.cachedir)
+            for path, size in entries:
+                if total_size <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                if _remove_dir(os.path.join(self.cachedir, path)):
+                    self.stats['evictions'] += 1
+                    self.stats['evicted_bytes'] += size
+                self._execute('DELETE FROM entries WHERE path = ?', (path, ))
+                total_size -= size
+        finally:
+            lock.release()
+
+
+class _BoundedMemorizedFunc(object):
+    """Wraps a joblib MemorizedFunc to record accesses and trigger
+    eviction after a result has been added to the cache."""
+    def __init__(self, memorized_func, backend):
+        self.memorized_func = memorized_func
+        self.backend = backend
+
+    def __call__(self, *args, **kwargs):
+        result, output_dir, hit = _call(self.memorized_func, args, kwargs)
+        if output_dir is None:
+            self.backend.scan()
+            self.backend.evict()
+            return result
+        if os.path.exists(output_dir):
+            self.backend.record_access(output_dir, hit)
+        if not hit:
+            self.backend.evict(keep=output_dir)
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.memorized_func, name)
+
+
+def get_cache_backend(cachedir, **kwargs):
+    """Return the CacheBackend of a joblib cachedir (one per process)."""
+    if cachedir not in __cache_backends:
+        __cache_backends[cachedir] = CacheBackend(cachedir, **kwargs)
+    return __cache_backends[cachedir]
+
+
+def get_cache_stats(cachedir=None):
+    """Hits, misses and evictions of the caches used by this process.
+
+    If cachedir is None, return a dict of the statistics of every cachedir.
+    """
+    if cachedir is not None:
+        return dict(get_cache_backend(cachedir).stats)
+    return dict((cachedir, dict(backend.stats))
+                for cachedir, backend in __cache_backends.items())
+
 
-    # Write json files if configuration is different
-    if versions != my_versions:
-        with open(version_file, 'w') as _version_file:
-            json.dump(my_versions, _version_file)
+def _safe_cache(memory, func, **kwargs):
+    """ A wrapper for mem.cache that stores results in a namespace per
+        version of nibabel, in a size-bounded cachedir (see CacheBackend).
+    """
+    cachedir = memory.cachedir
 
-    __cache_checked[cachedir] = True
+    if cachedir is None:
+        return memory.cache(func, **kwargs)
 
-    return memory.cache(func, **kwargs)
+    return get_cache_backend(cachedir).cache(memory, func, **kwargs)
 
 
 def cache(func, memory, func_memory_level=None, memory_level=None,
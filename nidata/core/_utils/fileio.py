@@ -0,0 +1,320 @@
+"""
+Filesystem helpers shared by fetchers and dataset post-processing.
+"""
+import contextlib
+import errno
+import os
+import socket
+import tempfile
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+
+@contextlib.contextmanager
+def atomic_filename(filename):
+    """Yield a temporary path to write `filename` to, then publish it.
+
+    The temporary file lives in the same directory as `filename` (so the
+    final rename never crosses filesystems) and keeps its extension (so
+    writers that infer the format from the name, like nibabel.save, keep
+    working). The file only appears under its final name once the block
+    exits without error; on error the temporary file is removed.
+    """
+    dirname, basename = os.path.split(os.path.abspath(filename))
+    if not os.path.exists(dirname):
+        os.makedirs(dirname)
+    # Keep double extensions such as .nii.gz intact.
+    ext = basename[basename.find('.'):] if '.' in basename else ''
+    fd, tmp_filename = tempfile.mkstemp(prefix='.%s.' % basename, suffix=ext,
+                                        dir=dirname)
+    os.close(fd)
+    try:
+        yield tmp_filename
+        os.rename(tmp_filename, filename)
+    finally:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+
+
+def _pid_alive(pid):
+    """Whether a process with this pid exists on this host."""
+    try:
+        os.kill(pid, 0)
+    except OSError as e:
+        return e.errno == errno.EPERM
+    return True
+
+
+def _lock_fd(fd):
+    """Take a non-blocking OS lock on an open file."""
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        msvcrt.locking(fd, msvcrt.LK_NBLCK, 1)
+
+
+def _unlock_fd(fd):
+    if fcntl is not None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+    else:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+
+# errno of a lock held by another process; other errors mean that the
+# filesystem does not support OS locks.
+_LOCK_HELD_ERRNOS = (errno.EAGAIN, errno.EACCES, errno.EWOULDBLOCK,
+                     getattr(errno, 'EDEADLOCK', errno.EDEADLK))
+
+
+class FileLock(object):
+    """Inter-process lock on a file.
+
+    Where the filesystem supports it, the lock is an OS lock (flock, or
+    msvcrt.locking on Windows) on the lock file, which the OS drops when
+    its owner dies.
+
+    Otherwise, the lock is the exclusive creation of the lock file, which
+    records the pid and host of its owner. A lock left behind by a crashed
+    process is detected and broken: on the same host when its owner is no
+    longer running, on any host when it has not been refreshed for
+    `stale_age` seconds. While it is held, a lock with a stale_age is
+    refreshed by a background thread.
+
+    Parameters
+    ----------
+    filename: string
+        Path of the lock file.
+
+    timeout: float, optional
+        Seconds to wait for the lock before raising an IOError. None waits
+        forever.
+
+    poll_interval: float, optional
+        Seconds between two attempts to take the lock.
+
+    stale_age: float, optional
+        Seconds after which a lock file that has not been refreshed is
+        considered abandoned. None only breaks locks of dead processes of
+        this host.
+    """
+    def __init__(self, filename, timeout=None, poll_interval=0.1,
+                 stale_age=None):
+        self.filename = filename
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.stale_age = stale_age
+        self.locked = False
+        self._fd = None
+        self._os_lock = fcntl is not None or msvcrt is not None
+        self._released = threading.Event()
+
+    def _read_info(self, filename=None):
+        """(pid, host, mtime) of a lock file, pid and host being None if
+        they can't be read; None if the file does not exist."""
+        filename = filename or self.filename
+        try:
+            mtime = os.stat(filename).st_mtime
+        except OSError:
+            return None
+        try:
+            with open(filename, 'r') as f:
+                pid, host = f.read().split(' ', 1)
+            return int(pid), host, mtime
+        except (IOError, OSError, ValueError):
+            return None, None, mtime
+
+    def _try_os_lock(self, filename, create):
+        """Open filename and lock it; return the file descriptor, or None
+        if the lock is held by another process."""
+        flags = os.O_RDWR | (os.O_CREAT if create else 0)
+        fd = os.open(filename, flags)
+        try:
+            _lock_fd(fd)
+        except (IOError, OSError) as e:
+            os.close(fd)
+            if e.errno in _LOCK_HELD_ERRNOS:
+                return None
+            raise
+        return fd
+
+    def _stale_info(self):
+        """Info (see _read_info) of an exclusively created lock file that
+        was abandoned by its owner, or None."""
+        info = self._read_info()
+        if info is None:
+            return None
+        pid, host, mtime = info
+        if (self.stale_age is not None and
+                time.time() - mtime > self.stale_age):
+            return info
+        if pid is None:
+            # Being written, or written by an older version: rely on age.
+            return None
+        if host == socket.gethostname() and not _pid_alive(pid):
+            return info
+        return None
+
+    def is_stale(self):
+        """Whether the lock file exists and was abandoned by its owner."""
+        if not self._os_lock:
+            return self._stale_info() is not None
+        try:
+            fd = self._try_os_lock(self.filename, create=False)
+        except (IOError, OSError):
+            return self._stale_info() is not None
+        if fd is None:
+            return False
+        _unlock_fd(fd)
+        os.close(fd)
+        return True
+
+    def _break(self, info):
+        """Remove a stale lock whose info is `info`.
+
+        Renaming first makes sure that, of several processes breaking the
+        same lock, only one removes it. If the renamed file is not the
+        stale lock (it was broken and taken again in the meantime), it is
+        put back.
+        """
+        broken = '%s.broken.%d' % (self.filename, os.getpid())
+        try:
+            os.rename(self.filename, broken)
+        except OSError:
+            return
+        if self._read_info(broken) == info:
+            os.remove(broken)
+            return
+        try:
+            # Does not replace a lock created since the rename
+            os.link(broken, self.filename)
+            os.remove(broken)
+        except (AttributeError, OSError):
+            os.rename(broken, self.filename)
+
+    def _acquire_os_lock(self):
+        """Return True if the OS lock was taken, False if it is held, and
+        None if the filesystem does not support OS locks."""
+        try:
+            fd = self._try_os_lock(self.filename, create=True)
+        except (IOError, OSError) as e:
+            if e.errno in (errno.ENOENT, errno.EEXIST):
+                raise
+            return None
+        if fd is None:
+            return False
+        if fcntl is not None:
+            # The previous owner removes the file while holding the lock:
+            # make sure that we did not lock a removed file.
+            try:
+                same_file = os.path.samestat(os.fstat(fd),
+                                             os.stat(self.filename))
+            except OSError:
+                same_file = False
+            if not same_file:
+                os.close(fd)
+                return self._acquire_os_lock()
+        os.ftruncate(fd, 0)
+        os.write(fd, ('%d %s' % (os.getpid(), socket.gethostname())
+                      ).encode('utf-8'))
+        self._fd = fd
+        return True
+
+    def _acquire_exclusive_file(self):
+        """Return True if the lock file was created, False if it is held."""
+        while True:
+            try:
+                fd = os.open(self.filename,
+                             os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+                info = self._stale_info()
+                if info is None:
+                    return False
+                self._break(info)
+            else:
+                os.write(fd, ('%d %s' % (os.getpid(), socket.gethostname())
+                              ).encode('utf-8'))
+                os.close(fd)
+                if self.stale_age is not None:
+                    self._start_heartbeat()
+                return True
+
+    def acquire(self, blocking=True):
+        """Take the lock; return False if blocking is False and the lock
+        is held by someone else."""
+        start_time = time.time()
+        while True:
+            acquired = None
+            if self._os_lock:
+                acquired = self._acquire_os_lock()
+                if acquired is None:
+                    self._os_lock = False
+            if acquired is None:
+                acquired = self._acquire_exclusive_file()
+            if acquired:
+                self.locked = True
+                return True
+            if not blocking:
+                return False
+            if (self.timeout is not None and
+                    time.time() - start_time > self.timeout):
+                raise IOError('Timeout while waiting for lock %s'
+                              % self.filename)
+            time.sleep(self.poll_interval)
+
+    def _start_heartbeat(self):
+        self._released.clear()
+
+        def beat():
+            while not self._released.wait(self.stale_age / 4.):
+                try:
+                    self.refresh()
+                except OSError:
+                    return
+
+        thread = threading.Thread(target=beat)
+        thread.daemon = True
+        thread.start()
+
+    def refresh(self):
+        """Mark a held lock as alive (resets its age, see stale_age)."""
+        if self.locked:
+            os.utime(self.filename, None)
+
+    def release(self):
+        if not self.locked:
+            return
+        self.locked = False
+        self._released.set()
+        fd, self._fd = self._fd, None
+        if fd is None:
+            os.remove(self.filename)
+        elif fcntl is not None:
+            # Removed while still locked, see _acquire_os_lock
+            os.remove(self.filename)
+            os.close(fd)
+        else:
+            _unlock_fd(fd)
+            os.close(fd)
+            try:
+                os.remove(self.filename)
+            except OSError:
+                pass  # opened by a process waiting for the lock
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
@@ -0,0 +1,137 @@
+"""
+Decode-once cache of uncompressed, memory-mappable images.
+
+Compressed images (.nii.gz) are decompressed a single time into a
+page-aligned .nii copy; every later load memory-maps that copy, so that
+processes on the same host share one page-cached version of the data.
+"""
+import os
+
+import nibabel
+import numpy as np
+from nibabel.openers import Opener
+
+from .compat import _basestring, md5_hash
+from .fileio import atomic_filename
+from .niimg import create_mmap_niimg
+
+
+def get_mmap_cache_dir(cache_dir=None):
+    """Return (and create) the directory holding decompressed images.
+
+    The priority is: the cache_dir argument, the NIDATA_MMAP_CACHE
+    environment variable, then a 'mmap_cache' folder in the nidata path.
+    """
+    if cache_dir is None:
+        cache_dir = os.environ.get('NIDATA_MMAP_CACHE')
+    if cache_dir is None:
+        from ..datasets import get_dataset_dir  # avoid circular import
+        return get_dataset_dir('mmap_cache', verbose=0)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    return cache_dir
+
+
+def _cache_key(filename, use_digest=False):
+    """Key a file by path, size and modification time (no data read), or
+    by the md5 digest of its content if use_digest is True.
+
+    Digests are memoized next to the file (see cached_md5_sum_file), and
+    let copies of the same file share a single cache entry.
+    """
+    if use_digest:
+        from ..fetchers import cached_md5_sum_file  # avoid circular import
+        return cached_md5_sum_file(filename)
+    stat = os.stat(filename)
+    return md5_hash('%s-%d-%d' % (os.path.abspath(filename),
+                                  stat.st_size, int(stat.st_mtime)))
+
+
+def _strip_ext(filename):
+    basename = os.path.basename(filename)
+    for ext in ('.nii.gz', '.nii', '.csv', '.xml', '.txt', '.bvals',
+                '.bvecs', '.bval', '.bvec'):
+        if basename.endswith(ext):
+            return basename[:-len(ext)]
+    return os.path.splitext(basename)[0]
+
+
+def decompress_niimg(filename, cache_dir=None, use_digest=False):
+    """Return the path of an uncompressed, page-aligned copy of an image.
+
+    The copy is created on first use and reused until the source file
+    changes. Data bytes are copied verbatim, so dtype and scaling are
+    those of the source image. See _cache_key for use_digest.
+    """
+    cache_dir = get_mmap_cache_dir(cache_dir)
+    cached_file = os.path.join(cache_dir, '%s-%s.nii' % (
+        _strip_ext(filename), _cache_key(filename, use_digest=use_digest)))
+    if os.path.exists(cached_file):
+        return cached_file
+
+    img = nibabel.load(filename)
+    header = img.get_header()
+    # The header of a loaded image no longer holds the data offset and
+    # scaling of the file: its array proxy does.
+    proxy = img.dataobj
+    shape = header.get_data_shape()
+    dtype = np.dtype(proxy.dtype)
+    n_bytes = int(np.prod(shape)) * dtype.itemsize
+
+    with atomic_filename(cached_file) as tmp_file:
+        # Write the (page-aligned) header, then stream the raw data bytes
+        # from the decompressor: no decoding, scaling or full-size buffer.
+        data = create_mmap_niimg(tmp_file, shape, None,
+                                 dtype=dtype, header=header,
+                                 slope_inter=(proxy.slope, proxy.inter))
+        data_offset = data.offset
+        del data
+        with Opener(filename) as src, open(tmp_file, 'r+b') as dst:
+            src.seek(proxy.offset)
+            dst.seek(data_offset)
+            while n_bytes > 0:
+                chunk = src.read(min(n_bytes, 16 * 1024 * 1024))
+                if not chunk:
+                    raise IOError('Unexpected end of file in %s' % filename)
+                dst.write(chunk)
+                n_bytes -= len(chunk)
+    return cached_file
+
+
+def load_mmap_niimg(filename, cache_dir=None, use_digest=False):
+    """Load an image through the decode-once cache; its data is a memmap."""
+    return nibabel.load(decompress_niimg(filename, cache_dir=cache_dir,
+                                         use_digest=use_digest))
+
+
+def cached_array(source_file, name, func, cache_dir=None, use_digest=False):
+    """Compute an array from source_file once, store it as .npy and
+    return it memory-mapped (read-only) on later calls.
+
+    Used for parsed text tables, e.g. the names of an atlas' regions or
+    gradient tables. See _cache_key for use_digest.
+    """
+    cache_dir = get_mmap_cache_dir(cache_dir)
+    cached_file = os.path.join(cache_dir, '%s-%s-%s.npy' % (
+        _strip_ext(source_file), name,
+        _cache_key(source_file, use_digest=use_digest)))
+    if not os.path.exists(cached_file):
+        with atomic_filename(cached_file) as tmp_file:
+            np.save(tmp_file, np.asarray(func(source_file)))
+    return np.load(cached_file, mmap_mode='r')
+
+
+def mmap_niimgs(files, cache_dir=None):
+    """Replace image paths in a fetcher result by memory-mapped images.
+
+    files can be a path, a list of paths or a dict-like object (Bunch);
+    values that are not NIfTI paths are returned unchanged.
+    """
+    if isinstance(files, _basestring):
+        if files.endswith('.nii') or files.endswith('.nii.gz'):
+            return load_mmap_niimg(files, cache_dir=cache_dir)
+        return files
+    if hasattr(files, 'items'):
+        return files.__class__(**dict((key, mmap_niimgs(val, cache_dir))
+                                      for key, val in files.items()))
+    return [mmap_niimgs(f, cache_dir=cache_dir) for f in files]
@@ -5,32 +5,36 @@ Conversion utilities.
 # License: simplified BSD
 import collections
 import copy
-import gc
 import warnings
 from distutils.version import LooseVersion
 
 import numpy as np
-import itertools
 import nibabel
-from sklearn.externals.joblib import Memory
+from nibabel.openers import Opener
+from sklearn.externals.joblib import Memory, Parallel, delayed
 
 from .cache_mixin import cache
 from .compat import _basestring
+from .fileio import atomic_filename
 from .numpy_conversions import as_ndarray
+from .resample_cache import get_resample_cache
 
 
-def _safe_get_data(img):
+def _safe_get_data(img, copy=False):
     """ Get the data in the image without having a side effect on the
         Nifti1Image object
+
+    Data already loaded in the image are returned as-is. Otherwise the data
+    proxy is read directly, so that nothing gets cached in the image: for an
+    uncompressed, unscaled file, the result may be a memmap of the file.
+    Use copy=True to get an array that owns its data.
     """
-    if hasattr(img, '_data_cache') and img._data_cache is None:
-        # By loading directly dataobj, we prevent caching if the data is
-        # memmaped. Preventing this side-effect can save memory in some cases.
-        img = copy.deepcopy(img)
-    # typically the line below can double memory usage
-    # that's why we invoke a forced call to the garbage collector
-    gc.collect()
-    return img.get_data()
+    data = getattr(img, '_data_cache', None)
+    if data is None:
+        data = np.asarray(img.dataobj)
+    if copy:
+        data = np.array(data, copy=True)
+    return data
 
 
 def load_niimg(niimg, dtype=None):
@@ -95,10 +99,62 @@ def new_img_like(ref_img, data, affine, copy_header=False):
         header['scl_inter'] = 0.
         header['glmax'] = 0.
         header['cal_max'] = np.max(data) if data.size > 0 else 0.
-        header['cal_max'] = np.min(data) if data.size > 0 else 0.
+        header['cal_min'] = np.min(data) if data.size > 0 else 0.
     return ref_img.__class__(data, affine, header=header)
 
 
+def create_mmap_niimg(filename, shape, affine, dtype=np.float32,
+                      header=None, data_offset=4096, slope_inter=(1., 0.)):
+    """Create an uncompressed NIfTI file on disk and memory-map its data.
+
+    Parameters
+    ----------
+    filename: string
+        Path of the .nii file to create. Any existing file is overwritten.
+
+    shape: tuple of int
+        Shape of the image data.
+
+    affine: 4x4 numpy array or None
+        Transformation matrix. If None, the one of the header is kept.
+
+    dtype: numpy dtype, optional
+        On-disk dtype of the data.
+
+    header: nibabel.Nifti1Header, optional
+        Header used as a template for the new file.
+
+    data_offset: int, optional
+        Offset of the data block in the file. The default keeps the data
+        page-aligned, so that it can be shared through the page cache.
+
+    slope_inter: tuple of float, optional
+        Scaling stored in the header. Default: no scaling.
+
+    Returns
+    -------
+    data: numpy.memmap
+        Writable, Fortran-ordered view on the image data. Flush (or delete)
+        it before loading the file with nibabel.
+    """
+    header = (nibabel.Nifti1Header() if header is None
+              else nibabel.Nifti1Header.from_header(header))
+    header.set_data_shape(shape)
+    header.set_data_dtype(dtype)
+    if affine is not None:
+        header.set_qform(affine, code=1)
+        header.set_sform(affine, code=1)
+    header.set_slope_inter(*slope_inter)
+    header.set_data_offset(data_offset)
+    dtype = header.get_data_dtype()
+
+    with open(filename, 'wb') as fp:
+        header.write_to(fp)
+        fp.truncate(data_offset + int(np.prod(shape)) * dtype.itemsize)
+    return np.memmap(filename, dtype=dtype, mode='r+', offset=data_offset,
+                     shape=tuple(shape), order='F')
+
+
 def copy_img(img):
     """Copy an image to a nibabel.Nifti1Image.
 
@@ -151,30 +207,137 @@ def short_repr(niimg):
     return this_repr
 
 
+def check_fovs(niimgs, target_affine=None, target_shape=None,
+               rtol=1e-5, atol=1e-8):
+    """Compare the field of view (shape and affine) of many images with a
+    reference, reading only their headers.
+
+    Parameters
+    ----------
+    niimgs: iterable of Niimg-like objects
+        Images (or paths) to check. Data are never loaded.
+
+    target_affine: 4x4 numpy array, optional
+        Reference affine. Default: the affine of the first image.
+
+    target_shape: tuple of int, optional
+        Reference 3D shape. Default: the shape of the first image.
+
+    rtol, atol: float, optional
+        Tolerances on the affines, as in numpy.allclose.
+
+    Returns
+    -------
+    report: dict
+        - 'mismatch': boolean array, True for images with another FOV
+        - 'indices': indices of these images
+        - 'shape_mismatch': boolean array, True for images of another shape
+        - 'affine_max_diff': maximal absolute difference with the reference
+          affine, for every image
+        - 'shapes', 'affines': (n_images, 3) and (n_images, 4, 4) arrays
+        - 'target_affine', 'target_shape': the reference FOV
+    """
+    shapes = []
+    affines = []
+    for niimg in niimgs:
+        img = load_niimg(niimg)
+        shapes.append(tuple(img.shape[:3]) + (1, ) * (3 - len(img.shape)))
+        affines.append(img.get_affine())
+    if not shapes:
+        raise TypeError('Cannot check the field of view of empty objects')
+    shapes = np.asarray(shapes, dtype=int)
+    affines = np.asarray(affines, dtype=np.float64)
+
+    target_affine = (affines[0] if target_affine is None
+                     else np.asarray(target_affine, dtype=np.float64))
+    target_shape = (tuple(shapes[0]) if target_shape is None
+                    else tuple(target_shape))
+
+    shape_mismatch = np.any(shapes != np.asarray(target_shape), axis=1)
+    diff = np.abs(affines - target_affine)
+    affine_mismatch = np.any(
+        (diff > atol + rtol * np.abs(target_affine)).reshape(len(diff), -1),
+        axis=1)
+    mismatch = shape_mismatch | affine_mismatch
+    return dict(mismatch=mismatch,
+                indices=np.where(mismatch)[0],
+                shape_mismatch=shape_mismatch,
+                affine_max_diff=diff.reshape(len(diff), -1).max(axis=1),
+                shapes=shapes, affines=affines,
+                target_affine=target_affine, target_shape=target_shape)
+
+
 def _check_fov(img, affine, shape):
     """ Return True if img's field of view correspond to given
         shape and affine, False elsewhere.
     """
-    img = check_niimg(img)
-    return (img.shape[:3] == shape and
-            np.allclose(img.get_affine(), affine))
+    return not check_fovs([img], target_affine=affine,
+                          target_shape=shape)['mismatch'][0]
 
 
 def _check_same_fov(img1, img2):
     """ Return True if img1 and img2 have the same field of view
         (shape and affine), False elsewhere.
     """
-    img1 = check_niimg(img1)
-    img2 = check_niimg(img2)
-    return (img1.shape[:3] == img2.shape[:3]
-            and np.allclose(img1.get_affine(), img2.get_affine()))
+    return not check_fovs([img1, img2])['mismatch'][1]
 
 
-def _index_img(img, index):
-    """Helper function for check_niimg_4d."""
-    return new_img_like(
-        img, img.get_data()[:, :, :, index], img.get_affine(),
-        copy_header=True)
+def _volume_header(img):
+    """Header template for images holding (scaled) volumes of img.
+
+    Scaling and display range are reset: cal_min/cal_max are left to be
+    computed by whoever needs them, e.g. with new_img_like(copy_header=True).
+    """
+    header = copy.copy(img.get_header())
+    header['scl_slope'] = 0.
+    header['scl_inter'] = 0.
+    header['glmax'] = 0.
+    header['cal_max'] = 0.
+    header['cal_min'] = 0.
+    return header
+
+
+def _index_img(img, index, header=None):
+    """Helper function for check_niimg_4d.
+
+    Only the requested volume is read from uncompressed files.
+    """
+    if header is None:
+        header = _volume_header(img)
+    return img.__class__(np.asarray(img.dataobj[..., index]),
+                         img.get_affine(), header=header)
+
+
+def _iter_volumes(img):
+    """Lazily yield the 3D volumes of a 4D image.
+
+    In-memory data (including data already loaded with get_data) are
+    sliced without copy, and file-backed images are read sequentially one
+    writable volume at a time (compressed files are decompressed once). All
+    volumes are built from a single header template.
+    """
+    header = _volume_header(img)
+    affine = img.get_affine()
+    for chunk in _iter_volume_chunks(img, 1):
+        yield img.__class__(chunk[..., 0], affine, header=header)
+
+
+def _resample_img(img, target_fov, memory=Memory(cachedir=None),
+                  memory_level=0):
+    """Resample img to target_fov, an (affine, shape) tuple.
+
+    The nidata resampling cache is used when enabled (see
+    resample_cache.get_resample_cache); otherwise results are cached with
+    memory, depending on memory_level.
+    """
+    resample_cache = get_resample_cache()
+    if resample_cache is not None:
+        return resample_cache.resample_img(img, target_affine=target_fov[0],
+                                           target_shape=target_fov[1])
+    from nilearn import image  # we avoid a circular import
+    return cache(image.resample_img, memory, func_memory_level=2,
+                 memory_level=memory_level)(
+        img, target_affine=target_fov[0], target_shape=target_fov[1])
 
 
 def _iter_check_niimg(niimgs, ensure_ndim=None, atleast_4d=False,
@@ -216,16 +379,12 @@ def _iter_check_niimg(niimgs, ensure_ndim=None, atleast_4d=False,
 
             if not _check_fov(niimg, ref_fov[0], ref_fov[1]):
                 if target_fov is not None:
-                    from nilearn import image  # we avoid a circular import
                     if resample_to_first_img:
                         warnings.warn('Affine is different across subjects.'
                                       ' Realignement on first subject '
                                       'affine forced')
-                    niimg = cache(
-                        image.resample_img, memory, func_memory_level=2,
-                        memory_level=memory_level)(
-                            niimg, target_affine=ref_fov[0],
-                            target_shape=ref_fov[1])
+                    niimg = _resample_img(niimg, ref_fov, memory=memory,
+                                          memory_level=memory_level)
                 else:
                     raise ValueError(
                         "Field of view of image #%d is different from "
@@ -311,7 +470,7 @@ def check_niimg(niimg, ensure_ndim=None, atleast_4d=False,
             "manipulating_mr_images.html#niimg." % (ensure_ndim, niimg.shape))
 
     if return_iterator:
-        return (_index_img(niimg, i) for i in range(niimg.shape[3]))
+        return _iter_volumes(niimg)
 
     return niimg
 
@@ -377,9 +536,136 @@ def check_niimg_4d(niimg, return_iterator=False):
     return check_niimg(niimg, ensure_ndim=4, return_iterator=return_iterator)
 
 
+def _plan_concat(niimgs, ndim=None):
+    """Load every niimg once and compute the layout of their concatenation.
+
+    Images given as filenames are loaded lazily: only their header is read.
+    Other iterables (e.g. nested lists) are concatenated by check_niimg.
+
+    Returns
+    -------
+    imgs: list of images
+        The loaded images.
+
+    offsets: list of int
+        Index of the first output volume of every image; the last element
+        is the total number of volumes.
+
+    ndim: int
+        Dimensionality of the images.
+    """
+    imgs = []
+    offsets = [0]
+    for index, niimg in enumerate(niimgs):
+        try:
+            if (isinstance(niimg, _basestring) or
+                    isinstance(niimg, nibabel.spatialimages.SpatialImage)):
+                img = load_niimg(niimg)
+            else:
+                img = check_niimg(niimg, ensure_ndim=ndim)
+        except TypeError as exc:
+            img_name = ''
+            if isinstance(niimg, _basestring):
+                img_name = " (%s) " % niimg
+            exc.args = (('Error encountered while loading image #%d%s'
+                         % (index, img_name),) + exc.args)
+            raise
+
+        shape = img.shape
+        # If no particular dimensionality is asked, we force consistency
+        # wrt the first image
+        if ndim is None:
+            ndim = len(shape)
+        if ndim == 3 and len(shape) == 4 and shape[3] == 1:
+            pass  # single-scan 4D image, used as a 3D image
+        elif len(shape) != ndim:
+            raise TypeError(
+                "Data must be a %iD Niimg-like object but you provided an "
+                "image of shape %s (image #%d). See "
+                "http://nilearn.github.io/building_blocks/"
+                "manipulating_mr_images.html#niimg." % (ndim, shape, index))
+        imgs.append(img)
+        offsets.append(offsets[-1] + (shape[3] if len(shape) == 4 else 1))
+
+    if not imgs:
+        raise TypeError('Cannot concatenate empty objects')
+    return imgs, offsets, ndim
+
+
+def _read_exactly(fobj, n_bytes, filename):
+    """Read n_bytes of fobj in a new (writable) bytearray."""
+    buf = bytearray(n_bytes)
+    view = memoryview(buf)
+    pos = 0
+    while pos < n_bytes:
+        n_read = fobj.readinto(view[pos:])
+        if not n_read:
+            raise IOError('Unexpected end of file in %s' % filename)
+        pos += n_read
+    return buf
+
+
+def _iter_volume_chunks(img, chunk_size):
+    """Yield consecutive 4D blocks of at most chunk_size volumes of img.
+
+    Single-file NIfTI images that are still backed by their file are
+    streamed from disk in order: a compressed file is decompressed once,
+    and only one block is in memory at a time. Blocks are writable.
+    """
+    shape = img.shape[:3] + ((img.shape[3] if len(img.shape) == 4 else 1), )
+    filename = img.get_filename()
+    # Data already in memory (including data loaded by get_data) is sliced.
+    if (filename is None or not isinstance(img, nibabel.Nifti1Image)
+            or isinstance(img.dataobj, np.ndarray)
+            or getattr(img, '_data_cache', None) is not None):
+        data = _safe_get_data(img).reshape(shape, order='F')
+        for start in range(0, shape[3], chunk_size):
+            yield data[..., start:start + chunk_size]
+        return
+
+    # The header of a loaded image no longer holds the data offset and
+    # scaling of the file: its array proxy does.
+    proxy = img.dataobj
+    dtype = np.dtype(proxy.dtype)
+    slope, inter = proxy.slope, proxy.inter
+    has_scaling = not (slope in (None, 1.) and inter in (None, 0.))
+    volume_bytes = int(np.prod(shape[:3])) * dtype.itemsize
+    with Opener(filename) as fobj:
+        fobj.seek(proxy.offset)
+        for start in range(0, shape[3], chunk_size):
+            n_volumes = min(chunk_size, shape[3] - start)
+            chunk = np.frombuffer(
+                _read_exactly(fobj, n_volumes * volume_bytes, filename),
+                dtype=dtype)
+            chunk = chunk.reshape(shape[:3] + (n_volumes, ), order='F')
+            if has_scaling:
+                chunk = chunk * slope + (inter or 0.)
+            yield chunk
+
+
+def _fill_concat(data, img, start, stop, target_fov=None,
+                 memory=Memory(cachedir=None), memory_level=0,
+                 chunk_bytes=2 ** 26):
+    """Copy (resampling it if needed) the data of img into
+    data[..., start:stop], by blocks of about chunk_bytes."""
+    if target_fov is not None:
+        img = _resample_img(img, target_fov, memory=memory,
+                            memory_level=memory_level)
+    volume_bytes = int(np.prod(data.shape[:3])) * data.dtype.itemsize
+    chunk_size = max(1, chunk_bytes // volume_bytes)
+    index = start
+    for chunk in _iter_volume_chunks(img, chunk_size):
+        data[..., index:index + chunk.shape[3]] = chunk
+        index += chunk.shape[3]
+    if index != stop:
+        raise ValueError('Image %s has %d volumes, %d were expected'
+                         % (short_repr(img), index - start, stop - start))
+
+
 def concat_niimgs(niimgs, dtype=np.float32, ensure_ndim=None,
                   memory=Memory(cachedir=None), memory_level=0,
-                  auto_resample=False, verbose=0):
+                  auto_resample=False, verbose=0, n_jobs=1,
+                  output_file=None):
     """Concatenate a list of 3D/4D niimgs of varying lengths.
 
     The niimgs list can contain niftis/paths to images of varying dimensions
@@ -414,55 +700,90 @@ def concat_niimgs(niimgs, dtype=np.float32, ensure_ndim=None,
         Rough estimator of the amount of memory used by caching. Higher value
         means more memory for caching.
 
+    n_jobs: integer, optional
+        Number of threads used to read (and decompress) the images.
+
+    output_file: string, optional
+        Path of an uncompressed NIfTI file (.nii) to write the concatenation
+        to. The data are copied block by block into a memory map of that
+        file, so the concatenation does not need to fit in memory.
+
     Returns
     -------
     concatenated: nibabel.Nifti1Image
-        A single image.
-    """
-
-    target_fov = 'first' if auto_resample else None
+        A single image. If output_file is given, it is loaded from that
+        file and its data is memory-mapped.
 
+    Notes
+    -----
+    Every image is loaded once: headers are used to plan the output (shape,
+    offset of each image, field of view checks), then the data of each
+    image is copied into the preallocated output.
+    """
     # We remove one to the dimensionality because of the list is one dimension.
     ndim = None
     if ensure_ndim is not None:
         ndim = ensure_ndim - 1
 
-    # First niimg is extracted to get information and for new_img_like
-    first_niimg = None
-
-    iterator, literator = itertools.tee(iter(niimgs))
-    try:
-        first_niimg = check_niimg(next(literator), ensure_ndim=ndim)
-    except StopIteration:
-        raise TypeError('Cannot concatenate empty objects')
-
-    # If no particular dimensionality is asked, we force consistency wrt the
-    # first image
-    if ndim is None:
-        ndim = len(first_niimg.shape)
-
-    lengths = [first_niimg.shape[-1] if ndim == 4 else 1]
-    for niimg in literator:
-        # We check the dimensionality of the niimg
-        niimg = check_niimg(niimg, ensure_ndim=ndim)
-        lengths.append(niimg.shape[-1] if ndim == 4 else 1)
-
-    target_shape = first_niimg.shape[:3]
-    data = np.ndarray(target_shape + (sum(lengths), ),
-                      order="F", dtype=dtype)
-    cur_4d_index = 0
-    for index, (size, niimg) in enumerate(zip(lengths, _iter_check_niimg(
-            iterator, atleast_4d=True, target_fov=target_fov,
-            memory=memory, memory_level=memory_level))):
-
-        if verbose > 0:
-            if isinstance(niimg, _basestring):
-                nii_str = "image " + niimg
+    imgs, offsets, ndim = _plan_concat(niimgs, ndim=ndim)
+    first_niimg = imgs[0]
+    ref_fov = (first_niimg.get_affine(), first_niimg.shape[:3])
+
+    # Field of view checks only need the headers.
+    fov_report = check_fovs(imgs)
+    target_fovs = [None] * len(imgs)
+    if len(fov_report['indices']) > 0:
+        if not auto_resample:
+            index = fov_report['indices'][0]
+            raise ValueError(
+                "Field of view of image #%d is different from "
+                "reference FOV.\n"
+                "Reference affine:\n%r\nImage affine:\n%r\n"
+                "Reference shape:\n%r\nImage shape:\n%r\n"
+                "%d image(s) differ: %r"
+                % (index, ref_fov[0], imgs[index].get_affine(), ref_fov[1],
+                   imgs[index].shape, len(fov_report['indices']),
+                   list(fov_report['indices'])))
+        warnings.warn('Affine is different across subjects.'
+                      ' Realignement on first subject '
+                      'affine forced')
+        for index in fov_report['indices']:
+            target_fovs[index] = ref_fov
+
+    if verbose > 0:
+        for index, img in enumerate(imgs):
+            filename = img.get_filename()
+            if filename is not None:
+                nii_str = "image " + filename
             else:
                 nii_str = "image #" + str(index)
             print("Concatenating {0}: {1}".format(index + 1, nii_str))
 
-        data[..., cur_4d_index:cur_4d_index + size] = niimg.get_data()
-        cur_4d_index += size
-
-    return new_img_like(first_niimg, data, first_niimg.get_affine())
+    target_shape = ref_fov[1] + (offsets[-1], )
+
+    def fill(data):
+        # Images fill disjoint parts of the output: threads need no locking,
+        # and zlib releases the GIL while decompressing.
+        Parallel(n_jobs=n_jobs, backend='threading')(
+            delayed(_fill_concat)(data, img, start, stop,
+                                  target_fov=target_fov, memory=memory,
+                                  memory_level=memory_level)
+            for img, start, stop, target_fov in zip(
+                imgs, offsets[:-1], offsets[1:], target_fovs))
+
+    if output_file is None:
+        data = np.ndarray(target_shape, order="F", dtype=dtype)
+        fill(data)
+        return new_img_like(first_niimg, data, first_niimg.get_affine())
+
+    header = first_niimg.get_header()
+    if not isinstance(header, nibabel.Nifti1Header):
+        header = None
+    with atomic_filename(output_file) as tmp_file:
+        data = create_mmap_niimg(tmp_file, target_shape,
+                                 first_niimg.get_affine(), dtype=dtype,
+                                 header=header)
+        fill(data)
+        data.flush()
+        del data
+    return nibabel.load(output_file)
@@ -27,11 +27,40 @@ def _asarray(arr, dtype=None, order=None):
     return ret
 
 
-def as_ndarray(arr, copy=False, dtype=None, order='K'):
+def _memmap_to_ndarray(arr, dtype=None, order=None, block_bytes=2 ** 26):
+    """Copy a memmap to a new ndarray, casting and reordering on the fly.
+
+    The memmap is read along its slowest-varying axis, by contiguous blocks
+    of about block_bytes, each block being cast and reordered in a single
+    assignment into the preallocated output.
+    """
+    dtype = arr.dtype if dtype is None else np.dtype(dtype)
+    src_f_order = arr.flags["F_CONTIGUOUS"] and not arr.flags["C_CONTIGUOUS"]
+    if order not in ("C", "F"):
+        # "K", "A" or None: preserve the order of the input.
+        order = "F" if src_f_order else "C"
+    ret = np.empty(arr.shape, dtype=dtype, order=order)
+    if arr.ndim == 0 or arr.size == 0:
+        ret[...] = arr
+        return ret
+
+    axis = arr.ndim - 1 if src_f_order else 0
+    slice_bytes = arr.nbytes // arr.shape[axis]
+    step = max(1, block_bytes // max(1, slice_bytes))
+    index = [slice(None)] * arr.ndim
+    for start in range(0, arr.shape[axis], step):
+        index[axis] = slice(start, start + step)
+        ret[tuple(index)] = arr[tuple(index)]
+    return ret
+
+
+def as_ndarray(arr, copy=False, dtype=None, order='K', allow_memmap=False):
     """Starting with an arbitrary array, convert to numpy.ndarray.
 
     In the case of a memmap array, a copy is automatically made to break the
-    link with the underlying file (whatever the value of the "copy" keyword).
+    link with the underlying file (whatever the value of the "copy" keyword),
+    unless allow_memmap is True. The copy reads the file by large contiguous
+    blocks, casting and reordering each block in a single step.
 
     The purpose of this function is mainly to get rid of memmap objects, but
     it can be used for other purposes. In particular, combining copying and
@@ -70,11 +99,17 @@ def as_ndarray(arr, copy=False, dtype=None, order='K'):
         Valid values are: "C", "F", "A", "K", None.
         default is "K". See ndarray.copy() for more information.
 
+    allow_memmap: bool
+        if True and arr is a memmap that needs no conversion (and copy is
+        False), return a read-only numpy.ndarray view on the file instead of
+        a copy.
+
     Returns
     =======
     ret: numpy.ndarray
         Numpy array containing the same data as arr, always of class
-        numpy.ndarray, and with no link to any underlying file.
+        numpy.ndarray, and with no link to any underlying file (except for
+        the read-only views returned when allow_memmap is True).
     """
     # This function should work on numpy 1.3
     # in this version, astype() and copy() have no "order" keyword.
@@ -88,21 +123,17 @@ def as_ndarray(arr, copy=False, dtype=None, order='K'):
         raise ValueError("Invalid value for 'order': %s" % str(order))
 
     if isinstance(arr, np.memmap):
-        if dtype is None:
-            if order in ("K", "A", None):
-                ret = np.array(np.asarray(arr), copy=True)
-            else:
-                ret = np.array(np.asarray(arr), copy=True, order=order)
+        same_dtype = dtype is None or np.dtype(dtype) == arr.dtype
+        same_order = (order in ("K", "A", None)
+                      or order == "C" and arr.flags["C_CONTIGUOUS"]
+                      or order == "F" and arr.flags["F_CONTIGUOUS"])
+        if allow_memmap and not copy and same_dtype and same_order:
+            ret = np.asarray(arr).view()
+            ret.flags.writeable = False
         else:
-            if order in ("K", "A", None):
-                # always copy (even when dtype does not change)
-                ret = np.asarray(arr).astype(dtype)
-            else:
-                # First load data from disk without changing order
-                # Changing order while reading through a memmap is incredibly
-                # inefficient.
-                ret = np.array(arr, copy=True)
-                ret = _asarray(arr, dtype=dtype, order=order)
+            # Changing order while reading through a memmap is incredibly
+            # inefficient: read it by contiguous blocks.
+            ret = _memmap_to_ndarray(arr, dtype=dtype, order=order)
 
     elif isinstance(arr, np.ndarray):
         ret = _asarray(arr, dtype=dtype, order=order)
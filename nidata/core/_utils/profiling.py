@@ -0,0 +1,222 @@
+"""
+Opt-in timers and counters for the phases of dataset fetching.
+
+Profiling is enabled by setting the NIDATA_PROFILE environment variable
+(or with enable()). Each Dataset.fetch call then collects the time spent
+in its phases (path resolution, dependency probing, url preparation,
+download, checksum, extraction, publication...) and prints a breakdown
+when it returns; the time not spent in a known phase is the dataset's own
+post-processing. If NIDATA_PROFILE_DIR is set, a cProfile file is also
+written there for each call.
+
+Reports are attached to the thread that collects them: functions run in
+worker threads on its behalf must be wrapped with propagate(), so that
+concurrent fetches (e.g. of several datasets) keep separate reports.
+
+When profiling is disabled, phase() returns a shared no-op context manager
+and count() returns immediately, and Dataset.fetch is not wrapped.
+"""
+import collections
+import contextlib
+import cProfile
+import functools
+import os
+import threading
+import time
+
+_enabled = bool(os.environ.get('NIDATA_PROFILE'))
+_profile_dir = os.environ.get('NIDATA_PROFILE_DIR') or None
+_local = threading.local()  # phase stack and active reports of a thread
+_lock = threading.Lock()
+_last_report = None
+
+
+def enable(profile_dir=None):
+    """Enable profiling (for datasets created from now on)."""
+    global _enabled, _profile_dir
+    _enabled = True
+    _profile_dir = profile_dir or _profile_dir
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def is_enabled():
+    return _enabled
+
+
+def get_last_report():
+    """Report of the last profiled call that returned, or None."""
+    return _last_report
+
+
+class Report(object):
+    """Time, number of calls and counters by phase.
+
+    Phases are identified by their path: the names of the enclosing
+    phases of the same thread, joined by '/'.
+    """
+    def __init__(self, label):
+        self.label = label
+        self.total = 0.
+        self.times = collections.defaultdict(float)
+        self.calls = collections.defaultdict(int)
+        self.counts = collections.defaultdict(int)
+
+    def as_dict(self):
+        return {'label': self.label, 'total': self.total,
+                'times': dict(self.times), 'calls': dict(self.calls),
+                'counts': dict(self.counts)}
+
+    def update(self, other):
+        """Add the phases and counters of another report."""
+        for path, elapsed in other.times.items():
+            self.times[path] += elapsed
+            self.calls[path] += other.calls[path]
+        for name, n in other.counts.items():
+            self.counts[name] += n
+
+    def format(self):
+        lines = ['Profile of %s: %.3fs' % (self.label, self.total)]
+        for path in sorted(self.times):
+            children = sum(t for p, t in self.times.items()
+                           if p.startswith(path + '/') and
+                           '/' not in p[len(path) + 1:])
+            lines.append('  %-50s %8.3fs %6d call(s)%s' % (
+                path, self.times[path], self.calls[path],
+                ' (%.3fs own)' % (self.times[path] - children)
+                if children else ''))
+        for name in sorted(self.counts):
+            lines.append('  %-50s %8d' % (name, self.counts[name]))
+        return '\n'.join(lines)
+
+
+def _active_reports():
+    """Reports collected by the current thread (see propagate)."""
+    reports = getattr(_local, 'reports', None)
+    if reports is None:
+        reports = _local.reports = []
+    return reports
+
+
+def _record(path, elapsed):
+    with _lock:
+        for report in _active_reports():
+            report.times[path] += elapsed
+            report.calls[path] += 1
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        stack = getattr(_local, 'stack', None)
+        if stack is None:
+            stack = _local.stack = []
+        stack.append(self.name)
+        self.path = '/'.join(stack)
+        self.t0 = time.time()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _record(self.path, time.time() - self.t0)
+        _local.stack.pop()
+
+
+def phase(name):
+    """Context manager timing a phase (no-op if profiling is disabled)."""
+    if not _enabled:
+        return _NULL_PHASE
+    return _Phase(name)
+
+
+def count(name, n=1):
+    """Add n to a counter of the active reports."""
+    if not _enabled:
+        return
+    with _lock:
+        for report in _active_reports():
+            report.counts[name] += n
+
+
+@contextlib.contextmanager
+def collect(label):
+    """Collect the phases of a block in a Report."""
+    report = Report(label)
+    _active_reports().append(report)
+    t0 = time.time()
+    try:
+        yield report
+    finally:
+        report.total = time.time() - t0
+        _active_reports().remove(report)
+
+
+def propagate(func):
+    """Wrap func, to be called in a worker thread, so that its phases are
+    recorded in the reports of the calling thread, under its current
+    phase."""
+    if not _enabled or not _active_reports():
+        return func
+    reports = list(_active_reports())
+    stack = list(getattr(_local, 'stack', None) or [])
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        saved = (getattr(_local, 'reports', None),
+                 getattr(_local, 'stack', None))
+        _local.reports, _local.stack = list(reports), list(stack)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.reports, _local.stack = saved
+    return wrapper
+
+
+def profiled(func, label, init_report=None, verbose=1):
+    """Wrap func so that each call collects, prints and keeps (see
+    get_last_report) a Report of its phases. The phases of init_report
+    (e.g. the construction of the object) are added to the first one."""
+    init_reports = [init_report] if init_report is not None else []
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        global _last_report
+        profiler = None
+        if _profile_dir is not None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:  # another profiler is active
+                profiler = None
+        try:
+            with collect(label) as report:
+                with _Phase(label):
+                    return func(*args, **kwargs)
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                if not os.path.exists(_profile_dir):
+                    os.makedirs(_profile_dir)
+                profiler.dump_stats(os.path.join(
+                    _profile_dir, '%s-%d-%d.prof' % (
+                        label, os.getpid(), int(time.time() * 1000))))
+            if init_reports:
+                report.update(init_reports.pop())
+            _last_report = report
+            if kwargs.get('verbose', verbose) > 0:
+                print(report.format())
+    return wrapper
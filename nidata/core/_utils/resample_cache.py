@@ -0,0 +1,209 @@
+"""
+Cache of resampled images, with an in-memory and an on-disk tier.
+
+Resampling the same image (typically an atlas) to the same grids over and
+over is common. Results are keyed by a fingerprint of the source image
+and by the resampling parameters, kept in a small in-memory LRU cache,
+and stored as uncompressed NIfTI files in a size-bounded directory.
+
+The cache is enabled by setting the NIDATA_RESAMPLE_CACHE environment
+variable to a directory (its size is bounded by NIDATA_RESAMPLE_CACHE_SIZE,
+in MB), or with set_resample_cache().
+"""
+import collections
+import hashlib
+import os
+import threading
+
+import nibabel
+import numpy as np
+
+from .fileio import atomic_filename
+
+
+def _img_fingerprint(img):
+    """Fingerprint of an image: its header, affine and data source.
+
+    Images still backed by their file are identified by the path, size and
+    modification time of the file, without reading the data; the data of
+    other images, including data loaded from a file (which may have been
+    modified in place), is hashed.
+    """
+    m = hashlib.md5()
+    m.update(img.get_header().binaryblock)
+    m.update(np.asarray(img.get_affine(), dtype=np.float64).tobytes())
+    filename = img.get_filename()
+    loaded = getattr(img, '_data_cache', None) is not None
+    if (filename is not None and not loaded and
+            not isinstance(img.dataobj, np.ndarray)):
+        stat = os.stat(filename)
+        # Sub-second modification times, where available
+        mtime = getattr(stat, 'st_mtime_ns', repr(stat.st_mtime))
+        m.update(('%s-%d-%s' % (os.path.abspath(filename), stat.st_size,
+                                mtime)).encode('utf-8'))
+    else:
+        data = np.ascontiguousarray(img.get_data() if loaded
+                                    else img.dataobj)
+        m.update(str((data.dtype.str, data.shape)).encode('utf-8'))
+        m.update(data.view(np.uint8))
+    return m.hexdigest()
+
+
+def _freeze(img):
+    """(data, affine, header) of img, with a read-only copy of its data."""
+    data = np.array(img.dataobj)
+    data.setflags(write=False)
+    return data, img.get_affine(), img.get_header()
+
+
+class ResampleCache(object):
+    """Two-tier cache of resampled images.
+
+    The in-memory tier holds read-only data; images returned by the cache
+    get a writable copy of it.
+
+    Parameters
+    ----------
+    cache_dir: string, optional
+        Directory of the on-disk tier. If None, only the in-memory tier is
+        used.
+
+    max_disk_bytes: int, optional
+        Size above which the least recently used files of the on-disk tier
+        are removed.
+
+    max_memory_items: int, optional
+        Number of images kept in the in-memory tier.
+    """
+    def __init__(self, cache_dir=None, max_disk_bytes=2 ** 30,
+                 max_memory_items=16):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_memory_items = max_memory_items
+        self._memory = collections.OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir is not None and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+
+    def get_key(self, img, target_affine, target_shape,
+                interpolation='continuous'):
+        m = hashlib.md5()
+        m.update(_img_fingerprint(img).encode('utf-8'))
+        if target_affine is not None:
+            m.update(np.asarray(target_affine, dtype=np.float64).tobytes())
+        m.update(str((tuple(target_shape) if target_shape is not None
+                      else None, interpolation)).encode('utf-8'))
+        return m.hexdigest()
+
+    def _get_filename(self, key):
+        return os.path.join(self.cache_dir, key + '.nii')
+
+    def get(self, key):
+        """Return the cached image for key, or None."""
+        with self._lock:
+            frozen = self._memory.pop(key, None)
+            if frozen is not None:
+                self._memory[key] = frozen
+        if self.cache_dir is not None:
+            filename = self._get_filename(key)
+            try:
+                os.utime(filename, None)  # mark as recently used
+            except OSError:
+                if frozen is None:
+                    return None
+            if frozen is None:
+                frozen = self._remember(key, nibabel.load(filename))
+        if frozen is None:
+            return None
+        data, affine, header = frozen
+        # A new image for every caller, that it can modify.
+        return nibabel.Nifti1Image(data.copy(), affine.copy(), header=header)
+
+    def put(self, key, img):
+        """Store img under key in both tiers."""
+        if self.cache_dir is not None:
+            with atomic_filename(self._get_filename(key)) as tmp_file:
+                nibabel.save(img, tmp_file)
+            self._evict()
+        self._remember(key, img)
+
+    def _remember(self, key, img):
+        frozen = _freeze(img)
+        with self._lock:
+            self._memory[key] = frozen
+            while len(self._memory) > self.max_memory_items:
+                self._memory.popitem(last=False)
+        return frozen
+
+    def _evict(self):
+        """Remove least recently used files above max_disk_bytes."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.nii') or name.startswith('.'):
+                continue
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except OSError:
+                continue  # removed by another process
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total_size <= self.max_disk_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        if self.cache_dir is not None:
+            for name in os.listdir(self.cache_dir):
+                if name.endswith('.nii'):
+                    os.remove(os.path.join(self.cache_dir, name))
+
+    def resample_img(self, img, target_affine=None, target_shape=None,
+                     interpolation='continuous'):
+        """Cached version of nilearn.image.resample_img."""
+        key = self.get_key(img, target_affine, target_shape, interpolation)
+        resampled = self.get(key)
+        if resampled is None:
+            from nilearn import image
+            resampled = image.resample_img(
+                img, target_affine=target_affine, target_shape=target_shape,
+                interpolation=interpolation)
+            self.put(key, resampled)
+        return resampled
+
+
+# Until set_resample_cache is called, the cache is configured from the
+# environment.
+_FROM_ENVIRON = object()
+_resample_cache = _FROM_ENVIRON
+
+
+def set_resample_cache(resample_cache):
+    """Set the ResampleCache used by nidata (None disables caching, even
+    if NIDATA_RESAMPLE_CACHE is set)."""
+    global _resample_cache
+    _resample_cache = resample_cache
+
+
+def get_resample_cache():
+    """Return the ResampleCache used by nidata, or None if disabled.
+
+    Unless set with set_resample_cache, a cache is created on first use if
+    the NIDATA_RESAMPLE_CACHE environment variable is set.
+    """
+    global _resample_cache
+    if _resample_cache is _FROM_ENVIRON:
+        if not os.environ.get('NIDATA_RESAMPLE_CACHE'):
+            return None
+        max_disk_mb = float(os.environ.get('NIDATA_RESAMPLE_CACHE_SIZE',
+                                           1024))
+        _resample_cache = ResampleCache(
+            os.path.expanduser(os.environ['NIDATA_RESAMPLE_CACHE']),
+            max_disk_bytes=int(max_disk_mb * 2 ** 20))
+    return _resample_cache
@@ -423,6 +423,18 @@ def skip_if_running_nose(msg=''):
         raise nose.SkipTest(msg)
 
 
+def known_failure(reason):
+    """Decorator skipping a test that is known to fail (without running its
+    setup), giving the reason."""
+    def decorator(func):
+        @functools.wraps(func, updated=())
+        def skipped(*args, **kwargs):
+            import nose
+            raise nose.SkipTest('Known failure: %s' % reason)
+        return skipped
+    return decorator
+
+
 # Backport: On some nose versions, assert_less_equal is not present
 try:
     from nose.tools import assert_less_equal
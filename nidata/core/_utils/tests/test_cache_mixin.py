@@ -0,0 +1,127 @@
+"""
+Test the cache_mixin module
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+
+import numpy as np
+from nose.tools import assert_equal, assert_true
+from sklearn.externals.joblib import Memory
+
+from nidata.core._utils.cache_mixin import CacheBackend
+
+CALLS = []
+
+
+def _ones(value):
+    CALLS.append(value)
+    return np.ones(1000) * value
+
+
+def _filled_backend(cachedir, policy):
+    """Backend holding the results of _ones(0) (1 hit, last used) and
+    _ones(1) (2 hits), its budget fitting these two entries."""
+    memory = Memory(cachedir=cachedir, verbose=0)
+    backend = CacheBackend(memory.cachedir, policy=policy)
+    ones = backend.cache(memory, _ones)
+    for value in (0, 1, 1, 1, 0):
+        ones(value)
+    backend.max_bytes = backend.get_size() + 100
+    return backend, ones
+
+
+def test_cache_eviction_policies():
+    for policy, evicted in (('lru', 1), ('lfu', 0)):
+        tmp_dir = mkdtemp()
+        try:
+            backend, ones = _filled_backend(tmp_dir, policy)
+            del CALLS[:]
+            ones(2)
+            assert_equal(backend.stats['evictions'], 1)
+            ones(1 - evicted)
+            assert_equal(CALLS, [2])  # still cached
+            ones(evicted)
+            assert_equal(CALLS, [2, evicted])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+
+def test_cache_budget():
+    tmp_dir = mkdtemp()
+    try:
+        backend, ones = _filled_backend(tmp_dir, 'lru')
+        for value in range(2, 10):
+            ones(value)
+            assert_true(backend.get_size() <= backend.max_bytes)
+        assert_equal(backend.stats['evictions'], 8)
+        assert_equal(backend.stats['misses'], 10)
+
+        # Recorded sizes match the cachedir, where only 2 entries are left
+        entries = []
+        for dirpath, _, filenames in os.walk(backend.cachedir):
+            if 'output.pkl' in filenames:
+                entries.append(sum(
+                    os.path.getsize(os.path.join(dirpath, filename))
+                    for filename in filenames))
+        assert_equal(len(entries), 2)
+        assert_equal(sum(entries), backend.get_size())
+
+        # Entries are indexed when the index is created
+        os.remove(os.path.join(backend.cachedir, CacheBackend.index_file))
+        assert_equal(CacheBackend(backend.cachedir).get_size(), sum(entries))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_cache_hits():
+    tmp_dir = mkdtemp()
+    try:
+        backend, ones = _filled_backend(tmp_dir, 'lru')
+        assert_equal(backend.stats['hits'], 3)
+        assert_equal(backend.stats['misses'], 2)
+
+        # Arguments are hashed once per call
+        hashes = []
+        get_argument_hash = ones.memorized_func._get_argument_hash
+
+        def counting_hash(*args, **kwargs):
+            hashes.append(args)
+            return get_argument_hash(*args, **kwargs)
+        ones.memorized_func._get_argument_hash = counting_hash
+        del CALLS[:]
+        ones(1)
+        assert_equal(CALLS, [])
+        assert_equal(len(hashes), 1)
+        assert_equal(backend.stats['hits'], 4)
+
+        # The index is opened again in a forked process
+        conn = backend._conn
+        backend._pid = -1
+        assert_equal(backend.get_size(), backend.max_bytes - 100)
+        assert_true(backend._conn is not conn)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_cache_stale_namespaces():
+    tmp_dir = mkdtemp()
+    try:
+        memory = Memory(cachedir=tmp_dir, verbose=0)
+        stale_dir = os.path.join(memory.cachedir, 'nibabel_0.1', 'f', 'a')
+        os.makedirs(stale_dir)
+        with open(os.path.join(stale_dir, 'output.pkl'), 'wb') as fp:
+            fp.write(b'0' * 100)
+        other_dir = os.path.join(memory.cachedir, 'nidata')
+        os.makedirs(other_dir)
+
+        # Removed without a size budget, with their index entries
+        backend = CacheBackend(memory.cachedir)
+        assert_equal(backend.get_size(), 100)
+        backend.cache(memory, _ones)(0)
+        assert_true(not os.path.exists(os.path.dirname(
+            os.path.dirname(stale_dir))))
+        assert_true(os.path.exists(other_dir))
+        assert_equal(len(backend._execute('SELECT path FROM entries')), 1)
+    finally:
+        shutil.rmtree(tmp_dir)
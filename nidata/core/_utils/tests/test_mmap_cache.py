@@ -0,0 +1,34 @@
+"""
+Test the mmap_cache module
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+
+import nibabel
+import numpy as np
+from nose.tools import assert_equal, assert_true
+
+from nidata.core._utils.mmap_cache import decompress_niimg, load_mmap_niimg
+
+
+def test_decompress_niimg():
+    tmp_dir = mkdtemp()
+    try:
+        data = np.arange(60, dtype=np.int16).reshape((3, 4, 5))
+        img = nibabel.Nifti1Image(data, np.diag([2., 2., 2., 1.]))
+        img.get_header().set_slope_inter(.5, 3.)
+        filename = os.path.join(tmp_dir, 'img.nii.gz')
+        nibabel.save(img, filename)
+
+        cached_file = decompress_niimg(filename, cache_dir=tmp_dir)
+        assert_true(cached_file.endswith('.nii'))
+        assert_equal(decompress_niimg(filename, cache_dir=tmp_dir),
+                     cached_file)
+        cached_img = load_mmap_niimg(filename, cache_dir=tmp_dir)
+        np.testing.assert_array_equal(cached_img.get_data(),
+                                      nibabel.load(filename).get_data())
+        np.testing.assert_array_equal(cached_img.get_affine(),
+                                      img.get_affine())
+    finally:
+        shutil.rmtree(tmp_dir)
@@ -0,0 +1,193 @@
+"""
+Test the niimg module
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+
+import nibabel
+import numpy as np
+from nose.tools import assert_equal, assert_true, assert_false
+
+from nidata.core._utils.niimg import (check_fovs, check_niimg, concat_niimgs,
+                                     _iter_volume_chunks)
+from nidata.core._utils.testing import assert_raises_regex
+
+AFFINE = np.diag([2., 2., 2., 1.])
+SHAPE = (5, 6, 4)
+
+
+def _make_imgs(lengths, rng):
+    """In-memory images with the given number of volumes (None for 3D),
+    with their data as 4D arrays."""
+    imgs, datas = [], []
+    for length in lengths:
+        shape = SHAPE if length is None else SHAPE + (length, )
+        data = rng.rand(*shape)
+        imgs.append(nibabel.Nifti1Image(data, AFFINE))
+        datas.append(data.reshape(SHAPE + (-1, )))
+    return imgs, datas
+
+
+def _save_imgs(imgs, tmp_dir):
+    """Save images as .nii.gz (scaled int16) and .nii (float32) files;
+    return the file names and their data."""
+    filenames, datas = [], []
+    for index, img in enumerate(imgs):
+        if index % 2:
+            data = img.get_data().astype(np.float32)
+            ext = '.nii'
+        else:
+            data = np.round(img.get_data() * 100).astype(np.int16)
+            ext = '.nii.gz'
+        filename = os.path.join(tmp_dir, 'img%d%s' % (index, ext))
+        file_img = nibabel.Nifti1Image(data, AFFINE)
+        if ext == '.nii.gz':
+            file_img.get_header().set_slope_inter(.5, 3.)
+        nibabel.save(file_img, filename)
+        filenames.append(filename)
+        datas.append(nibabel.load(filename).get_data().reshape(
+            SHAPE + (-1, )))
+    return filenames, datas
+
+
+def test_concat_niimgs():
+    rng = np.random.RandomState(42)
+    # 4D images of different lengths
+    imgs, datas = _make_imgs([3, 1, 2], rng)
+    concatenated = concat_niimgs(imgs)
+    assert_equal(concatenated.get_data().dtype, np.float32)
+    np.testing.assert_array_almost_equal(concatenated.get_data(),
+                                         np.concatenate(datas, axis=3))
+
+    # 3D images, and a single-scan 4D image used as a 3D image
+    imgs, datas = _make_imgs([None, 1, None], rng)
+    for n_jobs in (1, 2):
+        concatenated = concat_niimgs(imgs, ensure_ndim=4, n_jobs=n_jobs)
+        np.testing.assert_array_almost_equal(concatenated.get_data(),
+                                             np.concatenate(datas, axis=3))
+
+
+def test_concat_niimgs_nested():
+    rng = np.random.RandomState(42)
+    imgs, datas = _make_imgs([None, None, 2], rng)
+    # Nested lists are concatenated first, as check_niimg does.
+    concatenated = concat_niimgs([imgs[:2], imgs[2]])
+    np.testing.assert_array_almost_equal(concatenated.get_data(),
+                                         np.concatenate(datas, axis=3))
+
+
+def test_concat_niimgs_files():
+    rng = np.random.RandomState(42)
+    tmp_dir = mkdtemp()
+    try:
+        imgs, _ = _make_imgs([3, 1, 2, 4], rng)
+        filenames, datas = _save_imgs(imgs, tmp_dir)
+        expected = np.concatenate(datas, axis=3)
+        # Mix of streamed files and in-memory images.
+        mixed = filenames[:2] + imgs[2:]
+        expected_mixed = np.concatenate(
+            datas[:2] + [img.get_data() for img in imgs[2:]], axis=3)
+        concatenated = concat_niimgs(mixed)
+        np.testing.assert_array_almost_equal(concatenated.get_data(),
+                                             expected_mixed)
+
+        output_file = os.path.join(tmp_dir, 'concat.nii')
+        concatenated = concat_niimgs(filenames, output_file=output_file,
+                                     n_jobs=2)
+        assert_true(os.path.exists(output_file))
+        np.testing.assert_array_almost_equal(concatenated.get_data(),
+                                             expected)
+        np.testing.assert_array_equal(concatenated.get_affine(), AFFINE)
+
+        imgs, _ = _make_imgs([None, None, None], rng)
+        filenames, datas = _save_imgs(imgs, tmp_dir)
+        concatenated = concat_niimgs(filenames)
+        np.testing.assert_array_almost_equal(concatenated.get_data(),
+                                             np.concatenate(datas, axis=3))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_iter_volume_chunks():
+    rng = np.random.RandomState(42)
+    tmp_dir = mkdtemp()
+    try:
+        imgs, _ = _make_imgs([5, 5], rng)
+        filenames, datas = _save_imgs(imgs, tmp_dir)
+        for filename, data in zip(filenames, datas):
+            chunks = list(_iter_volume_chunks(nibabel.load(filename), 2))
+            assert_equal([chunk.shape[3] for chunk in chunks], [2, 2, 1])
+            np.testing.assert_array_equal(np.concatenate(chunks, axis=3),
+                                          data)
+            # Chunks can be modified in place.
+            chunks[0][:] = 0
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_check_niimg_iterator():
+    rng = np.random.RandomState(42)
+    tmp_dir = mkdtemp()
+    try:
+        imgs, _ = _make_imgs([4, 3], rng)
+        filenames, datas = _save_imgs(imgs, tmp_dir)
+        for filename, data in zip(filenames, datas):
+            volumes = list(check_niimg(filename, return_iterator=True))
+            assert_equal(len(volumes), data.shape[3])
+            for index, volume in enumerate(volumes):
+                np.testing.assert_array_equal(volume.get_data(),
+                                              data[..., index])
+                volume.get_data()[0] = 0  # writable
+
+            # Loaded data is sliced rather than read again.
+            img = nibabel.load(filename)
+            cache = img.get_data()
+            for volume in check_niimg(img, return_iterator=True):
+                assert_true(np.may_share_memory(volume.get_data(), cache))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_check_fovs():
+    rng = np.random.RandomState(42)
+    imgs, _ = _make_imgs([None, 3, None], rng)
+    report = check_fovs(imgs)
+    assert_false(report['mismatch'].any())
+    assert_equal(report['target_shape'], SHAPE)
+    np.testing.assert_array_equal(report['target_affine'], AFFINE)
+
+    # Shape mismatch
+    other = nibabel.Nifti1Image(np.zeros((5, 6, 5)), AFFINE)
+    report = check_fovs(imgs + [other])
+    assert_equal(list(report['indices']), [3])
+    assert_equal(list(report['shape_mismatch']), [False] * 3 + [True])
+
+    # Affine mismatch, within and beyond the tolerance
+    close, far = AFFINE.copy(), AFFINE.copy()
+    close[0, 3] += 1e-9
+    far[0, 3] += 1e-3
+    imgs = [imgs[0], nibabel.Nifti1Image(np.zeros(SHAPE), close),
+            nibabel.Nifti1Image(np.zeros(SHAPE), far)]
+    report = check_fovs(imgs)
+    assert_equal(list(report['indices']), [2])
+    assert_false(report['shape_mismatch'].any())
+    np.testing.assert_almost_equal(report['affine_max_diff'],
+                                   [0., 1e-9, 1e-3])
+    assert_false(check_fovs(imgs, atol=1e-2)['mismatch'].any())
+
+    # Explicit reference, for files read from their headers only
+    tmp_dir = mkdtemp()
+    try:
+        filenames, _ = _save_imgs(imgs[:1] * 2, tmp_dir)
+        report = check_fovs(filenames, target_shape=SHAPE,
+                            target_affine=np.diag([3., 3., 3., 1.]))
+        assert_equal(list(report['indices']), [0, 1])
+        assert_false(report['shape_mismatch'].any())
+        report = check_fovs(filenames, target_shape=(5, 6, 5))
+        assert_equal(list(report['shape_mismatch']), [True, True])
+        np.testing.assert_array_equal(report['affine_max_diff'], 0.)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+    assert_raises_regex(TypeError, 'empty', check_fovs, [])
@@ -0,0 +1,88 @@
+"""
+Test the numpy_conversions module
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+
+import numpy as np
+from nose.tools import assert_equal, assert_true, assert_false, assert_raises
+
+from nidata.core._utils.numpy_conversions import (as_ndarray,
+                                                   _memmap_to_ndarray)
+
+
+def _memmap(filename, data, order):
+    arr = np.memmap(filename, dtype=data.dtype, mode='w+', shape=data.shape,
+                    order=order)
+    arr[:] = data
+    return arr
+
+
+def _check_order(arr, order):
+    if order == 'F':
+        assert_true(arr.flags['F_CONTIGUOUS'])
+    else:
+        assert_true(arr.flags['C_CONTIGUOUS'])
+
+
+def test_memmap_to_ndarray():
+    rng = np.random.RandomState(42)
+    data = (rng.rand(7, 5, 3) * 100).astype(np.float64)
+    tmp_dir = mkdtemp()
+    try:
+        for src_order in ('C', 'F'):
+            arr = _memmap(os.path.join(tmp_dir, src_order), data, src_order)
+            for dtype in (None, np.float32, np.int16):
+                expected = data if dtype is None else data.astype(dtype)
+                for order in ('C', 'F', 'A', 'K', None):
+                    # Blocks of one slice, several slices and the whole array
+                    for block_bytes in (1, 200, 2 ** 26):
+                        ret = _memmap_to_ndarray(arr, dtype=dtype,
+                                                 order=order,
+                                                 block_bytes=block_bytes)
+                        assert_equal(type(ret), np.ndarray)
+                        assert_equal(ret.dtype, expected.dtype)
+                        _check_order(ret, src_order if order in
+                                     ('A', 'K', None) else order)
+                        np.testing.assert_array_equal(ret, expected)
+                        assert_false(np.may_share_memory(ret, arr))
+
+                    ret = as_ndarray(arr, dtype=dtype, order=order)
+                    assert_equal(type(ret), np.ndarray)
+                    assert_equal(ret.dtype, expected.dtype)
+                    np.testing.assert_array_equal(ret, expected)
+                    assert_true(ret.flags.writeable)
+            del arr
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_as_ndarray_allow_memmap():
+    data = np.arange(24, dtype=np.float32).reshape((4, 6))
+    tmp_dir = mkdtemp()
+    try:
+        arr = _memmap(os.path.join(tmp_dir, 'data'), data, 'C')
+        for order in ('C', 'K', 'A', None):
+            ret = as_ndarray(arr, order=order, allow_memmap=True)
+            assert_equal(type(ret), np.ndarray)
+            assert_true(np.may_share_memory(ret, arr))
+            assert_false(ret.flags.writeable)
+            assert_raises(ValueError, ret.__setitem__, 0, 0)
+            np.testing.assert_array_equal(ret, data)
+        # The memmap itself stays writable
+        arr[0, 0] = -1
+        assert_equal(ret[0, 0], -1)
+
+        # Conversions and copies are writable arrays of their own
+        for kwargs in (dict(dtype=np.float64, allow_memmap=True),
+                       dict(order='F', allow_memmap=True),
+                       dict(copy=True, allow_memmap=True), dict()):
+            ret = as_ndarray(arr, **kwargs)
+            assert_equal(type(ret), np.ndarray)
+            assert_false(np.may_share_memory(ret, arr))
+            assert_true(ret.flags.writeable)
+            np.testing.assert_array_equal(ret, arr)
+        del arr, ret
+    finally:
+        shutil.rmtree(tmp_dir)
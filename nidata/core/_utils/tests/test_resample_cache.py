@@ -0,0 +1,116 @@
+"""
+Test the resample_cache module
+"""
+import os
+import shutil
+from tempfile import mkdtemp
+
+import nibabel
+import numpy as np
+from nose.tools import assert_equal, assert_true
+
+from nidata.core._utils import resample_cache
+from nidata.core._utils.resample_cache import ResampleCache
+
+
+def _img(value=1., shape=(4, 5, 6)):
+    return nibabel.Nifti1Image(np.ones(shape, dtype=np.float32) * value,
+                               np.eye(4))
+
+
+def test_resample_cache_tiers():
+    tmp_dir = mkdtemp()
+    try:
+        cache = ResampleCache(tmp_dir, max_memory_items=2)
+        key = cache.get_key(_img(), np.eye(4) * 2, (2, 2, 3))
+        assert_true(cache.get(key) is None)
+        cache.put(key, _img(3.))
+
+        # In-memory hits are distinct images with their own writable data.
+        first, second = cache.get(key), cache.get(key)
+        assert_true(first is not second)
+        np.testing.assert_array_equal(first.get_data(), 3.)
+        first.get_data()[0] = 0.
+        np.testing.assert_array_equal(second.get_data(), 3.)
+        np.testing.assert_array_equal(cache.get(key).get_data(), 3.)
+
+        # On-disk hits, e.g. from another process.
+        img = ResampleCache(tmp_dir).get(key)
+        np.testing.assert_array_equal(img.get_data(), 3.)
+        img.get_data()[0] = 0.
+
+        # Without a directory, only the most recent images are kept.
+        cache = ResampleCache(max_memory_items=2)
+        for value in range(3):
+            cache.put(str(value), _img(value))
+        assert_true(cache.get('0') is None)
+        assert_true(cache.get('2') is not None)
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_resample_cache_key():
+    tmp_dir = mkdtemp()
+    try:
+        cache = ResampleCache()
+        filename = os.path.join(tmp_dir, 'img.nii')
+        nibabel.save(_img(1.), filename)
+        key = cache.get_key(nibabel.load(filename), None, (2, 2, 2))
+        assert_equal(cache.get_key(nibabel.load(filename), None, (2, 2, 2)),
+                     key)
+        assert_true(cache.get_key(nibabel.load(filename), None,
+                                  (2, 2, 3)) != key)
+        assert_true(cache.get_key(nibabel.load(filename), None, (2, 2, 2),
+                                  interpolation='nearest') != key)
+
+        # Data loaded from the file, then modified in place, is hashed.
+        img = nibabel.load(filename)
+        img.get_data()[0] = 2.
+        assert_true(cache.get_key(img, None, (2, 2, 2)) != key)
+
+        # A modified source file invalidates its entries, even within the
+        # same second.
+        stat = os.stat(filename)
+        nibabel.save(_img(2.), filename)
+        os.utime(filename, (stat.st_atime, stat.st_mtime + .01))
+        assert_true(cache.get_key(nibabel.load(filename), None,
+                                  (2, 2, 2)) != key)
+
+        # In-memory images are keyed by their data.
+        assert_equal(cache.get_key(_img(1.), None, (2, 2, 2)),
+                     cache.get_key(_img(1.), None, (2, 2, 2)))
+        assert_true(cache.get_key(_img(1.), None, (2, 2, 2)) !=
+                    cache.get_key(_img(2.), None, (2, 2, 2)))
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_resample_cache_eviction():
+    tmp_dir = mkdtemp()
+    try:
+        cache = ResampleCache(tmp_dir)
+        for value in range(2):
+            cache.put(str(value), _img(value))
+            # Distinct modification times for the LRU order.
+            os.utime(os.path.join(tmp_dir, '%d.nii' % value), (value, value))
+        cache.max_disk_bytes = os.path.getsize(
+            os.path.join(tmp_dir, '0.nii')) * 2
+        cache.get('0')  # recently used
+        cache.put('2', _img(2.))
+        assert_equal(sorted(os.listdir(tmp_dir)), ['0.nii', '2.nii'])
+    finally:
+        shutil.rmtree(tmp_dir)
+
+
+def test_set_resample_cache():
+    os.environ['NIDATA_RESAMPLE_CACHE'] = mkdtemp()
+    try:
+        resample_cache.set_resample_cache(None)
+        assert_true(resample_cache.get_resample_cache() is None)
+
+        cache = ResampleCache()
+        resample_cache.set_resample_cache(cache)
+        assert_true(resample_cache.get_resample_cache() is cache)
+    finally:
+        resample_cache.set_resample_cache(resample_cache._FROM_ENVIRON)
+        shutil.rmtree(os.environ.pop('NIDATA_RESAMPLE_CACHE'))
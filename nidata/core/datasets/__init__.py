@@ -3,7 +3,9 @@
 import inspect
 import os
 
-from ..objdep import DependenciesMeta
+from .._utils import profiling
+from .._utils.profiling import phase
+from ..objdep import DependenciesMeta, install_missing_dependencies
 
 
 def get_dataset_descr(ds_path, ds_name):
@@ -97,19 +99,56 @@ def get_dataset_dir(dataset_name, data_dir=None, env_vars=[],
                   'directories, but:' + ''.join(errors))
 
 
+def get_dataset_classes():
+    """Return the Dataset classes of nidata that implement fetch, by name."""
+    import nidata  # noqa (imports all dataset modules)
+
+    def _func(method):
+        return getattr(method, '__func__', method)
+
+    classes = {}
+    todo = [Dataset]
+    while todo:
+        klass = todo.pop()
+        todo.extend(klass.__subclasses__())
+        if _func(klass.fetch) is not _func(Dataset.fetch):
+            classes[klass.__name__] = klass
+    return classes
+
+
 class Dataset(object):
     __metaclass__ = DependenciesMeta
     dependencies = []
+    # Probed in _init, so that profiling reports it with the construction.
+    check_dependencies_on_init = False
+    # Options of the synthetic files replacing downloads (see
+    # nidata.core.fetchers.synthetic), by filename pattern.
+    synthetic_specs = {}
 
     def __init__(self, data_dir=None):
+        if profiling.is_enabled():
+            # Report the construction with the first fetch.
+            label = '%s.fetch' % self.__class__.__name__
+            with profiling.collect('%s.__init__' % label) as report:
+                self._init(data_dir)
+            self.fetch = profiling.profiled(self.fetch, label,
+                                            init_report=report)
+        else:
+            self._init(data_dir)
+
+    def _init(self, data_dir):
+        if isinstance(type(self), DependenciesMeta):  # see __metaclass__
+            install_missing_dependencies(self.__class__)
         class_path = os.path.dirname(inspect.getfile(self.__class__))
 
         self.name = os.path.basename(class_path)
         self.modality = os.path.basename(os.path.dirname(class_path))  # assume
-        self.description = get_dataset_descr(ds_path=class_path,
-                                             ds_name=self.name)
+        with phase('describe'):
+            self.description = get_dataset_descr(ds_path=class_path,
+                                                 ds_name=self.name)
 
-        self.data_dir = get_dataset_dir(self.name, data_dir=data_dir)
+        with phase('get_dataset_dir'):
+            self.data_dir = get_dataset_dir(self.name, data_dir=data_dir)
 
         self.fetcher = getattr(self, 'fetcher', None)
 
@@ -123,4 +162,11 @@ class HttpDataset(Dataset):
         """
         from ..fetchers import HttpFetcher  # avoid circular import
         super(HttpDataset, self).__init__(data_dir=data_dir)
-        self.fetcher = HttpFetcher(data_dir=self.data_dir)
+        if os.environ.get('NIDATA_SYNTHETIC'):
+            from ..fetchers.synthetic import SyntheticFetcher
+            self.fetcher = SyntheticFetcher(
+                data_dir=self.data_dir,
+                scale=float(os.environ['NIDATA_SYNTHETIC']),
+                specs=self.synthetic_specs)
+        else:
+            self.fetcher = HttpFetcher(data_dir=self.data_dir)
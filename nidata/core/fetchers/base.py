@@ -8,6 +8,7 @@ Utilities to download NeuroImaging datasets
 import contextlib
 import collections
 import os
+import posixpath
 import tarfile
 import zipfile
 import sys
@@ -18,6 +19,7 @@ import fnmatch
 import warnings
 import re
 import base64
+import json
 
 import numpy as np
 from scipy import ndimage
@@ -25,6 +27,7 @@ from sklearn.datasets.base import Bunch
 
 from ..objdep import DependenciesMeta
 from .._utils.compat import _basestring, BytesIO, cPickle, _urllib, md5_hash
+from .._utils.fileio import atomic_filename
 from ..datasets import get_dataset_dir
 
 
@@ -48,6 +51,49 @@ def md5_sum_file(path):
     return m.hexdigest()
 
 
+def cached_md5_sum_file(path):
+    """ Calculates the MD5 sum of a file, memoized in a sidecar file.
+
+    The sum is stored with the size and modification time of the file in
+    a hidden '.<name>.md5' file next to it, and is only computed again
+    when they change.
+    """
+    stat = os.stat(path)
+    signature = '%d %r' % (stat.st_size, stat.st_mtime)
+    sidecar = _md5_sidecar(path)
+    try:
+        with open(sidecar, 'r') as f:
+            cached_signature, md5 = f.read().rsplit(' ', 1)
+        if cached_signature == signature:
+            return md5
+    except (IOError, OSError, ValueError):
+        pass
+
+    md5 = md5_sum_file(path)
+    try:
+        with atomic_filename(sidecar) as tmp_sidecar:
+            with open(tmp_sidecar, 'w') as f:
+                f.write('%s %s' % (signature, md5))
+    except (IOError, OSError):
+        pass  # read-only data directory: don't memoize
+    return md5
+
+
+def _md5_sidecar(path):
+    dirname, basename = os.path.split(path)
+    return os.path.join(dirname, '.%s.md5' % basename)
+
+
+def remove_checksummed_file(path):
+    """ Removes a file, and its MD5 sum memoized by cached_md5_sum_file.
+    """
+    os.remove(path)
+    try:
+        os.remove(_md5_sidecar(path))
+    except OSError:
+        pass
+
+
 def readmd5_sum_file(path):
     """ Reads a MD5 checksum file and returns hashes as a dictionary.
     """
@@ -192,6 +238,44 @@ def chunk_report(bytes_so_far, total_size, initial_size, t0):
                format_time(time_remaining)))
 
 
+def get_mirrors():
+    """Return the url-rewrite table set in NIDATA_MIRRORS.
+
+    NIDATA_MIRRORS is either the path of a JSON file mapping upstream url
+    prefixes to mirror url roots, or a list of 'prefix=root' entries
+    separated by ';'. Roots can be http(s):// or file:// urls. The special
+    prefix '*' maps all urls to a mirror of a nidata data directory (such
+    as the one served by nidata.core.fetchers.mirror_server): files are then
+    downloaded from <root>/<dataset name>/<file>, and archives from
+    <root>/<dataset name>/<archive name> (the mirror must keep them, see
+    the delete_archive option of fetch_files) unless another prefix of
+    their url is mirrored.
+
+    Returns a list of (prefix, root), longest prefixes first.
+    """
+    mirrors = os.environ.get('NIDATA_MIRRORS', '').strip()
+    if not mirrors:
+        return []
+    if os.path.isfile(mirrors):
+        with open(mirrors, 'r') as fp:
+            mirrors = list(json.load(fp).items())
+    else:
+        mirrors = [entry.strip().split('=', 1)
+                   for entry in mirrors.split(';') if entry.strip()]
+    return sorted(((prefix, root) for prefix, root in mirrors),
+                  key=lambda mirror: len(mirror[0]), reverse=True)
+
+
+def rewrite_url(url, mirrors=None):
+    """Replace the longest upstream prefix of url by its mirror root."""
+    if mirrors is None:
+        mirrors = get_mirrors()
+    for prefix, root in mirrors:
+        if prefix != '*' and url.startswith(prefix):
+            return root + url[len(prefix):]
+    return url
+
+
 class Fetcher(object):
     __metaclass__ = DependenciesMeta
     dependencies = []
@@ -201,6 +285,36 @@ class Fetcher(object):
         if verbose > 0 and not os.path.exists(self.data_dir):
             print("Files will be downloaded to %s" % self.data_dir)
 
+    def apply_mirrors(self, files, mirrors=None):
+        """Rewrite the urls of (file, url, opts) entries to their mirror
+        (see get_mirrors)."""
+        if mirrors is None:
+            mirrors = get_mirrors()
+        tree_root = dict(mirrors).get('*')
+        if tree_root is not None:
+            tree_root = '%s/%s/' % (tree_root.rstrip('/'), _urllib.parse.quote(
+                os.path.basename(self.data_dir.rstrip(os.sep))))
+        out_files = []
+        for file_, url, opts in files:
+            mirror_url = rewrite_url(url, mirrors)
+            if tree_root is None:
+                out_files.append((file_, mirror_url, opts))
+            elif opts.get('uncompress'):
+                # The target is extracted (often a directory): fetch the
+                # archive, kept by the mirror under its url basename,
+                # unless a prefix of the url is mirrored.
+                if mirror_url == url:
+                    mirror_url = tree_root + posixpath.basename(
+                        _urllib.parse.urlparse(url).path)
+                out_files.append((file_, mirror_url, opts))
+            else:
+                # The mirror holds the fetched files themselves.
+                path = '/'.join(file_.split(os.sep))
+                out_files.append((file_,
+                                  tree_root + _urllib.parse.quote(path),
+                                  dict(opts, keep_path=True)))
+        return out_files
+
     @classmethod
     def reformat_files(cls, files):
         """ Takes an iterable, and puts into the expected format of
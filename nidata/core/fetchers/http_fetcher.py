@@ -14,15 +14,36 @@ import fnmatch
 import warnings
 import re
 import base64
+import errno
+import json
+import subprocess
 from functools import partial
+try:
+    from shutil import which as find_executable
+except ImportError:  # python 2
+    from distutils.spawn import find_executable
 
 import nibabel as nib
 import numpy as np
 from scipy import ndimage
 from sklearn.datasets.base import Bunch
+from sklearn.externals.joblib import Parallel, delayed, cpu_count
 
 from .._utils.compat import _basestring, BytesIO, cPickle, _urllib, md5_hash
-from .base import chunk_report, Fetcher
+from .._utils.fileio import FileLock, atomic_filename
+from .._utils.profiling import count, phase, propagate
+from .base import (_md5_sidecar, cached_md5_sum_file, chunk_report, Fetcher,
+                   remove_checksummed_file)
+
+
+# Seconds after which the download lock of a crashed process (on another
+# host; on the same host, dead owners are detected immediately) is broken.
+# Live locks are refreshed every quarter of this time.
+LOCK_STALE_AGE = float(os.environ.get('NIDATA_LOCK_STALE_AGE', 120))
+
+# External gzip decompressor (pigz decompresses in a separate thread from
+# reading and writing); set NIDATA_GZIP to '' to always use the gzip module.
+GZIP_COMMAND = os.environ.get('NIDATA_GZIP', find_executable('pigz'))
 
 
 def movetree(src, dst):
@@ -54,6 +75,91 @@ def movetree(src, dst):
         raise Exception(errors)
 
 
+def _plan_publish(src, dst, renames):
+    """List the renames moving the content of src into dst.
+
+    Entries absent from dst are moved with a single rename, whole
+    directories included; only directories present on both sides are
+    merged member by member.
+    """
+    for name in sorted(os.listdir(src)):
+        srcname = os.path.join(src, name)
+        dstname = os.path.join(dst, name)
+        if os.path.isdir(srcname) and os.path.isdir(dstname):
+            _plan_publish(srcname, dstname, renames)
+        else:
+            renames.append((srcname, dstname))
+    return renames
+
+
+def _rename_over(src, dst):
+    """Rename src to dst, replacing dst if it exists.
+
+    Directories that appeared at dst since the publication was planned
+    (e.g. published by a concurrent fetch) are merged, not replaced.
+    """
+    if os.path.isdir(src) and os.path.isdir(dst):
+        for srcname, dstname in _plan_publish(src, dst, []):
+            _rename_over(srcname, dstname)
+        return
+    if os.path.isdir(dst) and not os.path.islink(dst):
+        shutil.rmtree(dst)
+    elif os.path.lexists(dst) and (os.name == 'nt' or os.path.isdir(src)):
+        os.remove(dst)
+    try:
+        os.rename(src, dst)
+    except OSError as e:
+        # A directory was published at dst since it was checked
+        if (e.errno not in (errno.ENOTEMPTY, errno.EEXIST) or
+                not os.path.isdir(src) or not os.path.isdir(dst)):
+            raise
+        _rename_over(src, dst)
+
+
+def _complete_publish(journal, verbose=1):
+    """Replay the renames of an interrupted publish_tree, then remove its
+    staging directory and journal."""
+    try:
+        with open(journal, 'r') as fp:
+            plan = json.load(fp)
+    except (IOError, OSError):
+        return  # completed by another process
+    except ValueError:
+        os.remove(journal)  # never fully written: nothing was renamed
+        return
+    root = os.path.dirname(journal)
+    if verbose > 0:
+        print('Completing the interrupted publication of %s'
+              % os.path.join(root, plan['staging']))
+    for src, dst in plan['renames']:
+        src = os.path.join(root, src)
+        if os.path.lexists(src):
+            _rename_over(src, os.path.join(root, dst))
+    shutil.rmtree(os.path.join(root, plan['staging']), ignore_errors=True)
+    os.remove(journal)
+
+
+def publish_tree(src, dst, journal):
+    """Move the content of src into dst, then remove src.
+
+    src must be on the same filesystem as dst (e.g. a staging directory
+    inside it). New files and directories are published with one rename
+    each; existing files are overwritten. The renames are recorded in the
+    journal file first, so that an interrupted publication is completed by
+    _complete_publish on the next call.
+    """
+    if not os.path.exists(dst):
+        os.makedirs(dst)
+    root = os.path.dirname(journal)
+    renames = [(os.path.relpath(s, root), os.path.relpath(d, root))
+               for s, d in _plan_publish(src, dst, [])]
+    with atomic_filename(journal) as tmp_journal:
+        with open(tmp_journal, 'w') as fp:
+            json.dump({'staging': os.path.relpath(src, root),
+                       'renames': renames}, fp)
+    _complete_publish(journal, verbose=0)
+
+
 def _tree(path, pattern=None, dictionary=False):
     """ Return a directory tree under the form of a dictionaries and list
 
@@ -149,10 +255,65 @@ def _chunk_read_(response, local_file, chunk_size=8192, report_hook=None,
         if report_hook:
             chunk_report(bytes_so_far, total_size, initial_size, t0)
 
+    count('bytes_downloaded', bytes_so_far - initial_size)
     return
 
 
-def _uncompress_file(file_, delete_archive=True, verbose=1):
+def _extract_zip_members(file_, members, data_dir):
+    # Each worker reads the archive through its own file handle.
+    with contextlib.closing(zipfile.ZipFile(file_)) as z:
+        for member in members:
+            z.extract(member, data_dir)
+
+
+def _extract_zip(file_, data_dir, n_jobs=1):
+    """Extract a zip file, decompressing members in n_jobs threads
+    (members are compressed independently; zlib releases the GIL)."""
+    with contextlib.closing(zipfile.ZipFile(file_)) as z:
+        members = z.infolist()
+        if n_jobs < 0:
+            n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+        n_jobs = min(n_jobs, len(members))
+        if n_jobs <= 1:
+            z.extractall(data_dir)
+            return
+    # Create the directories beforehand, so that workers don't race to.
+    data_dir = os.path.abspath(data_dir)
+    for member in members:
+        dirname = os.path.normpath(os.path.join(
+            data_dir, os.path.dirname(member.filename)))
+        if dirname.startswith(data_dir) and not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+    # Deal members largest first, so that workers get similar loads.
+    members.sort(key=lambda m: m.file_size, reverse=True)
+    Parallel(n_jobs=n_jobs, backend='threading')(
+        delayed(_extract_zip_members)(file_, members[i::n_jobs], data_dir)
+        for i in range(n_jobs))
+
+
+def _gunzip(file_, out_filename):
+    """Decompress a gzip file, with GZIP_COMMAND if available."""
+    if GZIP_COMMAND:
+        try:
+            with open(out_filename, 'wb') as out:
+                if subprocess.call([GZIP_COMMAND, '-dc', file_],
+                                   stdout=out) == 0:
+                    return
+        except OSError:
+            pass
+    import gzip
+    gz = gzip.open(file_)
+    out = open(out_filename, 'wb')
+    shutil.copyfileobj(gz, out, 8192)
+    gz.close()
+    out.close()
+
+
+def _uncompress_file(file_, delete_archive=True, verbose=1, n_jobs=1):
     """Uncompress files contained in a data_set.
 
     Parameters
@@ -167,6 +328,9 @@ def _uncompress_file(file_, delete_archive=True, verbose=1):
     verbose: int, optional
         verbosity level (0 means no message).
 
+    n_jobs: int, optional
+        Number of threads decompressing the members of zip files.
+
     Notes
     -----
     This handles zip, tar, gzip and bzip files only.
@@ -174,6 +338,7 @@ def _uncompress_file(file_, delete_archive=True, verbose=1):
     if verbose > 0:
         print('Extracting data from %s...' % file_)
     data_dir = os.path.dirname(file_)
+    archive = file_
     # We first try to see if it is a zip file
     try:
         filename, ext = os.path.splitext(file_)
@@ -181,23 +346,14 @@ def _uncompress_file(file_, delete_archive=True, verbose=1):
             header = fd.read(4)
         processed = False
         if zipfile.is_zipfile(file_):
-            z = zipfile.ZipFile(file_)
-            z.extractall(data_dir)
-            z.close()
+            _extract_zip(file_, data_dir, n_jobs=n_jobs)
             processed = True
         elif ext == '.gz' or header.startswith(b'\x1f\x8b'):
-            import gzip
-            gz = gzip.open(file_)
             if ext == '.tgz':
                 filename = filename + '.tar'
-            out = open(filename, 'wb')
-            shutil.copyfileobj(gz, out, 8192)
-            gz.close()
-            out.close()
+            _gunzip(file_, filename)
 
             # If file is .tar.gz, this will be handle in the next case
-            if delete_archive:
-                os.remove(file_)
             file_ = filename
             filename, ext = os.path.splitext(file_)
             processed = True
@@ -206,11 +362,13 @@ def _uncompress_file(file_, delete_archive=True, verbose=1):
             with contextlib.closing(tarfile.open(file_, "r")) as tar:
                 tar.extractall(path=data_dir)
             processed = True
+            if file_ != archive:
+                os.remove(file_)  # tar of a .tar.gz
         if not processed:
             raise IOError(
                     "[Uncompress] unknown archive file format: %s" % file_)
         if delete_archive:
-            os.remove(file_)
+            remove_checksummed_file(archive)
         if verbose > 0:
             print('   ...done.')
     except Exception as e:
@@ -291,7 +449,7 @@ def _fetch_file(url, data_dir, resume=True, overwrite=False,
     temp_full_name = os.path.join(data_dir, temp_file_name)
     if os.path.exists(full_name):
         if overwrite:
-            os.remove(full_name)
+            remove_checksummed_file(full_name)
         else:
             return full_name
     if os.path.exists(temp_full_name):
@@ -386,14 +544,169 @@ def _fetch_file(url, data_dir, resume=True, overwrite=False,
     finally:
         if local_file is not None and not local_file.closed:
             local_file.close()
+    count('files_downloaded')
     if md5sum is not None:
-        if (md5_sum_file(full_name) != md5sum):
+        with phase('checksum'):
+            checksum = cached_md5_sum_file(full_name)
+        if checksum != md5sum:
             raise ValueError("File %s checksum verification has failed."
                              " Dataset fetching aborted." % local_file)
     return full_name
 
 
-def fetch_files(data_dir, files, resume=True, force=False, verbose=1, delete_archive=True):
+def _publish_journal(temp_dir):
+    dirname, basename = os.path.split(temp_dir)
+    return os.path.join(dirname, '.%s.publish' % basename)
+
+
+def _needs_refetch(target_file, opts):
+    """Whether an existing, non-archive target has an unexpected checksum."""
+    if (opts.get('md5sum') is None or opts.get('uncompress') or
+            not os.path.isfile(target_file)):
+        return False
+    with phase('checksum'):
+        return cached_md5_sum_file(target_file) != opts['md5sum']
+
+
+def _fetch_target(file_, url, opts, data_dir, temp_dir, resume=True,
+                  overwrite=False, delete_archive=True, n_jobs=1, verbose=1):
+    """Download (and uncompress) url in temp_dir, then move the result to
+    data_dir. See fetch_files."""
+    target_file = os.path.join(data_dir, file_)
+    # if not os.path.exists(temp_target_dir):
+    #     os.makedirs(temp_target_dir)
+    # Fetch the file, if it doesn't already exist. With keep_path, the url
+    # points to file_ itself (e.g. on a mirror), which keeps its subfolder.
+    fetch_dir = temp_dir
+    if opts.get('keep_path'):
+        fetch_dir = os.path.join(temp_dir, os.path.dirname(file_))
+    with phase('download'):
+        fetched_file = _fetch_file(url, fetch_dir,
+                                   resume=resume,
+                                   overwrite=overwrite,
+                                   verbose=verbose,
+                                   md5sum=opts.get('md5sum'),
+                                   username=opts.get('username'),
+                                   passwd=opts.get('passwd'),
+                                   handlers=opts.get('handlers', []),
+                                   headers=opts.get('headers', dict()),
+                                   cookies=opts.get('cookies', dict()))
+    if opts.get('keep_path'):
+        # The url basename may be quoted.
+        kept_file = os.path.join(fetch_dir, os.path.basename(file_))
+        if fetched_file != kept_file:
+            os.rename(fetched_file, kept_file)
+            if os.path.exists(_md5_sidecar(fetched_file)):
+                os.rename(_md5_sidecar(fetched_file), _md5_sidecar(kept_file))
+            fetched_file = kept_file
+
+    # First, uncompress.
+    if opts.get('uncompress'):
+        with phase('extract'):
+            target_files = _uncompress_file(fetched_file, verbose=verbose,
+                                            delete_archive=False,
+                                            n_jobs=n_jobs)
+    else:
+        target_files = [fetched_file]
+
+    if opts.get('move'):
+        raise NotImplementedError()
+
+        # XXX: here, move is supposed to be a dir, it can be a name
+        move = os.path.join(temp_dir, opts['move'])
+
+        if len(target_files) > 1:
+            target_files = [os.path.join(os.path.dirname(move),
+                                 os.path.basename(f))
+                            for f in target_files]
+            # Do the move
+        else:
+            if not os.path.exists(move_dir):
+                os.makedirs(move_dir)
+            shutil.move(fetched_file, move)
+            target_files = [move]
+        temp_target_file = move
+
+    # Let's examine our work (the files are published below)
+    if not (os.path.exists(os.path.join(temp_dir, file_)) or
+            os.path.exists(target_file)):
+        raise Exception("An error occured while fetching %s; the expected target file cannot be found. (%s)\nDebug info: %s" % (
+            file_, target_file,
+            {'fetched_file': fetched_file, 'target_files': target_files}))
+
+    if opts.get('uncompress') and delete_archive:
+        remove_checksummed_file(fetched_file)
+
+    # If needed, move files from temps directory to final directory.
+    if os.path.exists(temp_dir):
+        with phase('publish'):
+            publish_tree(temp_dir, data_dir, _publish_journal(temp_dir))
+
+
+def _fetch_entry(data_dir, file_, url, opts, resume=True, force=False,
+                 delete_archive=True, n_jobs=1, verbose=1):
+    """Fetch one (file_, url, opts) entry of fetch_files; return the path
+    of file_."""
+    # There are two working directories here:
+    # - data_dir is the destination directory of the dataset
+    # - temp_dir is a temporary directory dedicated to this fetching call. All
+    #   files that must be downloaded will be in this directory. If a corrupted
+    #   file is found, or a file is missing, this working directory will be
+    #   deleted.
+    files_pickle = cPickle.dumps(url)
+    files_md5 = hashlib.md5(files_pickle).hexdigest()
+    temp_dir = os.path.join(data_dir, files_md5)
+
+    # 3 possibilities:
+    # - the file exists in data_dir, nothing to do.
+    # - the file does not exists: we download it in temp_dir
+    # - the file exists in temp_dir: this can happen if an archive has been
+    #   downloaded. There is nothing to do
+
+    # Target file in the data_dir
+    target_file = os.path.join(data_dir, file_)
+
+    # Concurrent fetches of the same url (e.g. array jobs) share
+    # temp_dir: one process downloads, the others wait for it and
+    # use its result.
+    lock = FileLock(os.path.join(data_dir, '.%s.lock' % files_md5),
+                    stale_age=LOCK_STALE_AGE)
+
+    # A previous call was interrupted while publishing its files.
+    journal = _publish_journal(temp_dir)
+    if os.path.exists(journal):
+        with lock:
+            _complete_publish(journal, verbose=verbose)
+
+    # Existing files with a known checksum are verified; the checksum
+    # is memoized, so this only reads files that changed.
+    refetch = not force and _needs_refetch(target_file, opts)
+    if refetch and verbose > 0:
+        print('%s has an unexpected checksum; fetching it again.'
+              % target_file)
+
+    if force or refetch or not os.path.exists(target_file):
+        waited = not lock.acquire(blocking=False)
+        if waited:
+            if verbose > 0:
+                print('%s is being fetched by another process, '
+                      'waiting...' % file_)
+            with phase('lock_wait'):
+                lock.acquire()
+        try:
+            if not (waited and os.path.exists(target_file) and
+                    not _needs_refetch(target_file, opts)):
+                _fetch_target(file_, url, opts, data_dir, temp_dir,
+                              resume=resume, overwrite=force or refetch,
+                              delete_archive=delete_archive,
+                              n_jobs=n_jobs, verbose=verbose)
+        finally:
+            lock.release()
+    return target_file
+
+
+def fetch_files(data_dir, files, resume=True, force=False, verbose=1,
+                delete_archive=True, n_jobs=1):
     """Load requested dataset, downloading it if needed or requested.
 
     This function retrieves files from the hard drive or download them from
@@ -413,7 +726,8 @@ def fetch_files(data_dir, files, resume=True, force=False, verbose=1, delete_arc
         options regarding the files. Options supported are 'uncompress' to
         indicates that the file is an archive, 'md5sum' to check the md5 sum of
         the file and 'move' if renaming the file or moving it to a subfolder is
-        needed.
+        needed. With 'keep_path', the url is that of the file itself, which
+        is stored at its path rather than under the url basename.
 
     data_dir: string, optional
         Path of the data directory. Used to force data storage in a specified
@@ -429,6 +743,11 @@ def fetch_files(data_dir, files, resume=True, force=False, verbose=1, delete_arc
     verbose: int, optional
         verbosity level (0 means no message).
 
+    n_jobs: int, optional
+        Number of threads fetching and extracting archives from different
+        urls (or, when all files come from the same archive, decompressing
+        its members). -1 means all CPUs.
+
     Returns
     -------
     files: list of string
@@ -445,85 +764,23 @@ def fetch_files(data_dir, files, resume=True, force=False, verbose=1, delete_arc
     if not os.path.exists(data_dir):
         os.makedirs(data_dir)
 
-    files_ = []
-    for file_, url, opts in files:
-        # There are two working directories here:
-        # - data_dir is the destination directory of the dataset
-        # - temp_dir is a temporary directory dedicated to this fetching call. All
-        #   files that must be downloaded will be in this directory. If a corrupted
-        #   file is found, or a file is missing, this working directory will be
-        #   deleted.
-        files_pickle = cPickle.dumps(url)
-        files_md5 = hashlib.md5(files_pickle).hexdigest()
-        temp_dir = os.path.join(data_dir, files_md5)
-
-        # 3 possibilities:
-        # - the file exists in data_dir, nothing to do.
-        # - the file does not exists: we download it in temp_dir
-        # - the file exists in temp_dir: this can happen if an archive has been
-        #   downloaded. There is nothing to do
-
-        # Target file in the data_dir
-        target_file = os.path.join(data_dir, file_)
-    
-        if force or not os.path.exists(target_file):
-            # if not os.path.exists(temp_target_dir):
-            #     os.makedirs(temp_target_dir)
-            # Fetch the file, if it doesn't already exist.
-            fetched_file = _fetch_file(url, temp_dir,
-                                       resume=resume,
-                                       overwrite=force,
-                                       verbose=verbose,
-                                       md5sum=opts.get('md5sum'),
-                                       username=opts.get('username'),
-                                       passwd=opts.get('passwd'),
-                                       handlers=opts.get('handlers', []),
-                                       headers=opts.get('headers', dict()),
-                                       cookies=opts.get('cookies', dict()))
-
-            # First, uncompress.
-            if opts.get('uncompress'):
-                target_files = _uncompress_file(fetched_file, verbose=verbose, delete_archive=False)
-            else:
-                target_files = [fetched_file]
-
-            if opts.get('move'):
-                raise NotImplementedError()
-
-                # XXX: here, move is supposed to be a dir, it can be a name
-                move = os.path.join(temp_dir, opts['move'])
-
-                if len(target_files) > 1:
-                    target_files = [os.path.join(os.path.dirname(move),
-                                         os.path.basename(f))
-                                    for f in target_files]
-                    # Do the move
-                else:
-                    if not os.path.exists(move_dir):
-                        os.makedirs(move_dir)
-                    shutil.move(fetched_file, move)
-                    target_files = [move]
-                temp_target_file = move
-
-            # Let's examine our work
-            if not os.path.exists(target_file):
-                raise Exception("An error occured while fetching %s; the expected target file cannot be found. (%s)\nDebug info: %s" % (
-                    file_, target_file,
-                    {'fetched_file': fetched_file, 'target_files': target_files}))
-
-            if opts.get('uncompress') and delete_archive:
-                os.remove(fetched_file)
-
-            # If needed, move files from temps directory to final directory.
-            if os.path.exists(temp_dir):
-                #XXX We could only moved the files requested
-                #XXX Movetree can go wrong
-                movetree(temp_dir, data_dir)
-                shutil.rmtree(temp_dir)
-
-        files_.append(target_file)
-
-    return files_
+    # Independent archives are fetched and extracted in parallel; a single
+    # archive uses the threads to decompress its members.
+    files = list(files)
+    if n_jobs < 0:
+        n_jobs = max(cpu_count() + 1 + n_jobs, 1)
+    n_urls = len(set(url for _, url, _ in files))
+    if n_jobs == 1 or n_urls == 1:
+        return [_fetch_entry(data_dir, file_, url, opts, resume=resume,
+                             force=force, delete_archive=delete_archive,
+                             n_jobs=n_jobs, verbose=verbose)
+                for file_, url, opts in files]
+    fetch_entry = propagate(_fetch_entry)
+    return Parallel(n_jobs=min(n_jobs, len(files)), backend='threading')(
+        delayed(fetch_entry)(data_dir, file_, url, opts, resume=resume,
+                             force=force, delete_archive=delete_archive,
+                             verbose=verbose)
+        for file_, url, opts in files)
 
 
 def copytree(src, dst, symlinks=False, ignore=None):
@@ -583,11 +840,21 @@ class HttpFetcher(Fetcher):
         self.username = username
         self.passwd = passwd
 
-    def fetch(self, files, force=False, resume=True, check=False, verbose=1, delete_archive=True):
+    def prepare_files(self, files):
+        """(file, url, opts) entries of files, as passed to fetch_files."""
         files = self.reformat_files(files)  # allows flexibility
+        files = self.apply_mirrors(files)
         if self.username is not None:
             for tgt, src, opts in files:
                 opts['username'] = opts.get('username', self.username)
                 opts['passwd'] = opts.get('passwd', self.username)
+        return files
 
-        return fetch_files(self.data_dir, files, resume=resume, force=force, verbose=verbose, delete_archive=delete_archive)
+    def fetch(self, files, force=False, resume=True, check=False, verbose=1,
+              delete_archive=True, n_jobs=1):
+        with phase('prepare_files'):
+            files = self.prepare_files(files)
+        with phase('fetch_files'):
+            return fetch_files(self.data_dir, files, resume=resume,
+                               force=force, verbose=verbose,
+                               delete_archive=delete_archive, n_jobs=n_jobs)
@@ -0,0 +1,166 @@
+"""
+Small HTTP server publishing a nidata data directory as a mirror.
+
+Run it on a host holding an up-to-date NIDATA_PATH:
+
+    python -m nidata.core.fetchers.mirror_server --port 8000
+
+and point other hosts to it with NIDATA_MIRRORS='*=http://<host>:8000'
+(see nidata.core.fetchers.base.get_mirrors). Single byte ranges are
+supported, so interrupted downloads from the mirror are resumed.
+
+Archives are fetched from the mirror rather than their extracted files,
+so the mirror must have been fetched with delete_archive=False.
+"""
+import argparse
+import os
+
+try:
+    from http.server import SimpleHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+except ImportError:  # python 2
+    from SimpleHTTPServer import SimpleHTTPRequestHandler
+    from BaseHTTPServer import HTTPServer
+    from SocketServer import ThreadingMixIn
+
+from .._utils.compat import _urllib
+
+
+def _parse_range(header, size):
+    """(start, stop) of a 'bytes=start-end' Range header, None if the
+    header is absent or not a single range, or ValueError if the range
+    cannot be satisfied."""
+    if not header or not header.startswith('bytes=') or ',' in header:
+        return None
+    start, end = header[len('bytes='):].split('-', 1)
+    if not start:  # suffix: the last `end` bytes
+        start, stop = max(size - int(end), 0), size
+    else:
+        start = int(start)
+        stop = min(int(end) + 1, size) if end else size
+    if start >= stop:
+        raise ValueError(header)
+    return start, stop
+
+
+def _split_roots(root):
+    """List of the directories of root, a list or a string of directories
+    separated by os.pathsep (as NIDATA_PATH)."""
+    if not isinstance(root, (list, tuple)):
+        root = root.split(os.pathsep)
+    return [os.path.abspath(r) for r in root if r]
+
+
+class MirrorRequestHandler(SimpleHTTPRequestHandler):
+    """Serve the files of the `roots` directories (GET and HEAD), with
+    range support. A path is served from the first root holding it."""
+    roots = ['.']
+    chunk_size = 64 * 1024
+
+    def translate_path(self, path):
+        path = _urllib.parse.unquote(path.split('?', 1)[0].split('#', 1)[0])
+        parts = [p for p in path.split('/') if p not in ('', '.', '..')]
+        for root in self.roots:
+            translated = os.path.join(root, *parts)
+            if os.path.exists(translated):
+                return translated
+        return os.path.join(self.roots[0], *parts)
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404, 'File not found')
+            return None
+        size = os.path.getsize(path)
+        try:
+            byte_range = _parse_range(self.headers.get('Range'), size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header('Content-Range', 'bytes */%d' % size)
+            self.end_headers()
+            return None
+        f = open(path, 'rb')
+        if byte_range is None:
+            start, stop = 0, size
+            self.send_response(200)
+        else:
+            start, stop = byte_range
+            self.send_response(206)
+            self.send_header('Content-Range',
+                             'bytes %d-%d/%d' % (start, stop - 1, size))
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(stop - start))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Last-Modified',
+                         self.date_time_string(os.path.getmtime(path)))
+        self.end_headers()
+        f.seek(start)
+        self._remaining = stop - start
+        return f
+
+    def copyfile(self, source, outputfile):
+        while self._remaining > 0:
+            chunk = source.read(min(self.chunk_size, self._remaining))
+            if not chunk:
+                break
+            self.write_chunk(outputfile, chunk)
+            self._remaining -= len(chunk)
+
+    def write_chunk(self, outputfile, chunk):
+        outputfile.write(chunk)
+
+    def log_message(self, format, *args):
+        if self.server.verbose > 0:
+            SimpleHTTPRequestHandler.log_message(self, format, *args)
+
+
+class MirrorServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, host='', port=8000,
+                 handler_class=MirrorRequestHandler, verbose=1):
+        handler_class = type(handler_class.__name__, (handler_class,),
+                             {'roots': _split_roots(root)})
+        HTTPServer.__init__(self, (host, port), handler_class)
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return 'http://%s:%d' % (host or 'localhost', port)
+
+
+def serve(root=None, host='', port=8000, verbose=1):
+    """Serve root (by default, the directories of NIDATA_SHARED_DATA and
+    NIDATA_PATH) until interrupted."""
+    if root is None:
+        root = [path for var in ('NIDATA_SHARED_DATA', 'NIDATA_PATH')
+                for path in os.environ.get(var, '').split(os.pathsep)
+                if path] or ['nidata_data']
+    server = MirrorServer(root, host=host, port=port, verbose=verbose)
+    if verbose > 0:
+        print('Serving %s at %s' % (root, server.url))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Serve a nidata data directory as a mirror.')
+    parser.add_argument('--root', default=None,
+                        help='directories to serve, separated by %s '
+                             '(default: NIDATA_PATH)' % os.pathsep)
+    parser.add_argument('--host', default='')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--verbose', type=int, default=1)
+    args = parser.parse_args(args)
+    serve(root=args.root, host=args.host, port=args.port,
+          verbose=args.verbose)
+
+
+if __name__ == '__main__':
+    main()
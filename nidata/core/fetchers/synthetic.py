@@ -0,0 +1,274 @@
+"""
+Synthetic data: structurally valid files in place of downloaded ones.
+
+SyntheticFetcher creates the files a dataset requests instead of fetching
+them: NIfTI images of realistic shapes, CSV/TSV tables, text matrices
+(.1D, .txt), HDF5 files and archives, filled with deterministic random
+values. Sizes are scaled by a factor (1 is realistic; 0.01 makes files
+100 times smaller).
+
+Datasets describe the files their loaders parse in a `synthetic_specs`
+attribute, mapping filename patterns to generator options, e.g. the columns
+of a phenotypic CSV file.
+
+Set NIDATA_SYNTHETIC to a scale factor to make every HttpDataset use
+synthetic data, or use make_synthetic_dataset to write a data directory
+that can also be served to other hosts (see mirror_server).
+"""
+import fnmatch
+import os
+import posixpath
+import re
+import tarfile
+import zipfile
+import zlib
+
+import nibabel
+import numpy as np
+
+from .._utils.compat import _urllib
+from .._utils.fileio import atomic_filename
+from .base import Fetcher
+from .http_fetcher import _uncompress_file
+
+# MNI 2mm anatomical images and 3mm EPI runs.
+SHAPE_3D = (91, 109, 91)
+SHAPE_4D = (61, 73, 61, 150)
+AFFINE_3D = np.array([[-2., 0., 0., 90.], [0., 2., 0., -126.],
+                      [0., 0., 2., -72.], [0., 0., 0., 1.]])
+AFFINE_4D = np.array([[-3., 0., 0., 90.], [0., 3., 0., -126.],
+                      [0., 0., 3., -72.], [0., 0., 0., 1.]])
+
+_4D_PATTERN = re.compile(r'func|rest|bold|epi|dwi|4d', re.IGNORECASE)
+_LABELS_PATTERN = re.compile(r'label|atlas|parcel|aparc|aseg|seg',
+                             re.IGNORECASE)
+
+
+def _scaled_shape(shape, scale):
+    """Shape whose number of elements is about scale times that of shape."""
+    factor = scale ** (1. / len(shape))
+    return tuple(max(int(round(dim * factor)), 1) for dim in shape)
+
+
+def make_nifti(filename, rng, scale=1., shape=None, affine=None,
+               dtype=None):
+    """NIfTI image; 4D if its name looks like a functional run, integer
+    labels for atlases and segmentations, binary for masks."""
+    name = os.path.basename(filename)
+    if shape is None:
+        shape = SHAPE_4D if _4D_PATTERN.search(name) else SHAPE_3D
+        shape = _scaled_shape(shape, scale)
+    if affine is None:
+        affine = AFFINE_4D if len(shape) == 4 else AFFINE_3D
+    if 'mask' in name.lower():
+        data = (rng.rand(*shape) > .3).astype(dtype or np.uint8)
+    elif _LABELS_PATTERN.search(name):
+        data = rng.randint(0, 100, size=shape).astype(dtype or np.int16)
+    else:
+        # Volume by volume, to bound memory use for large runs.
+        data = np.empty(shape, dtype=dtype or np.float32)
+        for index in np.ndindex(*shape[3:]):
+            data[(Ellipsis,) + index] = rng.rand(*shape[:3])
+    nibabel.save(nibabel.Nifti1Image(data, affine), filename)
+
+
+def make_csv(filename, rng, scale=1., columns=None, n_rows=100,
+             delimiter=None, header=True):
+    """Table; columns is a list of (name, values) where values is a list
+    (random choice), a (low, high) tuple (uniform), or a callable
+    f(row_index, rng)."""
+    if delimiter is None:
+        delimiter = '\t' if filename.endswith('.tsv') else ','
+    if columns is None:
+        columns = [('id', lambda i, rng: i), ('value', (0., 1.))]
+
+    def _value(values, i):
+        if callable(values):
+            return values(i, rng)
+        if isinstance(values, tuple):
+            low, high = values
+            if isinstance(low, int) and isinstance(high, int):
+                return rng.randint(low, high + 1)
+            return '%.3f' % rng.uniform(low, high)
+        return values[rng.randint(len(values))]
+
+    with open(filename, 'w') as f:
+        if header:
+            f.write(delimiter.join(name for name, _ in columns) + '\n')
+        for i in range(n_rows):
+            f.write(delimiter.join(str(_value(values, i))
+                                   for _, values in columns) + '\n')
+
+
+def make_text(filename, rng, scale=1., shape=(150, 116)):
+    """Numeric matrix (e.g. ROI time series)."""
+    np.savetxt(filename, rng.randn(*_scaled_shape(shape, scale)))
+
+
+def make_hdf5(filename, rng, scale=1., datasets=None):
+    """HDF5 file; datasets maps names to shapes."""
+    import h5py
+    if datasets is None:
+        datasets = {'data': (100, 1000)}
+    with h5py.File(filename, 'w') as hdf:
+        for name, shape in datasets.items():
+            hdf.create_dataset(name, data=rng.rand(
+                *_scaled_shape(shape, scale)).astype(np.float32))
+
+
+def make_archive(filename, rng, scale=1., members=None, specs=None):
+    """zip or tar archive of synthetic members (by default, a few
+    images); specs are matched against the member names."""
+    if members is None:
+        members = ['data/img%02d.nii.gz' % i for i in range(4)]
+    tmp_dir = filename + '.members'
+    paths = []
+    for member in members:
+        path = os.path.join(tmp_dir, member)
+        make_synthetic_file(path, scale=scale, specs=specs, rng=rng,
+                            name=member)
+        paths.append((path, member))
+    if filename.endswith('.zip'):
+        with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as z:
+            for path, member in paths:
+                z.write(path, member)
+    else:
+        mode = 'w:gz' if filename.endswith('gz') else 'w'
+        tar = tarfile.open(filename, mode)
+        try:
+            for path, member in paths:
+                tar.add(path, member)
+        finally:
+            tar.close()
+    for path, _ in paths:
+        os.remove(path)
+    for dirpath, _, _ in sorted(os.walk(tmp_dir), reverse=True):
+        os.rmdir(dirpath)
+
+
+# Generators by extension (first match).
+GENERATORS = [('.nii.gz', make_nifti), ('.nii', make_nifti),
+              ('.csv', make_csv), ('.tsv', make_csv),
+              ('.1D', make_text), ('.txt', make_text), ('.h5', make_hdf5),
+              ('.hdf5', make_hdf5), ('.zip', make_archive),
+              ('.tgz', make_archive), ('.tar.gz', make_archive),
+              ('.tar', make_archive)]
+
+
+def _match_spec(name, specs):
+    """Options of the first pattern of specs matching name (a path) or its
+    basename."""
+    for pattern, spec in (specs or {}).items():
+        if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(
+                os.path.basename(name), pattern):
+            return dict(spec)
+    return {}
+
+
+def make_synthetic_file(filename, scale=1., specs=None, rng=None,
+                        name=None):
+    """Write a synthetic version of filename.
+
+    specs maps fnmatch patterns (matched against name, by default the
+    path) to keyword arguments of the generator, which can itself be given
+    as 'generator'. Files with an unknown extension get a few random bytes.
+    """
+    options = _match_spec(name or filename, specs)
+    generator = options.pop('generator', None)
+    if generator is None:
+        generator = next((gen for ext, gen in GENERATORS
+                          if filename.endswith(ext)), None)
+    if rng is None:
+        # Deterministic content for a given file name.
+        rng = np.random.RandomState(
+            zlib.crc32(os.path.basename(filename).encode('utf-8'))
+            & 0xffffffff)
+    with atomic_filename(filename) as tmp_filename:
+        if generator is None:
+            with open(tmp_filename, 'wb') as f:
+                f.write(rng.bytes(max(int(1024 * scale), 1)))
+        else:
+            generator(tmp_filename, rng, scale=scale, **options)
+    return filename
+
+
+def make_extracted_archive(data_dir, file_, url, scale=1., specs=None,
+                           verbose=1):
+    """Create the target file_ of an archive to uncompress, by extracting
+    a synthetic archive in data_dir.
+
+    The members of the archive are given by the 'members' option of the
+    spec matching file_. By default, they are file_ itself if it has an
+    extension, and otherwise a few images in the file_ directory.
+    """
+    members = _match_spec(file_, specs).get('members')
+    target = '/'.join(file_.split(os.sep))
+    if members is None:
+        if posixpath.splitext(posixpath.basename(target))[1]:
+            members = [target]
+        else:
+            members = ['%s/img%02d.nii.gz' % (target, i) for i in range(4)]
+    archive_name = posixpath.basename(_urllib.parse.urlparse(url).path)
+    if not any(archive_name.endswith(ext) for ext, gen in GENERATORS
+               if gen is make_archive):
+        archive_name += '.tgz'
+    archive = os.path.join(data_dir, '.synthetic_%s' % archive_name)
+    if not os.path.exists(data_dir):
+        os.makedirs(data_dir)
+    rng = np.random.RandomState(
+        zlib.crc32(archive_name.encode('utf-8')) & 0xffffffff)
+    make_archive(archive, rng, scale=scale, members=members, specs=specs)
+    _uncompress_file(archive, delete_archive=True,
+                     verbose=1 if verbose > 1 else 0)
+
+
+def fetch_synthetic_files(data_dir, files, scale=1., specs=None,
+                          force=False, verbose=1, **kwargs):
+    """Same interface as fetch_files, but creates synthetic files.
+
+    Entries that are archives to uncompress are extracted from synthetic
+    archives (see make_extracted_archive). Other keyword arguments are
+    ignored.
+    """
+    files_ = []
+    for file_, url, opts in files:
+        target_file = os.path.join(data_dir, file_)
+        if force or not os.path.exists(target_file):
+            if verbose > 1:
+                print('Creating synthetic %s' % target_file)
+            if opts.get('uncompress'):
+                make_extracted_archive(data_dir, file_, url, scale=scale,
+                                       specs=specs, verbose=verbose)
+            else:
+                make_synthetic_file(target_file, scale=scale, specs=specs)
+        files_.append(target_file)
+    return files_
+
+
+class SyntheticFetcher(Fetcher):
+    """Fetcher creating synthetic files instead of downloading them."""
+    def __init__(self, data_dir=None, scale=1., specs=None):
+        super(SyntheticFetcher, self).__init__(data_dir=data_dir)
+        self.scale = scale
+        self.specs = specs
+
+    def fetch(self, files, force=False, resume=True, check=False, verbose=1,
+              **kwargs):
+        files = self.reformat_files(files)  # allows flexibility
+        return fetch_synthetic_files(self.data_dir, files, scale=self.scale,
+                                     specs=self.specs, force=force,
+                                     verbose=verbose)
+
+
+def make_synthetic_dataset(dataset_class, data_dir=None, scale=1.,
+                           **fetch_kwargs):
+    """Fetch a dataset with synthetic files and return the fetch result.
+
+    The files are written to <data_dir>/<dataset name>, as a regular
+    download would: data_dir can be used as NIDATA_PATH, or served with
+    mirror_server.
+    """
+    dataset = dataset_class(data_dir=data_dir)
+    dataset.fetcher = SyntheticFetcher(dataset.data_dir, scale=scale,
+                                       specs=dataset.synthetic_specs)
+    return dataset.fetch(**fetch_kwargs)
@@ -14,7 +14,7 @@ from sklearn.utils import check_random_state
 import scipy.linalg
 import nibabel
 
-from .. import fetch_files
+from ..synthetic import fetch_synthetic_files
 from ..._utils.compat import _basestring, _urllib
 
 
@@ -73,7 +73,7 @@ def mock_chunk_read_raise_error_(response, local_file, initial_size=0,
 
 
 class FetchFilesMock (object):
-    _mockfetch_files = functools.partial(fetch_files, mock=True)
+    _mockfetch_files = functools.partial(fetch_synthetic_files, scale=1e-3)
 
     def __str__(self):
         return ':'.join(self.csv_files.values())
@@ -93,7 +93,7 @@ class FetchFilesMock (object):
         """Load requested dataset, downloading it if needed or requested.
 
         For test purpose, instead of actually fetching the dataset, this
-        function creates empty files and return their paths.
+        function creates small synthetic files and return their paths.
         """
         filenames = self._mockfetch_files(*args, **kwargs)
         # Fill CSV files with given content if needed
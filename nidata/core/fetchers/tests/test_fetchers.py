@@ -7,6 +7,7 @@ Test the fetchers module
 import contextlib
 import os
 import shutil
+import sys
 import numpy as np
 import zipfile
 import tarfile
@@ -17,12 +18,13 @@ import nibabel
 from nose import with_setup
 from nose.tools import assert_true, assert_false, assert_equal, assert_raises
 
-from nidata import fetchers
-from nidata._utils import compat
-from nidata._utils.testing import assert_raises_regex
-from nidata._utils.compat import _basestring
-from nidata.fetchers.tests import (mock_request, wrap_chunk_read_,
-                                   FetchFilesMock)
+from nidata.core import fetchers
+from nidata.core._utils import compat
+from nidata.core._utils.testing import assert_raises_regex
+from nidata.core._utils.compat import _basestring
+from nidata.core.fetchers import http_fetcher
+from nidata.core.fetchers.tests.base import (mock_request, wrap_chunk_read_,
+                                             FetchFilesMock)
 
 currdir = os.path.dirname(os.path.abspath(__file__))
 datadir = os.environ.get('NIDATA_PATH', os.path.join(currdir, 'data'))
@@ -45,7 +47,7 @@ def get_tmpdir():
 
 def get_url_request():
     global url_request
-    print ("url_request, " + url_request)
+    print ("url_request, " + str(url_request))
     return url_request
 
 
@@ -65,10 +67,10 @@ def setup_mock():
     global url_request
     url_request = mock_request()
     # compat._urllib.request = url_request
-    fetchers._chunk_read_ = wrap_chunk_read_(fetchers._chunk_read_)
+    http_fetcher._chunk_read_ = wrap_chunk_read_(http_fetcher._chunk_read_)
     global file_mock
     file_mock = FetchFilesMock()
-    fetchers.fetch_files = file_mock
+    http_fetcher.fetch_files = file_mock
 
 
 def teardown_tmpdata():
@@ -87,67 +89,190 @@ def testmd5_sum_file():
     os.remove(f)
 
 
+def test_cached_md5_sum_file():
+    dtemp = mkdtemp()
+    f = os.path.join(dtemp, 'test.txt')
+    with open(f, 'wb') as fp:
+        fp.write(b'abcfeg')
+    md5 = '18f32295c556b2a1a3a8e68fe1ad40f7'
+    assert_equal(fetchers.cached_md5_sum_file(f), md5)
+    sidecar = os.path.join(dtemp, '.test.txt.md5')
+    assert_true(os.path.exists(sidecar))
+
+    # The memoized sum is used while the file is unchanged...
+    with open(sidecar) as fp:
+        signature = fp.read().rsplit(' ', 1)[0]
+    with open(sidecar, 'w') as fp:
+        fp.write('%s %s' % (signature, 'memoized'))
+    assert_equal(fetchers.cached_md5_sum_file(f), 'memoized')
+
+    # ... and computed again when it changes.
+    with open(f, 'wb') as fp:
+        fp.write(b'abcfegh')
+    assert_true(fetchers.cached_md5_sum_file(f) not in (md5, 'memoized'))
+
+    # Removing the file removes its memoized sum.
+    fetchers.remove_checksummed_file(f)
+    assert_equal(os.listdir(dtemp), [])
+    shutil.rmtree(dtemp)
+
+
+def test_file_lock_stale():
+    from nidata.core._utils.fileio import FileLock
+    dtemp = mkdtemp()
+    lock_file = os.path.join(dtemp, '.test.lock')
+    lock = FileLock(lock_file)
+    assert_true(lock.acquire(blocking=False))
+    assert_false(FileLock(lock_file).acquire(blocking=False))
+    lock.release()
+    assert_false(os.path.exists(lock_file))
+
+    # Lock left behind by a process of this host that is not running.
+    import socket
+    with open(lock_file, 'w') as fp:
+        fp.write('999999999 %s' % socket.gethostname())
+    assert_true(FileLock(lock_file).is_stale())
+    lock = FileLock(lock_file)
+    assert_true(lock.acquire(blocking=False))
+    lock.release()
+    shutil.rmtree(dtemp)
+
+
+def test_file_lock_owner_killed():
+    import subprocess
+    import sys
+    from nidata.core._utils.fileio import FileLock
+    dtemp = mkdtemp()
+    lock_file = os.path.join(dtemp, '.test.lock')
+    code = ('import sys, time\n'
+            'from nidata.core._utils.fileio import FileLock\n'
+            'FileLock(sys.argv[1]).acquire()\n'
+            'print("locked")\n'
+            'sys.stdout.flush()\n'
+            'time.sleep(60)\n')
+    root_dir = currdir
+    for _ in range(4):
+        root_dir = os.path.dirname(root_dir)
+    process = subprocess.Popen([sys.executable, '-c', code, lock_file],
+                               cwd=root_dir, stdout=subprocess.PIPE)
+    try:
+        # Skip what nidata prints on import
+        while process.stdout.readline().strip() != b'locked':
+            assert_true(process.poll() is None)
+        assert_false(FileLock(lock_file).acquire(blocking=False))
+    finally:
+        process.kill()
+        process.wait()
+        process.stdout.close()
+    # The lock is dropped with its owner, even on another host.
+    lock = FileLock(lock_file)
+    assert_true(lock.acquire(blocking=False))
+    lock.release()
+    shutil.rmtree(dtemp)
+
+
+def test_file_lock_break():
+    # Lock files, where the filesystem has no OS locks
+    import socket
+    from nidata.core._utils.fileio import FileLock
+    dtemp = mkdtemp()
+    lock_file = os.path.join(dtemp, '.test.lock')
+    with open(lock_file, 'w') as fp:
+        fp.write('999999999 %s' % socket.gethostname())
+    lock = FileLock(lock_file)
+    lock._os_lock = False
+    stale_info = lock._stale_info()
+    assert_true(stale_info is not None)
+
+    # Broken and taken again by other processes since it was seen stale:
+    # the live lock is left in place.
+    os.remove(lock_file)
+    other = FileLock(lock_file)
+    other._os_lock = False
+    assert_true(other.acquire(blocking=False))
+    lock._break(stale_info)
+    assert_equal(open(lock_file).read(),
+                 '%d %s' % (os.getpid(), socket.gethostname()))
+    assert_false(lock.acquire(blocking=False))
+    other.release()
+
+    assert_true(lock.acquire(blocking=False))
+    assert_false(other.acquire(blocking=False))
+    lock.release()
+    assert_false(os.path.exists(lock_file))
+    shutil.rmtree(dtemp)
+
+
 @with_setup(setup_tmpdata, teardown_tmpdata)
 def testget_dataset_dir():
     # testing folder creation under different environments, enforcing
     # a custom clean install
-    os.environ.pop('NIDATA_PATH', None)
-    os.environ.pop('NILEARN_SHARED_DATA', None)
-
-    expected_base_dir = os.path.expanduser('~/NIDATA_PATH')
-    data_dir = fetchers.get_dataset_dir('test', verbose=0)
-    assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
-    assert os.path.exists(data_dir)
-    shutil.rmtree(data_dir)
-
-    expected_base_dir = os.path.join(tmpdir, 'test_NIDATA_PATH')
-    os.environ['NIDATA_PATH'] = expected_base_dir
-    data_dir = fetchers.get_dataset_dir('test', verbose=0)
-    assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
-    assert os.path.exists(data_dir)
-    shutil.rmtree(data_dir)
-
-    expected_base_dir = os.path.join(tmpdir, 'nilearn_shared_data')
-    os.environ['NILEARN_SHARED_DATA'] = expected_base_dir
-    data_dir = fetchers.get_dataset_dir('test', verbose=0)
-    assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
-    assert os.path.exists(data_dir)
-    shutil.rmtree(data_dir)
-
-    expected_base_dir = os.path.join(tmpdir, 'env_data')
-    os.environ['MY_DATA'] = expected_base_dir
-    data_dir = fetchers.get_dataset_dir('test', env_vars=['MY_DATA'],
-                                         verbose=0)
-    assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
-    assert os.path.exists(data_dir)
-    shutil.rmtree(data_dir)
-
-    no_write = os.path.join(tmpdir, 'no_write')
-    os.makedirs(no_write)
-    os.chmod(no_write, 0o400)
-
-    # Verify that default is used if non writeable dir
-    os.environ['MY_DATA'] = no_write
-    expected_base_dir = os.path.join(tmpdir, 'nilearn_shared_data')
-    os.environ['NILEARN_SHARED_DATA'] = expected_base_dir
-    data_dir = fetchers.get_dataset_dir('test', env_vars=['MY_DATA'],
-                                         verbose=0)
-    assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
-    assert os.path.exists(data_dir)
-    shutil.rmtree(data_dir)
-
-    # Verify exception is raised on read-only directories
-    assert_raises_regex(OSError, 'Permission denied',
-                        fetchers.get_dataset_dir, 'test', no_write,
-                        verbose=0)
-
-    # Verify exception for a path which exists and is a file
-    test_file = os.path.join(tmpdir, 'some_file')
-    with open(test_file, 'w') as out:
-        out.write('abcfeg')
-    assert_raises_regex(OSError, 'Not a directory',
-                        fetchers.get_dataset_dir, 'test', test_file,
-                        verbose=0)
+    env = dict((var, os.environ.pop(var, None))
+               for var in ('HOME', 'NIDATA_PATH', 'NIDATA_SHARED_DATA',
+                           'MY_DATA'))
+    try:
+        # Default: nidata_path in the (here, temporary) home folder
+        os.environ['HOME'] = tmpdir
+        expected_base_dir = os.path.expanduser('~/nidata_path')
+        data_dir = fetchers.get_dataset_dir('test', verbose=0)
+        assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
+        assert os.path.exists(data_dir)
+        shutil.rmtree(data_dir)
+
+        expected_base_dir = os.path.join(tmpdir, 'test_NIDATA_PATH')
+        os.environ['NIDATA_PATH'] = expected_base_dir
+        data_dir = fetchers.get_dataset_dir('test', verbose=0)
+        assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
+        assert os.path.exists(data_dir)
+        shutil.rmtree(data_dir)
+
+        expected_base_dir = os.path.join(tmpdir, 'nidata_shared_data')
+        os.environ['NIDATA_SHARED_DATA'] = expected_base_dir
+        data_dir = fetchers.get_dataset_dir('test', verbose=0)
+        assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
+        assert os.path.exists(data_dir)
+        shutil.rmtree(data_dir)
+
+        expected_base_dir = os.path.join(tmpdir, 'env_data')
+        os.environ['MY_DATA'] = expected_base_dir
+        data_dir = fetchers.get_dataset_dir('test', env_vars=['MY_DATA'],
+                                            verbose=0)
+        assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
+        assert os.path.exists(data_dir)
+        shutil.rmtree(data_dir)
+
+        no_write = os.path.join(tmpdir, 'no_write')
+        os.makedirs(no_write)
+        os.chmod(no_write, 0o400)
+        # Permissions are not enforced for root
+        if not os.access(no_write, os.W_OK):
+            # Verify that default is used if non writeable dir
+            os.environ['MY_DATA'] = no_write
+            expected_base_dir = os.path.join(tmpdir, 'nidata_shared_data')
+            data_dir = fetchers.get_dataset_dir('test', env_vars=['MY_DATA'],
+                                                verbose=0)
+            assert_equal(data_dir, os.path.join(expected_base_dir, 'test'))
+            assert os.path.exists(data_dir)
+            shutil.rmtree(data_dir)
+
+            # Verify exception is raised on read-only directories
+            assert_raises_regex(OSError, 'Permission denied',
+                                fetchers.get_dataset_dir, 'test', no_write,
+                                verbose=0)
+
+        # Verify exception for a path which exists and is a file
+        test_file = os.path.join(tmpdir, 'some_file')
+        with open(test_file, 'w') as out:
+            out.write('abcfeg')
+        assert_raises_regex(OSError, 'Not a directory',
+                            fetchers.get_dataset_dir, 'test', test_file,
+                            verbose=0)
+    finally:
+        for var, value in env.items():
+            if value is None:
+                os.environ.pop(var, None)
+            else:
+                os.environ[var] = value
 
 
 def test_readmd5_sum_file():
@@ -183,7 +308,7 @@ def test_tree():
     open(os.path.join(dir11, 'file111'), 'w').close()
     open(os.path.join(dir2, 'file21'), 'w').close()
 
-    tree_ = fetchers._tree(parent)
+    tree_ = http_fetcher._tree(parent)
 
     # Check the tree
     #assert_equal(tree_[0]['dir1'][0]['dir11'][0], 'file111')
@@ -224,7 +349,7 @@ def test_movetree():
     open(os.path.join(dir12, 'file121'), 'w').close()
     open(os.path.join(dir2, 'file21'), 'w').close()
 
-    fetchers.movetree(dir1, dir2)
+    http_fetcher.movetree(dir1, dir2)
 
     assert_false(os.path.exists(dir11))
     assert_false(os.path.exists(dir12))
@@ -243,6 +368,279 @@ def test_movetree():
     assert_true(os.path.exists(os.path.join(dir12, 'file121')))
 
 
+def test_publish_tree():
+    parent = mkdtemp()
+    staging = os.path.join(parent, 'staging')
+    os.makedirs(os.path.join(staging, 'new_dir', 'sub'))
+    os.makedirs(os.path.join(staging, 'old_dir'))
+    for name in ('new_dir/sub/file', 'old_dir/file', 'file'):
+        with open(os.path.join(staging, name), 'w') as fp:
+            fp.write('new')
+    os.makedirs(os.path.join(parent, 'old_dir'))
+    for name in ('old_dir/file', 'old_dir/other', 'file'):
+        with open(os.path.join(parent, name), 'w') as fp:
+            fp.write('old')
+
+    journal = os.path.join(parent, '.staging.publish')
+    http_fetcher.publish_tree(staging, parent, journal)
+    assert_false(os.path.exists(staging))
+    assert_false(os.path.exists(journal))
+    for name, content in (('new_dir/sub/file', 'new'),
+                          ('old_dir/file', 'new'),
+                          ('old_dir/other', 'old'),
+                          ('file', 'new')):
+        with open(os.path.join(parent, name)) as fp:
+            assert_equal(fp.read(), content)
+
+    # An interrupted publication is completed from its journal.
+    os.makedirs(os.path.join(staging, 'dir'))
+    open(os.path.join(staging, 'dir', 'file'), 'w').close()
+    with open(journal, 'w') as fp:
+        fp.write('{"staging": "staging", '
+                 '"renames": [["staging/dir", "dir"], ["staging/x", "x"]]}')
+    http_fetcher._complete_publish(journal, verbose=0)
+    assert_true(os.path.exists(os.path.join(parent, 'dir', 'file')))
+    assert_false(os.path.exists(staging))
+    assert_false(os.path.exists(journal))
+    shutil.rmtree(parent)
+
+
+def test_rename_over_concurrent_dir():
+    parent = mkdtemp()
+    src, dst = os.path.join(parent, 'src'), os.path.join(parent, 'dst')
+    os.makedirs(src)
+    open(os.path.join(src, 'file'), 'w').close()
+    rename = os.rename
+
+    def publish_then_rename(*args):
+        # A concurrent fetch publishes dst after it was checked.
+        os.rename = rename
+        os.makedirs(dst)
+        open(os.path.join(dst, 'other'), 'w').close()
+        rename(*args)
+
+    os.rename = publish_then_rename
+    try:
+        http_fetcher._rename_over(src, dst)
+    finally:
+        os.rename = rename
+    assert_equal(sorted(os.listdir(dst)), ['file', 'other'])
+    shutil.rmtree(parent)
+
+
+def test_mirrors():
+    mirrors = [('http://a.org/data/', 'file:///mirror/a/'),
+               ('http://a.org/', 'http://lan/a/')]
+    assert_equal(fetchers.rewrite_url('http://a.org/data/f.tgz', mirrors),
+                 'file:///mirror/a/f.tgz')
+    assert_equal(fetchers.rewrite_url('http://a.org/f.tgz', mirrors),
+                 'http://lan/a/f.tgz')
+    assert_equal(fetchers.rewrite_url('http://b.org/f.tgz', mirrors),
+                 'http://b.org/f.tgz')
+
+    os.environ['NIDATA_MIRRORS'] = 'http://a.org/=http://lan/a/;' \
+                                   'http://a.org/data/=file:///mirror/a/'
+    try:
+        assert_equal(fetchers.get_mirrors(), [tuple(m) for m in mirrors])
+    finally:
+        os.environ.pop('NIDATA_MIRRORS')
+
+    # A mirror of a data directory serves the fetched files, and the
+    # archives of extracted (e.g. directory) targets.
+    fetcher = fetchers.Fetcher(data_dir=os.path.join('nidata', 'ds'))
+    files = fetcher.apply_mirrors(
+        [(os.path.join('sub', 'f.nii'), 'http://a.org/f.nii', {}),
+         ('ds052', 'http://a.org/tarballs/ds052_raw.tgz?x=1',
+          {'uncompress': True, 'md5sum': 'x'}),
+         ('ds031', 'http://b.org/ds031.tgz', {'uncompress': True})],
+        mirrors=[('*', 'http://lan:8000/'), ('http://b.org/', 'http://c/')])
+    assert_equal(files, [(os.path.join('sub', 'f.nii'),
+                          'http://lan:8000/ds/sub/f.nii',
+                          {'keep_path': True}),
+                         ('ds052', 'http://lan:8000/ds/ds052_raw.tgz',
+                          {'uncompress': True, 'md5sum': 'x'}),
+                         ('ds031', 'http://c/ds031.tgz',
+                          {'uncompress': True})])
+
+
+def test_mirror_server_roots():
+    import threading
+    from nidata.core.fetchers import mirror_server
+    roots = [mkdtemp(), mkdtemp()]
+    try:
+        for root, name in zip(roots, ('f', 'g')):
+            os.makedirs(os.path.join(root, 'ds'))
+            with open(os.path.join(root, 'ds', name), 'w') as fp:
+                fp.write(name)
+        # Several directories, as in NIDATA_PATH
+        server = mirror_server.MirrorServer(os.pathsep.join(roots),
+                                            host='localhost', port=0,
+                                            verbose=0)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            for name in ('f', 'g'):
+                response = compat._urllib.request.urlopen(
+                    '%s/ds/%s' % (server.url, name))
+                assert_equal(response.read(), name.encode('ascii'))
+                response.close()
+            assert_raises(compat._urllib.error.HTTPError,
+                          compat._urllib.request.urlopen,
+                          server.url + '/ds')
+        finally:
+            server.shutdown()
+            server.server_close()
+    finally:
+        for root in roots:
+            shutil.rmtree(root)
+
+
+
+def test_profiling():
+    from nidata.core._utils import profiling
+
+    def fetch(verbose=0):
+        with profiling.phase('download'):
+            with profiling.phase('checksum'):
+                pass
+            profiling.count('files_downloaded', 2)
+        return 'done'
+
+    profiling.enable()
+    try:
+        init_report = profiling.Report('init')
+        init_report.times['get_dataset_dir'] = 1.
+        init_report.calls['get_dataset_dir'] = 1
+        profiled = profiling.profiled(fetch, 'ds.fetch',
+                                      init_report=init_report, verbose=0)
+        assert_equal(profiled(), 'done')
+        report = profiling.get_last_report()
+        assert_equal(report.label, 'ds.fetch')
+        assert_equal(sorted(report.times),
+                     ['ds.fetch', 'ds.fetch/download',
+                      'ds.fetch/download/checksum', 'get_dataset_dir'])
+        assert_equal(report.counts['files_downloaded'], 2)
+        # The construction is only reported with the first call.
+        profiled()
+        assert_false('get_dataset_dir' in profiling.get_last_report().times)
+    finally:
+        profiling.disable()
+    assert_true(profiling.phase('download') is profiling._NULL_PHASE)
+
+
+def test_profiling_threads():
+    import threading
+    from multiprocessing.pool import ThreadPool
+    from nidata.core._utils import profiling
+    from nidata.core.objdep import DependenciesMeta
+
+    pool = ThreadPool(2)
+    entered, both_entered = [], threading.Event()
+
+    def fetch_file(name):
+        with profiling.phase('download'):
+            profiling.count(name)
+            # Both downloads run at the same time
+            entered.append(name)
+            if len(entered) == 2:
+                both_entered.set()
+            both_entered.wait(5)
+
+    def fetch(name):
+        with profiling.collect(name) as report:
+            with profiling.phase('fetch'):
+                pool.apply_async(profiling.propagate(fetch_file),
+                                 (name, )).get()
+        return report
+
+    def init(self):
+        pass
+    Probed = DependenciesMeta('Probed', (object, ), {'__init__': init})
+
+    profiling.enable()
+    try:
+        # Concurrent fetches (sharing worker threads) keep their reports.
+        datasets = ThreadPool(2)
+        results = [datasets.apply_async(fetch, (name, ))
+                   for name in ('a', 'b')]
+        for name, result in zip(('a', 'b'), results):
+            report = result.get()
+            assert_equal(dict(report.counts), {name: 1})
+            assert_equal(sorted(report.times), ['fetch', 'fetch/download'])
+        datasets.close()
+
+        with profiling.collect('init') as report:
+            Probed()
+        assert_equal(list(report.times), ['dependencies'])
+    finally:
+        profiling.disable()
+        pool.close()
+
+
+def test_fetch_synthetic_files():
+    from nidata.core.fetchers.synthetic import fetch_synthetic_files
+    dtemp = mkdtemp()
+    specs = {'*.csv': dict(n_rows=5, columns=[('a', [1]), ('b', (0., 1.))])}
+    files = fetch_synthetic_files(
+        dtemp, [('sub1/rest.nii.gz', 'http://a.org/a.tgz', {}),
+                ('pheno.csv', 'http://a.org/pheno.csv', {}),
+                ('rois.1D', 'http://a.org/rois.1D', {})],
+        scale=1e-3, specs=specs)
+    assert_equal(len(nibabel.load(files[0]).shape), 4)
+    pheno = np.recfromcsv(files[1])
+    assert_equal(len(pheno), 5)
+    assert_true(np.all(pheno['a'] == 1))
+    assert_equal(np.loadtxt(files[2]).ndim, 2)
+    shutil.rmtree(dtemp)
+
+
+def test_fetch_synthetic_archives():
+    from nidata.core.fetchers.synthetic import fetch_synthetic_files
+    dtemp = mkdtemp()
+    specs = {'*.csv': dict(n_rows=5, columns=[('a', [1])]),
+             'ds052': dict(members=['ds052/sub001/BOLD/bold.nii.gz',
+                                    'ds052/task_key.txt'])}
+    opts = {'uncompress': True}
+    files = fetch_synthetic_files(
+        dtemp, [('pheno.csv', 'http://a.org/pheno.tgz', opts),
+                (os.path.join('ds031', 'ses105'), 'http://a.org/s.zip', opts),
+                ('ds052', 'http://a.org/get?ds=052', opts),
+                (os.path.join('atlases', 'labels.xml'), 'http://a.org/a.tgz',
+                 opts)],
+        scale=1e-3, specs=specs)
+    # Extracted members, with their specs
+    assert_equal(len(np.recfromcsv(files[0])), 5)
+    assert_equal(len(os.listdir(files[1])), 4)
+    nibabel.load(os.path.join(files[1], 'img00.nii.gz'))
+    assert_equal(len(nibabel.load(os.path.join(
+        files[2], 'sub001', 'BOLD', 'bold.nii.gz')).shape), 4)
+    assert_true(os.path.exists(os.path.join(files[2], 'task_key.txt')))
+    # Targets with an extension are files
+    assert_true(os.path.isfile(files[3]))
+    # Archives are removed
+    assert_equal(sorted(os.listdir(dtemp)),
+                 ['atlases', 'ds031', 'ds052', 'pheno.csv'])
+    shutil.rmtree(dtemp)
+
+
+def test_synthetic_datasets():
+    from nidata.core.datasets import get_dataset_classes
+    from nidata.core.fetchers.synthetic import make_synthetic_dataset
+    # The hyperalignment data are read with the bundled pymvpa, which is
+    # python 2 only.
+    skipped = ['HaxbyEtal2011Dataset'] if sys.version_info[0] > 2 else []
+    for name, dataset_class in sorted(get_dataset_classes().items()):
+        if name in skipped:
+            continue
+        dtemp = mkdtemp()
+        try:
+            make_synthetic_dataset(dataset_class, data_dir=dtemp, scale=1e-3,
+                                   verbose=0)
+        finally:
+            shutil.rmtree(dtemp)
+
+
 def test_filter_columns():
     # Create fake recarray
     value1 = np.arange(500)
@@ -286,7 +684,7 @@ def test_uncompress():
     ztemp = os.path.join(dtemp, 'test.zip')
     with contextlib.closing(zipfile.ZipFile(ztemp, 'w')) as testzip:
         testzip.write(temp)
-    fetchers._uncompress_file(ztemp, verbose=0)
+    http_fetcher._uncompress_file(ztemp, verbose=0)
     assert(os.path.exists(os.path.join(dtemp, temp)))
     shutil.rmtree(dtemp)
 
@@ -294,7 +692,7 @@ def test_uncompress():
     ztemp = os.path.join(dtemp, 'test.tar')
     with contextlib.closing(tarfile.open(ztemp, 'w')) as tar:
         tar.add(temp)
-    fetchers._uncompress_file(ztemp, verbose=0)
+    http_fetcher._uncompress_file(ztemp, verbose=0)
     assert(os.path.exists(os.path.join(dtemp, temp)))
     shutil.rmtree(dtemp)
 
@@ -302,8 +700,36 @@ def test_uncompress():
     ztemp = os.path.join(dtemp, 'test.gz')
     f = gzip.open(ztemp, 'wb')
     f.close()
-    fetchers._uncompress_file(ztemp, verbose=0)
+    http_fetcher._uncompress_file(ztemp, verbose=0)
     assert(os.path.exists(os.path.join(dtemp, temp)))
     shutil.rmtree(dtemp)
 
+    # The uncompressed file of a .gz is kept
+    dtemp = mkdtemp()
+    ztemp = os.path.join(dtemp, 'test.txt.gz')
+    with contextlib.closing(gzip.open(ztemp, 'wb')) as f:
+        f.write(b'abc')
+    http_fetcher._uncompress_file(ztemp, verbose=0)
+    assert_equal(os.listdir(dtemp), ['test.txt'])
+    shutil.rmtree(dtemp)
+
+    # A deleted archive leaves no memoized checksum behind
+    dtemp = mkdtemp()
+    ztemp = os.path.join(dtemp, 'test.txt.gz')
+    with contextlib.closing(gzip.open(ztemp, 'wb')) as f:
+        f.write(b'abc')
+    fetchers.cached_md5_sum_file(ztemp)
+    http_fetcher._uncompress_file(ztemp, verbose=0)
+    assert_equal(os.listdir(dtemp), ['test.txt'])
+    shutil.rmtree(dtemp)
+
+    # A kept .tgz leaves no intermediate .tar
+    dtemp = mkdtemp()
+    ztemp = os.path.join(dtemp, 'test.tgz')
+    with contextlib.closing(tarfile.open(ztemp, 'w:gz')) as tar:
+        tar.add(temp, 'test.txt')
+    http_fetcher._uncompress_file(ztemp, delete_archive=False, verbose=0)
+    assert_equal(sorted(os.listdir(dtemp)), ['test.tgz', 'test.txt'])
+    shutil.rmtree(dtemp)
+
     os.remove(temp)
@@ -3,6 +3,8 @@ Functions for dynamically managing dependencies
 """
 import sys
 
+from ._utils.profiling import phase
+
 
 def install_dependency(module):
     import pip
@@ -16,27 +18,36 @@ def install_dependency(module):
         sys.argv = old_arg
 
 
+def get_missing_dependencies(cls):
+    missing_dependencies = []
+    for dep in getattr(cls, 'dependencies', []):
+        try:
+            __import__(dep)
+        except ImportError as ie:
+            print('Import error: %s' % str(ie))
+            missing_dependencies.append(dep)
+    return missing_dependencies
+
+
+def install_missing_dependencies(cls):
+    with phase('dependencies'):
+        for dep in get_missing_dependencies(cls):
+            print("Installing missing dependencies '%s', for %s" % (dep, str(cls)))
+            if not install_dependency(dep):
+                raise Exception("Failed to install dependency '%s'; you will need to install it manually and re-run your code." % dep)
+
+
 class DependenciesMeta(type):
-    def __new__(cls, name, parents, props):
-        def get_missing_dependencies(cls):
-            missing_dependencies = []
-            for dep in getattr(cls, 'dependencies', []):
-                try:
-                    __import__(dep)
-                except ImportError as ie:
-                    print('Import error: %s' % str(ie))
-                    missing_dependencies.append(dep)
-            return missing_dependencies
-
-        def install_missing_dependencies(cls):
-            for dep in get_missing_dependencies(cls):
-                print("Installing missing dependencies '%s', for %s" % (dep, str(cls)))
-                if not install_dependency(dep):
-                    raise Exception("Failed to install dependency '%s'; you will need to install it manually and re-run your code." % dep)
+    """Install the missing dependencies of a class when it is instantiated.
 
+    Classes setting check_dependencies_on_init to False call
+    install_missing_dependencies themselves.
+    """
+    def __new__(cls, name, parents, props):
         def __init__wrapper(init_fn):
             def wrapper_fn(self, *args, **kwargs):
-                install_missing_dependencies(self.__class__)
+                if getattr(self, 'check_dependencies_on_init', True):
+                    install_missing_dependencies(self.__class__)
                 return init_fn(self, *args, **kwargs)
             return wrapper_fn
 
@@ -0,0 +1,28 @@
+"""
+ISBI 2013 HARDI reconstruction challenge phantom.
+"""
+from sklearn.datasets.base import Bunch
+
+from ...core.datasets import HttpDataset
+
+
+class Isbi2013Dataset(HttpDataset):
+    """Download a 2-shell software phantom dataset (20MB).
+
+    Returns
+    -------
+    data: sklearn.datasets.base.Bunch
+        Dictionary-like object, keys are 'dwi', 'bvals' and 'bvecs'.
+    """
+    def fetch(self, resume=True, force=False, verbose=1):
+        url = 'https://dl.dropboxusercontent.com/u/2481924/isbi2013_merlet/'
+        files = [('2shells-1500-2500-N64-SNR-30.nii.gz',
+                  {'md5sum': '42911a70f232321cf246315192d69c42'}),
+                 ('2shells-1500-2500-N64.bval',
+                  {'md5sum': '90e8cf66e0f4d9737a3b3c0da24df5ea'}),
+                 ('2shells-1500-2500-N64.bvec',
+                  {'md5sum': '4b7aa2757a1ccab140667b76e8075cb1'})]
+        files = self.fetcher.fetch([(f, url + f, opts) for f, opts in files],
+                                   resume=resume, force=force,
+                                   verbose=verbose)
+        return Bunch(dwi=files[0], bvals=files[1], bvecs=files[2])
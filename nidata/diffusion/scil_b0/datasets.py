@@ -0,0 +1,34 @@
+"""
+b=0 images from multiple MR systems, from the SCIL.
+"""
+import os
+
+from sklearn.datasets.base import Bunch
+
+from ...core.datasets import HttpDataset
+
+
+class ScilB0Dataset(HttpDataset):
+    """Download b=0 datasets from multiple MR systems (GE, Philips, Siemens)
+    and different magnetic fields (1.5T and 3T) (9.2MB).
+
+    Returns
+    -------
+    data: sklearn.datasets.base.Bunch
+        Dictionary-like object, keys are:
+        - 'ge_3t': path to the GE 3T b=0 image
+        - 'siemens_1_5t': path to the Siemens 1.5T b=0 image
+        - 'root': directory holding the images of all the systems
+    """
+    def fetch(self, resume=True, force=False, verbose=1):
+        url = ('http://scil.dinf.usherbrooke.ca/wp-content/data/'
+               'datasets_multi-site_all_companies.zip')
+        opts = {'uncompress': True}
+        root = 'datasets_multi-site_all_companies'
+        files = [(root, url, opts),
+                 (os.path.join(root, '3T', 'GE', 'b0.nii.gz'), url, opts),
+                 (os.path.join(root, '1.5T', 'Siemens', 'b0.nii.gz'), url,
+                  opts)]
+        files = self.fetcher.fetch(files, resume=resume, force=force,
+                                   verbose=verbose)
+        return Bunch(root=files[0], ge_3t=files[1], siemens_1_5t=files[2])
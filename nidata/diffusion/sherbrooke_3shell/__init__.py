@@ -0,0 +1 @@
+from .datasets import *
@@ -0,0 +1,28 @@
+"""
+Sherbrooke 3-shell HARDI dataset.
+"""
+from sklearn.datasets.base import Bunch
+
+from ...core.datasets import HttpDataset
+
+
+class Sherbrooke3ShellDataset(HttpDataset):
+    """Download a 3-shell HARDI dataset with 193 gradient directions (184MB).
+
+    Returns
+    -------
+    data: sklearn.datasets.base.Bunch
+        Dictionary-like object, keys are 'dwi', 'bvals' and 'bvecs'.
+    """
+    def fetch(self, resume=True, force=False, verbose=1):
+        url = 'https://dl.dropboxusercontent.com/u/2481924/sherbrooke_data/'
+        files = [('3shells-1000-2000-3500-N193.nii.gz',
+                  {'md5sum': '0b735e8f16695a37bfbd66aab136eb66'}),
+                 ('3shells-1000-2000-3500-N193.bval',
+                  {'md5sum': 'e9b9bb56252503ea49d31fb30a0ac637'}),
+                 ('3shells-1000-2000-3500-N193.bvec',
+                  {'md5sum': '0c83f7e8b917cd677ad58a078658ebb7'})]
+        files = self.fetcher.fetch([(f, url + f, opts) for f, opts in files],
+                                   resume=resume, force=force,
+                                   verbose=verbose)
+        return Bunch(dwi=files[0], bvals=files[1], bvecs=files[2])
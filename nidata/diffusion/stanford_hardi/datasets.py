@@ -0,0 +1,60 @@
+"""
+Stanford HARDI dataset, with its anatomical data.
+"""
+from sklearn.datasets.base import Bunch
+
+from ...core.datasets import HttpDataset
+
+
+class StanfordHardiDataset(HttpDataset):
+    """Download the Stanford HARDI dataset (160 gradient directions).
+
+    Parameters
+    ----------
+    data_types: list of string, optional
+        Parts of the dataset to fetch, among 'dwi' (diffusion images and
+        gradient table, 87MB), 'labels' (reduced FreeSurfer aparc image),
+        't1' and 'pve' (partial volume maps). Default: all.
+
+    Returns
+    -------
+    data: sklearn.datasets.base.Bunch
+        Dictionary-like object, keys are:
+        - 'dwi', 'bvals', 'bvecs': paths to the diffusion data
+        - 'labels', 'label_info': paths to the label image and its labels
+        - 't1': path to the T1 image
+        - 'pve_csf', 'pve_gm', 'pve_wm': paths to the partial volume maps
+        Only the keys of the requested data types are present.
+    """
+    base_url = 'https://stacks.stanford.edu/file/druid:yx282xq2090/'
+    files = dict(
+        dwi=[('dwi', 'dwi.nii.gz', '0b18513b46132b4d1051ed3364f2acbc'),
+             ('bvals', 'dwi.bvals', '4e08ee9e2b1d2ec3fddb68c70ae23c36'),
+             ('bvecs', 'dwi.bvecs', '4c63a586f29afc6a48a5809524a76cb4')],
+        labels=[('labels', 'aparc-reduced.nii.gz',
+                 '742de90090d06e687ce486f680f6d71a'),
+                ('label_info', 'label_info.txt',
+                 '39db9f0f5e173d7a2c2e51b07d5d711b')],
+        t1=[('t1', 't1.nii.gz', 'a6a140da6a947d4131b2368752951b0a')],
+        pve=[('pve_csf', 'pve_csf.nii.gz', '2c498e4fed32bca7f726e28aa86e9c18'),
+             ('pve_gm', 'pve_gm.nii.gz', '1654b20aeb35fc2734a0d7928b713874'),
+             ('pve_wm', 'pve_wm.nii.gz', '2e244983cf92aaf9f9d37bc7716b37d5')])
+
+    def fetch(self, data_types=None, resume=True, force=False, verbose=1):
+        if data_types is None:
+            data_types = ['dwi', 'labels', 't1', 'pve']
+
+        keys = []
+        files = []
+        for data_type in data_types:
+            if data_type not in self.files:
+                raise ValueError("Unknown data type '%s'. Valid types are: "
+                                 "%s" % (data_type, sorted(self.files)))
+            for key, filename, md5sum in self.files[data_type]:
+                keys.append(key)
+                files.append((filename, self.base_url + filename,
+                              {'md5sum': md5sum}))
+
+        files = self.fetcher.fetch(files, resume=resume, force=force,
+                                   verbose=verbose)
+        return Bunch(**dict(zip(keys, files)))
@@ -0,0 +1,24 @@
+"""
+T1 and b0 volumes of a single session, used to test registration.
+"""
+from sklearn.datasets.base import Bunch
+
+from ...core.datasets import HttpDataset
+
+
+class SynTestDataset(HttpDataset):
+    """Download t1 and b0 volumes from the same session (12MB).
+
+    Returns
+    -------
+    data: sklearn.datasets.base.Bunch
+        Dictionary-like object, keys are 't1' and 'b0'.
+    """
+    def fetch(self, resume=True, force=False, verbose=1):
+        url = 'https://dl.dropboxusercontent.com/u/5918983/'
+        files = [('t1.nii.gz', {'md5sum': '701bda02bb769655c7d4a9b1df2b73a6'}),
+                 ('b0.nii.gz', {'md5sum': 'e4b741f0c77b6039e67abb2885c97a78'})]
+        files = self.fetcher.fetch([(f, url + f, opts) for f, opts in files],
+                                   resume=resume, force=force,
+                                   verbose=verbose)
+        return Bunch(t1=files[0], b0=files[1])
@@ -0,0 +1,35 @@
+"""
+Taiwan NTU diffusion spectrum imaging dataset.
+"""
+from sklearn.datasets.base import Bunch
+
+from ...core.datasets import HttpDataset
+
+
+class TaiwanNtuDsiDataset(HttpDataset):
+    """Download a DSI dataset with 203 gradient directions (91MB).
+
+    See the 'license' file for the license of the data. For the complete
+    datasets please visit http://dsi-studio.labsolver.org
+
+    Returns
+    -------
+    data: sklearn.datasets.base.Bunch
+        Dictionary-like object, keys are 'dwi', 'bvals', 'bvecs' and
+        'license'.
+    """
+    def fetch(self, resume=True, force=False, verbose=1):
+        url = 'http://dl.dropbox.com/u/2481924/'
+        files = [('taiwan_ntu_dsi.nii.gz',
+                  {'md5sum': '950408c0980a7154cb188666a885a91f'}),
+                 ('tawian_ntu_dsi.bval',
+                  {'md5sum': '602e5cb5fad2e7163e8025011d8a6755'}),
+                 ('taiwan_ntu_dsi.bvec',
+                  {'md5sum': 'a95eb1be44748c20214dc7aa654f9e6b'}),
+                 ('license_taiwan_ntu_dsi.txt',
+                  {'md5sum': '7fa1d5e272533e832cc7453eeba23f44'})]
+        files = self.fetcher.fetch([(f, url + f, opts) for f, opts in files],
+                                   resume=resume, force=force,
+                                   verbose=verbose)
+        return Bunch(dwi=files[0], bvals=files[1], bvecs=files[2],
+                     license=files[3])
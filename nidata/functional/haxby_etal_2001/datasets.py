@@ -11,6 +11,10 @@ from sklearn.datasets.base import Bunch
 
 from ...core.datasets import HttpDataset
 from ...core.fetchers import readmd5_sum_file
+from ...core.fetchers.synthetic import make_csv
+
+_HAXBY_LABELS = ['rest', 'face', 'house', 'cat', 'bottle', 'scissors', 'shoe',
+                 'chair', 'scrambledpix']
 
 
 class Haxby2001Dataset(HttpDataset):
@@ -43,6 +47,23 @@ class Haxby2001Dataset(HttpDataset):
         'mask_house_little': string list. Paths to nifti ventral temporal
         mask file.
     """
+    # Targets and sessions of the 1452 volumes of a subject, and no
+    # checksums, as synthetic archives differ from the real ones.
+    synthetic_specs = {
+        'labels.txt': dict(generator=make_csv, delimiter=' ', n_rows=1452,
+                           columns=[('labels', _HAXBY_LABELS),
+                                    ('chunks', lambda i, rng: i // 121)]),
+        'attributes.txt': dict(generator=make_csv, delimiter=' ',
+                               header=False, n_rows=1452, columns=[
+                                   ('labels', (0, 8)),
+                                   ('chunks', lambda i, rng: i // 121)]),
+        'attributes_literal.txt': dict(generator=make_csv, delimiter=' ',
+                                       header=False, n_rows=1452, columns=[
+                                           ('labels', _HAXBY_LABELS),
+                                           ('chunks',
+                                            lambda i, rng: i // 121)]),
+        'MD5SUMS': dict(generator=make_csv, n_rows=0, header=False)}
+
     def __init__(self, data_dir=None, simple=False):
         super(Haxby2001Dataset, self).__init__(data_dir=data_dir)
         self.simple = simple
@@ -13,18 +13,98 @@ import pandas as pd
 import numpy as np
 from matplotlib import pyplot as plt  # we need to call plt.show()
 from sklearn.datasets.base import Bunch
+from sklearn.externals.joblib import Parallel, delayed
 
 import nibabel
 import nipy.modalities.fmri.design_matrix as dm
-from nilearn.image import index_img
 from nilearn.masking import compute_epi_mask
 from nipy.modalities.fmri.glm import FMRILinearModel
 from nipy.modalities.fmri.experimental_paradigm import EventRelatedParadigm
 
 from ...core.datasets import HttpDataset
+from ...core.fetchers import md5_sum_file
+from ...core._utils.cache_mixin import cache
+from ...core._utils.fileio import atomic_filename
 from openfmri2bids.converter import convert
 
 
+def _get_beta_filepath(func_file, cond):
+    return func_file.replace('_bold.nii.gz', '_beta-%s.nii.gz' % cond)
+
+
+def _make_design_matrix(n_scans, tr, conditions, onsets):
+    frametimes = np.linspace(0, (n_scans - 1) * tr, n_scans)
+    paradigm = EventRelatedParadigm(conditions, onsets)
+    design_mat = dm.make_dmtx(frametimes, paradigm, drift_model='cosine',
+                              hfcut=n_scans, hrf_model='canonical')
+    return design_mat.matrix
+
+
+def _compute_epi_mask(func_file, func_md5):
+    # func_md5 is the cache key; func_file is ignored when hashing.
+    return compute_epi_mask(func_file)
+
+
+def _preprocess_run(func_file, cache_dir, verbose=1):
+    """Compute (or reuse) the beta maps of a single functional run."""
+    cond_file = func_file.replace('_bold.nii.gz', '_events.tsv')
+    cond_data = pd.read_csv(cond_file, sep='\t',
+                            usecols=['onset', 'duration', 'trial_type'])
+
+    # Get condition info, to search if betas have been done.
+    conditions = cond_data['trial_type'].tolist()
+    all_conds = np.unique(conditions)
+    all_beta_files = [_get_beta_filepath(func_file, cond)
+                      for cond in all_conds]
+    # All betas are done.
+    if np.all([os.path.exists(f) for f in all_beta_files]):
+        return all_beta_files
+
+    if verbose > 0:
+        print('Preprocessing file %s' % func_file)
+
+    # Need to do regression.
+    tr = cond_data['duration'].values.mean()
+    onsets = cond_data['onset'].tolist()
+
+    img = nibabel.load(func_file)
+    n_scans = img.shape[3]
+
+    # Design matrices and masks are keyed by content, so identical
+    # paradigms and re-downloaded runs hit the cache.
+    design_mat = cache(_make_design_matrix, cache_dir,
+                       func_memory_level=1, memory_level=1)(
+        n_scans, tr, conditions, onsets)
+    mask_img = cache(_compute_epi_mask, cache_dir, func_memory_level=1,
+                     memory_level=1, ignore=['func_file'])(
+        func_file, md5_sum_file(func_file))
+
+    # Do the GLM
+    fmri_glm = FMRILinearModel(img, design_mat, mask=mask_img)
+    fmri_glm.fit(do_scaling=True, model='ar1')
+
+    # Pull out the betas
+    beta_hat = fmri_glm.glms[0].get_beta()  # Least-squares estimates of the beta
+    mask = fmri_glm.mask.get_data() > 0
+
+    # output beta images
+    dim = design_mat.shape[1]
+    beta_map = np.tile(mask.astype(np.float)[..., np.newaxis], dim)
+    beta_map[mask] = beta_hat.T
+
+    # Save beta images; each one is published atomically so that a
+    # killed job never leaves a truncated beta behind.
+    for ci, beta_filepath in enumerate(all_beta_files):
+        beta_cond_img = nibabel.Nifti1Image(beta_map[..., ci],
+                                            fmri_glm.affine)
+        beta_cond_img.get_header()['descrip'] = (
+            'Parameter estimates of the localizer dataset')
+        with atomic_filename(beta_filepath) as tmp_filepath:
+            nibabel.save(beta_cond_img, tmp_filepath)
+
+    return all_beta_files
+
+
 class OpenFMriDataset(HttpDataset):
     @staticmethod
     def get_subj_from_path(pth):
@@ -50,72 +130,26 @@ class OpenFMriDataset(HttpDataset):
         else:
             return match.groups()[0]
 
-    def preprocess_files(self, func_files, anat_files=None, verbose=1):
-        def get_beta_filepath(func_file, cond):
-            return func_file.replace('_bold.nii.gz', '_beta-%s.nii.gz' % cond)
-
-        beta_files = []
-        for fi, func_file in enumerate(func_files):
-            # Don't re-do preprocessing.
-            beta_mask = func_file.replace('_bold.nii.gz', '_beta*.nii.gz')
-
-            cond_file = func_file.replace('_bold.nii.gz', '_events.tsv')
-            cond_data = pd.read_csv(cond_file, sep='\t')
-
-            # Get condition info, to search if betas have been done.
-            conditions = cond_data['trial_type'].tolist()
-            all_conds = np.unique(conditions)
-            all_beta_files = [get_beta_filepath(func_file, cond)
-                              for cond in all_conds]
-            # All betas are done.
-            if np.all([os.path.exists(f) for f in all_beta_files]):
-                beta_files += all_beta_files
-                continue
-
-            if verbose >= 0:
-                print('Preprocessing file %d of %d' % (fi + 1, len(func_files)))
-
-            # Need to do regression.
-            tr = cond_data['duration'].as_matrix().mean()
-            onsets = cond_data['onset'].tolist()
-
-            img = nibabel.load(func_file)
-            n_scans = img.shape[3]
-            frametimes = np.linspace(0, (n_scans - 1) * tr, n_scans)
-
-            # Create the design matrix
-            paradigm = EventRelatedParadigm(conditions, onsets)
-            design_mat = dm.make_dmtx(frametimes, paradigm, drift_model='cosine',
-                                      hfcut=n_scans, hrf_model='canonical')
-
-            # Do the GLM
-            mask_img = compute_epi_mask(img)
-            fmri_glm = FMRILinearModel(img, design_mat.matrix, mask=mask_img)
-            fmri_glm.fit(do_scaling=True, model='ar1')
-
-            # Pull out the betas
-            beta_hat = fmri_glm.glms[0].get_beta()  # Least-squares estimates of the beta
-            mask = fmri_glm.mask.get_data() > 0
-
-            # output beta images
-            dim = design_mat.matrix.shape[1]
-            beta_map = np.tile(mask.astype(np.float)[..., np.newaxis], dim)
-            beta_map[mask] = beta_hat.T
-            beta_image = nibabel.Nifti1Image(beta_map, fmri_glm.affine)
-            beta_image.get_header()['descrip'] = ('Parameter estimates of the localizer dataset')
-
-            # Save beta images
-            for ci, cond in enumerate(np.unique(conditions)):
-                beta_cond_img = index_img(beta_image, ci)
-                beta_filepath = get_beta_filepath(func_file, cond)
-                nibabel.save(beta_cond_img, beta_filepath)
-                beta_files.append(beta_filepath)
-
-        return beta_files
+    def preprocess_files(self, func_files, anat_files=None, n_jobs=1,
+                         verbose=1):
+        """Fit a GLM to each functional run and save one beta map per
+        condition next to the run.
+
+        Runs are independent and are processed in parallel over `n_jobs`
+        processes. Design matrices and EPI masks are cached on disk, keyed
+        by their content, and beta maps are written atomically, so an
+        interrupted call resumes with the runs that are not complete yet.
+        """
+        cache_dir = os.path.join(self.data_dir, 'cache')
+        beta_files = Parallel(n_jobs=n_jobs, verbose=max(verbose - 1, 0))(
+            delayed(_preprocess_run)(func_file, cache_dir=cache_dir,
+                                     verbose=verbose)
+            for func_file in func_files)
+        return [f for run_beta_files in beta_files for f in run_beta_files]
 
 class PoldrackEtal2001Dataset(OpenFMriDataset):
     def fetch(self, n_subjects=1, preprocess_data=True,
-              url=None, resume=True, force=False, verbose=1):
+              url=None, resume=True, force=False, n_jobs=1, verbose=1):
 
         # Prep the URLs
         if not os.path.exists(os.path.join(self.data_dir, 'ds052_BIDS')):
@@ -124,10 +158,11 @@ class PoldrackEtal2001Dataset(OpenFMriDataset):
             files = [('ds052', url, opts)]
             files = self.fetcher.fetch(files, resume=resume, force=force, verbose=verbose)
 
-            # Move around the files to BIDS format.
+            # Move around the files to BIDS format. Hard links don't copy
+            # the images and stay valid if the data directory is moved.
             convert(source_dir=os.path.join(self.data_dir, 'ds052'),
                     dest_dir=os.path.join(self.data_dir, 'ds052_BIDS'),
-                    nii_handling='link')
+                    nii_handling='hardlink', n_jobs=n_jobs)
 
 
         # Loop over subjects to extract files.
@@ -140,7 +175,8 @@ class PoldrackEtal2001Dataset(OpenFMriDataset):
             # if not (i == 2 and anat_file == 'highres002.nii.gz') and not i==11]
 
         if preprocess_data:
-            func_files = self.preprocess_files(func_files, anat_files=anat_files)
+            func_files = self.preprocess_files(func_files, anat_files=anat_files,
+                                               n_jobs=n_jobs, verbose=verbose)
             plt.show()
 
         # return the data
@@ -114,6 +114,9 @@ class BrainomicsDataset(HttpDataset):
     resume: bool
         Whether to resume download of a partly-downloaded file.
 
+    n_jobs: int
+        Number of files downloaded (and archives extracted) in parallel.
+
     verbose: int
         verbose level (0 means no message).
 
@@ -176,9 +179,19 @@ class BrainomicsDataset(HttpDataset):
         "button press vs calculation and sentence listening/reading":
             "auditory&visual motor vs cognitive processing"}
 
+    # Covariates of the 94 subjects, joined on their subject_id.
+    synthetic_specs = {
+        'cubicwebexport.csv': dict(n_rows=94, delimiter=';', columns=[
+            ('subject_id', lambda i, rng: 'S%02d' % (i + 1)),
+            ('age', (18, 45)),
+            ('sex', ['M', 'F'])]),
+        'cubicwebexport2.csv': dict(n_rows=94, delimiter=';', columns=[
+            ('subject_id', lambda i, rng: 'S%02d' % (i + 1)),
+            ('handedness', ['right', 'left', 'ambidextrous'])])}
+
     def fetch(self, contrasts=None, n_subjects=None, get_tmaps=False,
               get_masks=False, get_anats=False, url=None,
-              resume=True, force=False, verbose=1):
+              resume=True, force=False, n_jobs=1, verbose=1):
         if n_subjects is None:
             n_subjects = 94  # 94 subjects available
         if (n_subjects > 94) or (n_subjects < 1):
@@ -286,7 +299,8 @@ class BrainomicsDataset(HttpDataset):
                       ("cubicwebexport2.csv", url_csv2, {})]
 
         # Actual data fetching
-        files = self.fetcher.fetch(filenames, resume=resume, force=force, verbose=verbose)
+        files = self.fetcher.fetch(filenames, resume=resume, force=force,
+                                   n_jobs=n_jobs, verbose=verbose)
         anats = None
         masks = None
         tmaps = None
@@ -356,7 +370,8 @@ class BrainomicsDataset(HttpDataset):
 
 def fetch_localizer_contrasts(contrasts, n_subjects=None, get_tmaps=False,
                               get_masks=False, get_anats=False,
-                              data_dir=None, url=None, resume=True, verbose=1):
+                              data_dir=None, url=None, resume=True, n_jobs=1,
+                              verbose=1):
     return BrainomicsDataset(data_dir=data_dir).fetch(contrasts=contrasts,
                                                       n_subjects=n_subjects,
                                                       get_tmaps=get_tmaps,
@@ -364,4 +379,5 @@ def fetch_localizer_contrasts(contrasts, n_subjects=None, get_tmaps=False,
                                                       get_anats=get_anats,
                                                       url=url,
                                                       resume=resume,
+                                                      n_jobs=n_jobs,
                                                       verbose=verbose)
\ No newline at end of file
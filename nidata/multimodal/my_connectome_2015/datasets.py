@@ -4,6 +4,7 @@ A data loader utility for downloading fMRI data from OpenfMRI.org
 Adapted by: Alison Campbell
 """
 import glob
+import json
 import os
 from collections import defaultdict
 
@@ -11,11 +12,66 @@ from sklearn.datasets.base import Bunch
 
 from ...core.datasets import HttpDataset
 from ...core.fetchers import readmd5_sum_file
+from ...core._utils.compat import _basestring
+from ...core._utils.fileio import atomic_filename
+
+
+def _archives_signature(data_dir):
+    """Names, sizes and modification times of the downloaded archives."""
+    signature = []
+    for archive in sorted(glob.glob(os.path.join(data_dir, '*.tgz'))):
+        stat = os.stat(archive)
+        signature.append([os.path.basename(archive), stat.st_size,
+                          int(stat.st_mtime)])
+    return signature
+
+
+def _build_index(data_dir):
+    """Map session -> modality -> list of (image path, size); paths are
+    relative to data_dir."""
+    sessions = {}
+    subject_dir = os.path.join(data_dir, 'ds031', 'sub00001')
+    for session_path in glob.glob(os.path.join(subject_dir, 'ses*')):
+        session = {}
+        for data_type in os.listdir(session_path):
+            data_type_path = os.path.join(session_path, data_type)
+            if not os.path.isdir(data_type_path):
+                continue
+            session[data_type] = [
+                (os.path.relpath(os.path.join(data_type_path, f), data_dir),
+                 os.path.getsize(os.path.join(data_type_path, f)))
+                for f in sorted(os.listdir(data_type_path))
+                if f.endswith('.nii.gz')]
+        sessions[os.path.basename(session_path)] = session
+    return sessions
 
 
 class MyConnectome2015Dataset(HttpDataset):
 # class [A CLASS]([A SUPER CLASS]) 
 
+    def get_index(self, verbose=1):
+        """Return the index of the extracted images (session -> modality ->
+        list of (path, size)).
+
+        The index is stored in the dataset directory, and is only rebuilt
+        when the downloaded archives change.
+        """
+        index_file = os.path.join(self.data_dir, 'ds031_index.json')
+        signature = _archives_signature(self.data_dir)
+        if os.path.exists(index_file):
+            with open(index_file, 'r') as fp:
+                index = json.load(fp)
+            if index['archives'] == signature:
+                return index['sessions']
+
+        if verbose > 0:
+            print('Indexing %s' % os.path.join(self.data_dir, 'ds031'))
+        index = dict(archives=signature, sessions=_build_index(self.data_dir))
+        with atomic_filename(index_file) as tmp_file:
+            with open(tmp_file, 'w') as fp:
+                json.dump(index, fp)
+        return index['sessions']
+
     def fetch(self, data_types=None, session_ids=None,
               resume=True, force=False, verbose=1):
     		# before the fetcher, construct URLS to download
@@ -72,20 +128,17 @@ class MyConnectome2015Dataset(HttpDataset):
         self.fetcher.fetch(files, resume=resume, force=force, verbose=verbose, delete_archive=False)
         
         # Group the data according to modality.
+        session_names = set(session_id if isinstance(session_id, _basestring)
+                            else 'ses%03d' % session_id
+                            for session_id in session_ids)
         out_dict = defaultdict(lambda: [])
-        for session_path in glob.glob(os.path.join(self.data_dir, 'ds031', 'sub00001', 'ses*')):
-            session_dirname = os.path.basename(session_path)
-            if (session_dirname not in session_ids and
-                int(session_dirname[3:]) not in session_ids):
+        for session_dirname, session in sorted(self.get_index(verbose=verbose).items()):
+            if session_dirname not in session_names:
                 continue
 
             for data_type in data_types:
-                data_type_path = os.path.join(session_path, data_type)
-                if not os.path.exists(data_type_path):
-                    continue
-
-                for img_path in glob.glob(os.path.join(data_type_path, '*.nii.gz')):
-                    out_dict[data_type].append(img_path)
+                for img_path, _ in session.get(data_type, []):
+                    out_dict[data_type].append(os.path.join(self.data_dir, img_path))
 
         # return the data
         return Bunch(**dict(out_dict))
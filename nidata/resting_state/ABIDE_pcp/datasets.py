@@ -16,6 +16,11 @@ from ...core.datasets import HttpDataset
 from ...core.fetchers import filter_columns
 
 
+_ABIDE_SITES = ['CALTECH', 'CMU', 'KKI', 'LEUVEN_1', 'LEUVEN_2', 'MAX_MUN',
+                'NYU', 'OHSU', 'OLIN', 'PITT', 'SBL', 'SDSU', 'STANFORD',
+                'TRINITY', 'UCLA_1', 'UCLA_2', 'UM_1', 'UM_2', 'USM', 'YALE']
+
+
 class AbidePcpDataset(HttpDataset):
     """ Fetch ABIDE dataset
 
@@ -96,6 +101,26 @@ class AbidePcpDataset(HttpDataset):
     7 (2013).
     """
 
+    # Phenotypic file of the 1112 subjects, with the columns used below.
+    synthetic_specs = {
+        'Phenotypic_*.csv': dict(n_rows=1112, columns=[
+            ('', lambda i, rng: i),
+            ('SUB_ID', lambda i, rng: 50001 + i),
+            ('FILE_ID', lambda i, rng: '%s_%07d' % (
+                _ABIDE_SITES[i % len(_ABIDE_SITES)], 50001 + i)),
+            ('SITE_ID', lambda i, rng: _ABIDE_SITES[i % len(_ABIDE_SITES)]),
+            ('DX_GROUP', [1, 2]),
+            ('DSM_IV_TR', (0, 4)),
+            ('AGE_AT_SCAN', (6.47, 64.)),
+            ('SEX', [1, 2]),
+            ('HANDEDNESS_CATEGORY', ['R', 'L', 'Mixed', 'Ambi']),
+            ('HANDEDNESS_SCORE', (-100, 100)),
+            ('qc_rater_1', ['OK', 'OK', 'OK', 'fail']),
+            ('qc_anat_rater_2', ['OK', 'maybe']),
+            ('qc_func_rater_2', ['OK', 'maybe']),
+            ('qc_anat_rater_3', ['OK']),
+            ('qc_func_rater_3', ['OK'])])}
+
     def fetch(self, n_subjects=None, pipeline='cpac',
               band_pass_filtering=False, global_signal_regression=False,
               derivatives=['func_preproc'],
@@ -10,6 +10,14 @@ from sklearn.datasets.base import Bunch
 
 from ...core.datasets import HttpDataset
 
+_ADHD_IDS = ['0010042', '0010064', '0010128', '0021019', '0023008', '0023012',
+             '0027011', '0027018', '0027034', '0027037', '1019436', '1206380',
+             '1418396', '1517058', '1552181', '1562298', '1679142', '2014113',
+             '2497695', '2950754', '3007585', '3154996', '3205761', '3520880',
+             '3624598', '3699991', '3884955', '3902469', '3994098', '4016887',
+             '4046678', '4134561', '4164316', '4275075', '6115230', '7774305',
+             '8409791', '8697774', '9744150', '9750701']
+
 
 class AdhdRestDataset(HttpDataset):
     """Download and load the ADHD resting-state dataset.
@@ -24,6 +32,8 @@ class AdhdRestDataset(HttpDataset):
     url: string, optional
         Override download URL. Used for test only (or if you setup a mirror of
         the data).
+    n_jobs: int, optional
+        Number of subject archives downloaded and extracted in parallel.
     Returns
     -------
     data: sklearn.datasets.base.Bunch
@@ -36,19 +46,25 @@ class AdhdRestDataset(HttpDataset):
     :Download:
         ftp://www.nitrc.org/fcon_1000/htdocs/indi/adhd200/sites/ADHD200_40sub_preprocessed.tgz
       """
-    def fetch(self, n_subjects=None, url=None, resume=True, verbose=1):
+
+    # Phenotypic file of the 40 subjects, with the column used below.
+    synthetic_specs = {
+        'ADHD200_40subs_motion_parameters_and_phenotypics.csv': dict(
+            n_rows=len(_ADHD_IDS), columns=[
+                ('Subject', lambda i, rng: int(_ADHD_IDS[i])),
+                ('MeanFD', (0., .5)),
+                ('adhd', [0, 1]),
+                ('age', (7., 21.)),
+                ('sex', ['M', 'F'])])}
+
+    def fetch(self, n_subjects=None, url=None, resume=True, n_jobs=1,
+              verbose=1):
 
         if url is None:
             url = 'https://www.nitrc.org/frs/download.php/'
 
         # Preliminary checks and declarations
-        ids = ['0010042', '0010064', '0010128', '0021019', '0023008', '0023012',
-               '0027011', '0027018', '0027034', '0027037', '1019436', '1206380',
-               '1418396', '1517058', '1552181', '1562298', '1679142', '2014113',
-               '2497695', '2950754', '3007585', '3154996', '3205761', '3520880',
-               '3624598', '3699991', '3884955', '3902469', '3994098', '4016887',
-               '4046678', '4134561', '4164316', '4275075', '6115230', '7774305',
-               '8409791', '8697774', '9744150', '9750701']
+        ids = _ADHD_IDS
         nitrc_ids = range(7782, 7822)
         max_subjects = len(ids)
         if n_subjects is None:
@@ -87,18 +103,19 @@ class AdhdRestDataset(HttpDataset):
 
         functionals = self.fetcher.fetch(
             zip(functionals, archives, (opts,) * n_subjects),
-            resume=resume, verbose=verbose)
+            resume=resume, n_jobs=n_jobs, verbose=verbose)
 
         confounds = self.fetcher.fetch(
             zip(confounds, archives, (opts,) * n_subjects),
-            resume=resume, verbose=verbose)
+            resume=resume, n_jobs=n_jobs, verbose=verbose)
 
         return Bunch(func=functionals, confounds=confounds,
                      phenotypic=phenotypic)
 
 
 def fetch_adhd(n_subjects=None, data_dir=None, url=None, resume=True,
-               verbose=1):
+               n_jobs=1, verbose=1):
     return AdhdRestDataset(data_dir=data_dir).fetch(n_subjects=n_subjects,
                                                     url=url, resume=resume,
+                                                    n_jobs=n_jobs,
                                                     verbose=verbose)